@@ -0,0 +1,120 @@
+#
+# Button action runner.
+#
+# Bound commands run on a small pool of worker threads, off the radio
+# thread. A remote sends the same frame several times per press, so
+# a command for a button and state that was submitted less than a
+# debounce window ago is dropped. Only a limited number of commands per
+# button may run at once, and a command still running after its timeout
+# is killed, along with anything it started.
+#
+# When a command finishes, the done callback is called with the time it
+# spent waiting to start, how long it ran and its exit status (None if it
+# was killed).
+#
+
+import os
+import signal
+import subprocess
+import threading
+import time
+import concurrent.futures
+import syslog
+
+import log
+
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 30
+DEFAULT_DEBOUNCE = 1.0
+MAX_PER_BUTTON = 1
+# commands waiting for a worker; more than this and new ones are dropped
+MAX_PENDING = 32
+
+class ActionRunner:
+    def __init__(self, done_cb, workers=DEFAULT_WORKERS,
+                 timeout=DEFAULT_TIMEOUT, debounce=DEFAULT_DEBOUNCE,
+                 max_per_button=MAX_PER_BUTTON):
+        self.done_cb = done_cb
+        self.timeout = timeout
+        self.debounce = debounce
+        self.max_per_button = max_per_button
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self._lock = threading.Lock()
+        self._last = {}
+        self._active = {}
+        self._pending = 0
+        self._procs = set()
+        self._closed = False
+    def submit(self, name, state, action, device_id, unit_id):
+        now = time.monotonic()
+        with self._lock:
+            if self._closed:
+                return False
+            last = self._last.get((name, state))
+            self._last[(name, state)] = now
+            if last != None and now - last < self.debounce:
+                return False
+            if self._active.get(name, 0) >= self.max_per_button:
+                log.log(syslog.LOG_INFO, "Not running \"%s\"; button \"%s\" "
+                        "still has a command running.", action, name)
+                return False
+            if self._pending >= MAX_PENDING:
+                log.log(syslog.LOG_WARNING, "Not running \"%s\"; too many "
+                        "commands waiting.", action)
+                return False
+            self._active[name] = self._active.get(name, 0) + 1
+            self._pending += 1
+            self._expire(now)
+        self._pool.submit(self._run, name, action, device_id, unit_id, now)
+        return True
+    def _expire(self, now):
+        for key, last in list(self._last.items()):
+            if now - last >= self.debounce:
+                del self._last[key]
+    def _run(self, name, action, device_id, unit_id, submitted):
+        start = time.monotonic()
+        with self._lock:
+            self._pending -= 1
+        status = None
+        try:
+            syslog.syslog(syslog.LOG_INFO, "Running cmd \"%s\"." % action)
+            # a session of its own, so a timeout kills the whole command
+            # and not just the shell
+            proc = subprocess.Popen(action, shell=True, start_new_session=True,
+                                    stdin=subprocess.DEVNULL)
+            with self._lock:
+                self._procs.add(proc)
+            try:
+                status = proc.wait(self.timeout)
+            except subprocess.TimeoutExpired:
+                syslog.syslog(syslog.LOG_WARNING, "Cmd \"%s\" timed out after "
+                              "%d s; killing it." % (action, self.timeout))
+                kill(proc)
+            finally:
+                with self._lock:
+                    self._procs.discard(proc)
+        except OSError as e:
+            syslog.syslog(syslog.LOG_ERR, "Unable to run \"%s\": %s." %
+                          (action, e))
+        finally:
+            with self._lock:
+                self._active[name] -= 1
+                if self._active[name] == 0:
+                    del self._active[name]
+        end = time.monotonic()
+        self.done_cb(name, device_id, unit_id, start - submitted, end - start,
+                     status)
+    def close(self):
+        with self._lock:
+            self._closed = True
+            procs = list(self._procs)
+        for proc in procs:
+            kill(proc)
+        self._pool.shutdown(wait=True)
+
+def kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
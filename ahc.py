@@ -6,6 +6,7 @@ import getopt
 import jsonrpclib
 import os
 import time
+import shlex
 
 DEFAULT_HOST="localhost"
 DEFAULT_PORT=3444
@@ -18,8 +19,8 @@ def usage(name):
     print("%s [-s server] switch" % name)
     print("%s [-s server] switch get <device-id> <unit-id>" % name)
     print("%s [-s server] switch get <name>" % name)
-    print("%s [-s server] switch set <device-id> <unit-id> on|off" % name)
-    print("%s [-s server] switch set <name> on|off" % name)
+    print("%s [-s server] [-b] switch set <device-id> <unit-id> on|off" % name)
+    print("%s [-s server] [-b] switch set <name> on|off" % name)
     print("%s [-s server] switch set-name <device-id> <unit-id> <name>" % name)
     print("%s [-s server] switch del <name>" % name)
     print("%s [-s server] button" % name)
@@ -28,6 +29,23 @@ def usage(name):
     print("%s [-s server] button unbind <name> on|off" % name)
     print("%s [-s server] button del <name>" % name)
     print("%s [-s server] event" % name)
+    print("%s [-s server] event -f" % name)
+    print("%s [-s server] event last <count> [button|sensor-reading|switch-set|action|rule]" % name)
+    print("%s [-s server] history <from> <to> [<event-type>]" % name)
+    print("%s [-s server] schedule" % name)
+    print("%s [-s server] schedule add <time>|+<seconds> <switch-name> on|off [run|skip]" % name)
+    print("%s [-s server] schedule cancel <job-id>" % name)
+    print("%s [-s server] heater" % name)
+    print("%s [-s server] heater add <name> <sensor> <switch-name> <time> [daily]" % name)
+    print("%s [-s server] heater del <name>" % name)
+    print("%s [-s server] rule" % name)
+    print("%s [-s server] rule add <name> <rule>" % name)
+    print("%s [-s server] rule del <name>" % name)
+    print("%s [-s server] rule enable|disable <name>" % name)
+    print("%s [-s server] stats" % name)
+    print("%s [-s server] radio" % name)
+    print("%s [-s server] [-b] multi <cmd> [<cmd> ...]" % name)
+    print("%s [-s server] [-b] multi -" % name)
     print("%s -h" % name)
 
 def make_url(host, port):
@@ -95,7 +113,7 @@ def get_switch_cmd(server, device_id=None, unit_id=None, name=None):
         return 1
 
 def set_switch_cmd(server, state, device_id=None, unit_id=None, 
-                   name=None):
+                   name=None, bulk=False):
     if state == "on":
         state = 1
     elif state == "off":
@@ -104,13 +122,13 @@ def set_switch_cmd(server, state, device_id=None, unit_id=None,
         print('A switch is "on" or "off"')
         sys.exit(1)
     if name:
-        if server.set_switch_by_name(name, state):
+        if server.set_switch_by_name(name, state, bulk):
             return 0
         else:
             print('No switch "%s" exists.' % name)
             return 1
     else:
-        server.set_switch(int(device_id, 16), int(unit_id, 10), state)
+        server.set_switch(int(device_id, 16), int(unit_id, 10), state, bulk)
     return 0
 
 def set_switch_name_cmd(server, s_device_id, s_unit_id, s_name):
@@ -153,8 +171,8 @@ def unbind_button_cmd(server, b_name, b_state):
     server.bind_button(b_name, b_state, None)
     return 0
 
-def get_event_log_cmd(server):
-    for event in server.get_event_log():
+def print_events(events):
+    for event in events:
         (event_type, event_time, device_id, unit_id, source_name, \
              event_value) = event
         if not source_name:
@@ -169,6 +187,248 @@ def get_event_log_cmd(server):
         print("%s: %s \"%s\" [0x%x%s]%s" % (event_time_s, event_type,
                                              source_name, device_id,
                                              unit_id_s, value_s))
+
+def get_event_log_cmd(server):
+    print_events(server.get_event_log())
+    return 0
+
+FOLLOW_TIMEOUT = 30
+
+def follow_events_cmd(server):
+    cursor, lost, events = server.get_events_since(None)
+    try:
+        while True:
+            cursor, lost, events = server.get_events_since(cursor,
+                                                           FOLLOW_TIMEOUT)
+            if lost:
+                print("[%d events lost]" % lost)
+            print_events(events)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        return 0
+
+def last_events_cmd(server, count, event_type=None):
+    events = server.get_event_log(None, None, event_type, None, count, 0, True)
+    events.reverse()
+    print_events(events)
+    return 0
+
+# [YYYY-MM-DDT]HH:MM, local time; without a date it means today
+def parse_time(s):
+    try:
+        t = time.strptime(s, "%Y-%m-%dT%H:%M")
+    except ValueError:
+        t = time.strptime(s, "%H:%M")
+        now = time.localtime()
+        t = time.struct_time((now.tm_year, now.tm_mon, now.tm_mday, t.tm_hour,
+                              t.tm_min, 0, 0, 0, -1))
+    return time.mktime(t)
+
+def history_cmd(server, s_start, s_end, event_type=None):
+    try:
+        start = parse_time(s_start)
+        end = parse_time(s_end)
+    except ValueError:
+        print("Times are given as [YYYY-MM-DDT]HH:MM.")
+        return 1
+    events = server.get_history(start, end, event_type)
+    if events == None:
+        print("The server keeps no history.")
+        return 1
+    print_events(events)
+    return 0
+
+def on_off(s_state):
+    if s_state == "on":
+        return 1
+    elif s_state == "off":
+        return 0
+    raise ValueError('A switch is "on" or "off"')
+
+# the subset of commands that may go into a multi-call, as
+# [method, params] pairs
+def to_call(words, bulk):
+    n = len(words)
+    if n >= 2 and words[0] == "switch":
+        if words[1] == "set" and n == 5:
+            return [ "set_switch", [ int(words[2], 16), int(words[3], 10),
+                                     on_off(words[4]), bulk ] ]
+        elif words[1] == "set" and n == 4:
+            return [ "set_switch_by_name", [ words[2], on_off(words[3]),
+                                             bulk ] ]
+        elif words[1] == "set-name" and n == 5:
+            return [ "set_switch_name", [ int(words[2], 16),
+                                          int(words[3], 10), words[4] ] ]
+        elif words[1] == "del" and n == 3:
+            return [ "del_switch", [ words[2] ] ]
+    elif n >= 2 and words[0] == "button":
+        if words[1] == "bind" and n == 5:
+            return [ "bind_button", [ words[2], words[3], words[4] ] ]
+        elif words[1] == "unbind" and n == 4:
+            return [ "bind_button", [ words[2], words[3], None ] ]
+        elif words[1] == "set-name" and n == 5:
+            return [ "set_button_name", [ int(words[2], 16),
+                                          int(words[3], 10), words[4] ] ]
+        elif words[1] == "del" and n == 3:
+            return [ "del_button", [ words[2] ] ]
+    elif n >= 2 and words[0] == "temp":
+        if words[1] == "set-name" and n == 4:
+            return [ "set_temp_sensor_name", [ int(words[2]), words[3] ] ]
+        elif words[1] == "del" and n == 3:
+            return [ "del_temp_sensor", [ int(words[2]) ] ]
+    raise ValueError("Command can't be part of a multi-call.")
+
+def multi_cmd(server, cmds, bulk):
+    if cmds == [ "-" ]:
+        cmds = [ line for line in sys.stdin if line.strip() ]
+    calls = []
+    for cmd in cmds:
+        try:
+            calls.append(to_call(shlex.split(cmd), bulk))
+        except ValueError as e:
+            print('"%s": %s' % (cmd.strip(), e))
+            return 1
+    ecode = 0
+    for cmd, (ok, result) in zip(cmds, server.multicall(calls)):
+        # set_switch_by_name and del_switch report a missing switch as False
+        if not ok or result == False:
+            print('"%s" failed.' % cmd.strip())
+            ecode = 1
+    return ecode
+
+def ms(seconds):
+    return "%.3f ms" % (seconds * 1000)
+
+def histogram_str(h):
+    if h["count"] == 0:
+        return "0 calls"
+    return "%d calls, mean %s, p50 %s, p90 %s, p99 %s, max %s" % \
+        (h["count"], ms(h["mean"]), ms(h["p50"]), ms(h["p90"]), ms(h["p99"]),
+         ms(h["max"]))
+
+def print_stats(stats, indent=""):
+    for name in sorted(stats.keys()):
+        value = stats[name]
+        if isinstance(value, dict) and "count" in value:
+            print("%s%s: %s" % (indent, name, histogram_str(value)))
+        elif isinstance(value, dict):
+            print("%s%s:" % (indent, name))
+            print_stats(value, indent + "  ")
+        else:
+            print("%s%s: %s" % (indent, name, value))
+
+def stats_cmd(server):
+    print_stats(server.get_stats())
+    return 0
+
+def list_jobs_cmd(server):
+    for job_id, when, switch_name, state, missed in server.list_jobs():
+        print("Job %d: %s: switch \"%s\" %s (if missed: %s)" %
+              (job_id, time.ctime(when), switch_name, state_str(state),
+               missed))
+    return 0
+
+def add_job_cmd(server, j_when, j_switch_name, j_state, j_missed="run"):
+    try:
+        if j_when.startswith("+"):
+            when = time.time() + float(j_when[1:])
+        else:
+            when = parse_time(j_when)
+            if when < time.time() and "T" not in j_when:
+                # a time of day that has passed means tomorrow
+                when += 24*60*60
+    except ValueError:
+        print("Times are given as [YYYY-MM-DDT]HH:MM or +<seconds>.")
+        return 1
+    ok, result = server.add_job(when, j_switch_name, on_off(j_state),
+                                j_missed)
+    if not ok:
+        print(result)
+        return 1
+    print("Job %d at %s." % (result, time.ctime(when)))
+    return 0
+
+def cancel_job_cmd(server, j_job_id):
+    if not server.cancel_job(int(j_job_id)):
+        print("No job %s." % j_job_id)
+        return 1
+    return 0
+
+def list_heater_plans_cmd(server):
+    for name, sensor_id, switch_name, target, start, forecast, daily in \
+            server.list_heater_plans():
+        s = "Heater %s: switch \"%s\" warm at %s" % \
+            (name, switch_name, time.ctime(target))
+        if daily:
+            s += " daily"
+        s += ", on at %s" % time.ctime(start)
+        if forecast != None:
+            s += " (forecast %3.1f °C)" % forecast
+        print(s)
+    return 0
+
+def add_heater_plan_cmd(server, h_name, h_sensor, h_switch_name, h_target,
+                        h_daily=None):
+    if h_daily not in (None, "daily"):
+        return None
+    try:
+        target = parse_time(h_target)
+    except ValueError:
+        print("Times are given as [YYYY-MM-DDT]HH:MM.")
+        return 1
+    if target < time.time() and "T" not in h_target:
+        target += 24*60*60
+    ok, result = server.add_heater_plan(h_name, h_sensor, h_switch_name,
+                                        target, h_daily == "daily")
+    if not ok:
+        print(result)
+        return 1
+    print("Heater on at %s." % time.ctime(result))
+    return 0
+
+def del_heater_plan_cmd(server, h_name):
+    if not server.del_heater_plan(h_name):
+        print("No heater plan \"%s\"." % h_name)
+        return 1
+    return 0
+
+def list_rules_cmd(server):
+    for name, text, enabled, active in server.list_rules():
+        s = "Rule %s: %s" % (name, text)
+        if not enabled:
+            s += " (disabled)"
+        elif active:
+            s += " (holds)"
+        print(s)
+    return 0
+
+def add_rule_cmd(server, r_name, r_words):
+    # the rule may be given as one argument or several
+    ok, error = server.add_rule(r_name, " ".join(r_words))
+    if not ok:
+        print("Invalid rule: %s" % error)
+        return 1
+    return 0
+
+def del_rule_cmd(server, r_name):
+    if not server.del_rule(r_name):
+        print("No rule \"%s\"." % r_name)
+        return 1
+    return 0
+
+def set_rule_enabled_cmd(server, r_name, enabled):
+    if not server.set_rule_enabled(r_name, enabled):
+        print("No rule \"%s\"." % r_name)
+        return 1
+    return 0
+
+def radio_cmd(server):
+    for ptype, addr, unit, radio, level in server.list_radio_routes():
+        if unit == None:
+            s = "0x%02x 0x%x" % (ptype, addr)
+        else:
+            s = "0x%02x 0x%x %d" % (ptype, addr, unit)
+        print("%s: %s (signal level %d)" % (s, radio, level))
     return 0
 
 env_host = os.getenv('AUTOHUB_SERVER')
@@ -178,8 +438,11 @@ if env_host:
 else:
     host = DEFAULT_HOST
 
+# -b queues switch commands behind interactive ones; meant for scripts
+bulk = False
+
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "s:h")
+    opts, args = getopt.getopt(sys.argv[1:], "s:bh")
 
     for opt, arg in opts:
         if opt == '-h':
@@ -187,6 +450,8 @@ try:
             sys.exit(0)
         elif opt == '-s':
             host = arg
+        elif opt == '-b':
+            bulk = True
         else:
             assert False
 except getopt.GetoptError as err:
@@ -223,9 +488,9 @@ elif args[0] == "switch":
             ecode = get_switch_cmd(s, name=args[2])
         elif args[1] == "set" and len(args) == 5:
             ecode = set_switch_cmd(s, args[4], device_id=args[2],
-                                   unit_id=args[3])
+                                   unit_id=args[3], bulk=bulk)
         elif args[1] == "set" and len(args) == 4:
-            ecode = set_switch_cmd(s, args[3], name=args[2])
+            ecode = set_switch_cmd(s, args[3], name=args[2], bulk=bulk)
         elif args[1] == "set-name" and len(args) == 5:
             ecode = set_switch_name_cmd(s, args[2], args[3], args[4])
         elif args[1] == "del" and len(args) == 3:
@@ -245,6 +510,48 @@ elif args[0] == "button":
 elif args[0] == "event":
     if len(args) == 1:
         ecode = get_event_log_cmd(s)
+    elif len(args) == 2 and args[1] == "-f":
+        ecode = follow_events_cmd(s)
+    elif len(args) == 3 and args[1] == "last":
+        ecode = last_events_cmd(s, int(args[2]))
+    elif len(args) == 4 and args[1] == "last":
+        ecode = last_events_cmd(s, int(args[2]), args[3])
+elif args[0] == "stats" and len(args) == 1:
+    ecode = stats_cmd(s)
+elif args[0] == "radio" and len(args) == 1:
+    ecode = radio_cmd(s)
+elif args[0] == "schedule":
+    if len(args) == 1:
+        ecode = list_jobs_cmd(s)
+    elif len(args) in (5, 6) and args[1] == "add":
+        ecode = add_job_cmd(s, *args[2:])
+    elif len(args) == 3 and args[1] == "cancel":
+        ecode = cancel_job_cmd(s, args[2])
+elif args[0] == "heater":
+    if len(args) == 1:
+        ecode = list_heater_plans_cmd(s)
+    elif len(args) in (6, 7) and args[1] == "add":
+        ecode = add_heater_plan_cmd(s, *args[2:])
+    elif len(args) == 3 and args[1] == "del":
+        ecode = del_heater_plan_cmd(s, args[2])
+elif args[0] == "rule":
+    if len(args) == 1:
+        ecode = list_rules_cmd(s)
+    elif len(args) >= 4 and args[1] == "add":
+        ecode = add_rule_cmd(s, args[2], args[3:])
+    elif len(args) == 3 and args[1] == "del":
+        ecode = del_rule_cmd(s, args[2])
+    elif len(args) == 3 and args[1] == "enable":
+        ecode = set_rule_enabled_cmd(s, args[2], True)
+    elif len(args) == 3 and args[1] == "disable":
+        ecode = set_rule_enabled_cmd(s, args[2], False)
+elif args[0] == "multi" and len(args) > 1:
+    ecode = multi_cmd(s, args[1:], bulk)
+elif args[0] == "history":
+    if len(args) == 3:
+        ecode = history_cmd(s, args[1], args[2])
+    elif len(args) == 4:
+        ecode = history_cmd(s, args[1], args[2], args[3])
 if ecode == None:
     usage(sys.argv[0])
     sys.exit(1)
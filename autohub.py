@@ -16,17 +16,35 @@ import rfxtrx433
 import sys
 import signal
 import threading
-import os
 import jsonrpcif
 import syslog
 import getopt
 import shelve
+import txsched
+import registry
+import eventlog
+import persist
+import history
+import tempseries
+import eventstream
+import snapshot
+import actions
+import dedupe
+import log
+import stats
+import replay
+import radios
+import rules
+import jobs
+import heater
 
 class TempSensor:
     def __init__(self, sensor_id):
         self.sensor_id = sensor_id
         self.name = None
         self.last_update = None
+        self.temp = None
+        self.signal_level = None
     def update(self, temp, signal_level):
         self.last_update = time.time()
         self.temp = temp
@@ -35,16 +53,8 @@ class TempSensor:
 EVENT_TYPE_BUTTON = "button"
 EVENT_TYPE_SENSOR_READING = "sensor-reading"
 EVENT_TYPE_SWITCH_SET = "switch-set"
-
-class Event:
-    def __init__(self, event_type, event_time, device_id, unit_id, source_name,
-                 event_value):
-        self.event_type = event_type
-        self.event_time = event_time
-        self.device_id = device_id
-        self.unit_id = unit_id
-        self.source_name = source_name
-        self.event_value = event_value
+EVENT_TYPE_ACTION = "action"
+EVENT_TYPE_RULE = "rule"
 
 class Switch:
     def __init__(self, device_id, unit_id, name=None, state=None,
@@ -70,18 +80,37 @@ class Switch:
         else:
             return "off"
 
+def switch_addr(switch):
+    return (switch.device_id, switch.unit_id)
+
+def switch_name(switch):
+    return switch.name
+
 def synchronized():
     '''Synchronization decorator.'''
     def wrap(f):
+        name = f.__name__
         def new_function(self, *args, **kw):
+            start = time.perf_counter()
             self._lock.acquire()
+            acquired = time.perf_counter()
             try:
                 return f(self, *args, **kw)
             finally:
+                # recorded before letting go, so the lock covers them too
+                self.lock_wait.add(name, acquired - start)
+                self.lock_hold.add(name, time.perf_counter() - acquired)
                 self._lock.release()
         return new_function
     return wrap
 
+class LockState (threading.local):
+    # how deep the calling thread is in lock()/unlock(), which may nest,
+    # and when it took the lock
+    def __init__(self):
+        self.depth = 0
+        self.locked_at = None
+
 class Button:
     def __init__(self, device_id, unit_id, name):
         self.device_id = device_id
@@ -94,111 +123,253 @@ class Button:
     def turned_off(self):
         print("Doing %s" % self.off_action)
 
+def button_name(button):
+    return button.name
+
+def button_addr(button):
+    return (button.device_id, button.unit_id)
+
 MAX_EVENT_LOG_SIZE = 10000
 
+SECTION_SWITCHES = "switches"
+SECTION_BUTTONS = "buttons"
+SECTION_TEMP_SENSORS = "temp_sensors"
+SECTION_TEMP_SERIES = "temp_series"
+SECTION_RULES = "rules"
+SECTION_JOBS = "jobs"
+SECTION_HEATER_PLANS = "heater_plans"
+
+def sensor_id(sensor):
+    return sensor.sensor_id
+
+def rule_name(rule):
+    return rule.name
+
+def job_id(job):
+    return job.job_id
+
+def plan_name(plan):
+    return plan.name
+
+# resolution of the history the heater planner forecasts from
+FORECAST_POINTS = 60
+
 class AutoHub:
-    def __init__(self, dev_filename, state_filename):
-        self._rfxtrx433 = rfxtrx433.RFXtrx433(dev_filename, self._handle_temp,
-                                              self._handle_button)
+    def __init__(self, dev_filenames, state_filename,
+                 flush_interval=persist.DEFAULT_FLUSH_INTERVAL,
+                 history_dirname=None, action_timeout=actions.DEFAULT_TIMEOUT,
+                 dedupe_window=dedupe.DEFAULT_WINDOW, capture_filename=None,
+                 replay_filename=None, replay_speed=1.0,
+                 max_lateness=jobs.DEFAULT_MAX_LATENESS):
+        # a window of 0 passes every repeat on
+        deduper = None
+        if dedupe_window > 0:
+            deduper = dedupe.Deduper(dedupe_window)
+        self.radios = radios.RadioSet(deduper)
+        if replay_filename != None:
+            radio = replay.ReplayRadio(replay_filename, self._handle_temp,
+                                       self._handle_button, deduper,
+                                       replay_speed, self.radios.heard_cb(0))
+            # routes and sent commands go by capture time, like repeats
+            self.radios.clock = radio.capture_time
+            self.radios.add(replay_filename, radio)
+        else:
+            for i, dev_filename in enumerate(dev_filenames):
+                radio_capture_filename = capture_filename
+                if capture_filename != None and len(dev_filenames) > 1:
+                    # one capture per radio
+                    radio_capture_filename = "%s.%d" % (capture_filename, i)
+                self.radios.add(dev_filename,
+                                rfxtrx433.RFXtrx433(dev_filename,
+                                                    self._handle_temp,
+                                                    self._handle_button,
+                                                    deduper,
+                                                    radio_capture_filename,
+                                                    self.radios.heard_cb(i)))
         self.temp_sensors = {}
-        self.switches = []
-        self.buttons = []
-        self.event_log = []
+        self.temp_series = tempseries.TempSeriesStore()
+        self.switches = registry.Registry(switch_addr, switch_name)
+        self.buttons = registry.Registry(button_name, button_addr)
+        self.event_log = eventlog.EventLog(MAX_EVENT_LOG_SIZE)
+        self.rules = rules.RuleEngine(self._rule_fired, self._rule_changed)
+        self.jobs = jobs.JobScheduler(self._job_due, max_lateness)
+        self.heaters = heater.HeaterPlanner(self._sensor_history,
+                                            self._schedule_switch,
+                                            self.cancel_job,
+                                            self._heater_changed)
+        # what read-only callers should look at instead of taking the lock
+        self.snapshot = snapshot.Snapshot()
         self._lock = threading.RLock()
+        self.lock_wait = stats.HistogramSet()
+        self.lock_hold = stats.HistogramSet()
+        self._lock_state = LockState()
+        self._new_event = threading.Condition(self._lock)
+        self._event_listeners = []
+        self._actions = actions.ActionRunner(self._action_done,
+                                             timeout=action_timeout)
         self.state_filename = state_filename
+        self._store = persist.StateStore(state_filename, self._lock,
+                                         flush_interval)
+        self._store.add_section(SECTION_SWITCHES, switch_addr,
+                                self.switches.get, lambda: self.switches)
+        self._store.add_section(SECTION_BUTTONS, button_name,
+                                self.buttons.get, lambda: self.buttons)
+        self._store.add_section(SECTION_TEMP_SENSORS, sensor_id,
+                                self.temp_sensors.get,
+                                lambda: self.temp_sensors.values())
+        # the series have a file of their own; the section is only read,
+        # from state saved before they did
+        self._store.add_section(SECTION_TEMP_SERIES, sensor_id,
+                                lambda key: None, lambda: [])
+        self._store.add_section(SECTION_RULES, rule_name, self.rules.get,
+                                self.rules.values)
+        self._store.add_section(SECTION_JOBS, job_id, self.jobs.get,
+                                self.jobs.values)
+        self._store.add_section(SECTION_HEATER_PLANS, plan_name,
+                                self.heaters.get, self.heaters.values)
+        self.series_file = tempseries.SeriesFile(state_filename + ".series",
+                                                 self.temp_series, self._lock)
+        self._store.add_flush_hook(self.series_file.save)
+        self.history = None
+        if history_dirname != None:
+            self.history = history.HistoryStore(history_dirname)
+            self._store.add_flush_hook(self.history.sync)
         self._load()
     def start(self):
-        self._rfxtrx433.start()
+        self._store.start()
+        self.radios.start()
+        self.jobs.start()
     def halt(self):
-        self._rfxtrx433.halt()
+        self.jobs.halt()
+        self.radios.halt()
+        self._actions.close()
+        self._store.close()
+        self.series_file.close()
+        if self.history != None:
+            self.lock()
+            self.history.close()
+            self.unlock()
     def lock(self):
+        start = time.perf_counter()
         self._lock.acquire()
+        state = self._lock_state
+        state.depth += 1
+        if state.depth == 1:
+            state.locked_at = time.perf_counter()
+            self.lock_wait.add("lock", state.locked_at - start)
     def unlock(self):
-        self._save()
+        state = self._lock_state
+        state.depth -= 1
+        if state.depth == 0:
+            self.lock_hold.add("lock", time.perf_counter() - state.locked_at)
         self._lock.release()
+    def stats(self):
+        return { "radio": self.radios.stats(),
+                 "lock_wait": self.lock_wait.to_dict(),
+                 "lock_hold": self.lock_hold.to_dict(),
+                 "rules": { "rules": len(self.rules.rules),
+                            "evaluated": self.rules.evaluated,
+                            "fired": self.rules.fired },
+                 "jobs": self.jobs.stats(),
+                 "heaters": { "plans": len(self.heaters.plans),
+                              "replans": self.heaters.replans } }
+    def _changed(self, section, key):
+        self._store.mark(section, key)
+        self._publish(section, key)
+    def _publish(self, section, key=None):
+        # only the changed section is copied, with just the changed entry
+        # replaced where it can be; the others are shared with the previous
+        # snapshot
+        if section == SECTION_SWITCHES:
+            switch = None
+            if key != None:
+                switch = self.switches.get(key)
+            switches = None
+            if switch != None:
+                switches = self.snapshot.switches.updated(switch)
+            if switches == None:
+                switches = snapshot.SwitchSection(self.switches)
+            self.snapshot = self.snapshot.replace(switches=switches)
+        elif section == SECTION_BUTTONS:
+            self.snapshot = self.snapshot.replace(
+                buttons=snapshot.button_section(self.buttons))
+        elif section == SECTION_TEMP_SENSORS:
+            sensor = None
+            if key != None:
+                sensor = self.temp_sensors.get(key)
+            temp_sensors = None
+            if sensor != None:
+                temp_sensors = self.snapshot.temp_sensors.updated(sensor)
+            if temp_sensors == None:
+                temp_sensors = snapshot.SensorSection(
+                    self.temp_sensors.values())
+            self.snapshot = self.snapshot.replace(temp_sensors=temp_sensors)
     @synchronized()
-    def set_switch_by_name(self, name, state):
+    def set_switch_by_name(self, name, state,
+                           priority=txsched.PRIORITY_INTERACTIVE):
         assert self.has_switch_by_name(name)
         switch = self.get_switch_by_name(name)
-        self._set_switch(switch, state)
+        self._set_switch(switch, state, priority)
     @synchronized()
     def has_switch_by_name(self, name):
-        return self._switch_index_by_name(name) != -1
+        return self.switches.find(name) != None
     @synchronized()
     def get_switch_by_name(self, name):
-        idx = self._switch_index_by_name(name)
-        assert idx != -1
-        return self.switches[idx]
+        switch = self.switches.find(name)
+        assert switch != None
+        return switch
     @synchronized()
     def set_switch_name(self, device_id, unit_id, name):
-        assert self.has_switch(device_id, unit_id)
         switch = self.get_switch(device_id, unit_id)
+        old_name = switch.name
         switch.name = name
+        self.switches.reindex(switch, old_name)
+        self._changed(SECTION_SWITCHES, switch_addr(switch))
     @synchronized()
-    def set_switch(self, device_id, unit_id, state):
-        if not self.has_switch(device_id, unit_id):
-            self.switches.append(Switch(device_id, unit_id))
-        switch = self.get_switch(device_id, unit_id)
-        self._set_switch(switch, state)
-    def _set_switch(self, switch, state):
+    def set_switch(self, device_id, unit_id, state,
+                   priority=txsched.PRIORITY_INTERACTIVE):
+        switch = self.switches.get((device_id, unit_id))
+        if switch == None:
+            switch = Switch(device_id, unit_id)
+            self.switches.add(switch)
+        self._set_switch(switch, state, priority)
+    def _set_switch(self, switch, state, priority):
         old_state_str = switch.state_str()
         switch.update(state)
-        self._rfxtrx433.set_switch(switch.device_id, switch.unit_id,
-                                   switch.next_seq_no(), state)
-        syslog.syslog(syslog.LOG_INFO, "Setting switch \"%s\" (0x%x %x) "
-                      "from %s to %s." % (switch.name.encode("UTF-8"),
-                                          switch.device_id, switch.unit_id,
-                                          old_state_str, switch.state_str()))
+        self._changed(SECTION_SWITCHES, switch_addr(switch))
+        # only queues the command; the radio threads do the sending
+        self.radios.set_switch(rfxtrx433.TYPE_LIGHTING2_MESSAGE,
+                               switch.device_id, switch.unit_id,
+                               switch.next_seq_no(), state, priority)
+        log.log(syslog.LOG_INFO,
+                "Setting switch \"%s\" (0x%x %x) from %s to %s.", switch.name,
+                switch.device_id, switch.unit_id, old_state_str,
+                switch.state_str())
         self.add_event(EVENT_TYPE_SWITCH_SET, switch.device_id,
                        switch.unit_id, switch.name, switch.state_str())
     @synchronized()
     def del_switch(self, name):
-        idx = self._switch_index_by_name(name)
-        del self.switches[idx]
-    def _switch_index(self, device_id, unit_id):
-        for i in range(0, len(self.switches)):
-            s = self.switches[i]
-            if s.device_id == device_id and s.unit_id == unit_id:
-                return i
-        return -1
-    def _switch_index_by_name(self, name):
-        for i in range(0, len(self.switches)):
-            s = self.switches[i]
-            if s.name == name:
-                return i
-        return -1
+        switch = self.get_switch_by_name(name)
+        self.switches.remove(switch_addr(switch))
+        self._changed(SECTION_SWITCHES, switch_addr(switch))
     @synchronized()
     def has_switch(self, device_id, unit_id):
-        return self._switch_index(device_id, unit_id) != -1
+        return (device_id, unit_id) in self.switches
     @synchronized()
     def get_switch(self, device_id, unit_id):
-        idx = self._switch_index(device_id, unit_id)
-        assert idx != -1
-        return self.switches[idx]
-    def _button_index_by_name(self, name):
-        for i in range(0, len(self.buttons)):
-            b = self.buttons[i]
-            if b.name == name:
-                return i
-        return -1
+        switch = self.switches.get((device_id, unit_id))
+        assert switch != None
+        return switch
     def _button_by_name(self, name):
-        idx = self._button_index_by_name(name)
-        if idx != -1:
-            return self.buttons[idx]
+        return self.buttons.get(name)
     def _button_by_addr(self, device_id, unit_id):
-        for b in self.buttons:
-            if b.device_id == device_id and b.unit_id == unit_id:
-                return b
+        return self.buttons.find((device_id, unit_id))
     @synchronized()
     def set_button_name(self, device_id, unit_id, name):
-        idx = self._button_index_by_name(name)
-        button = Button(device_id, unit_id, name)
-        if idx != -1:
-            self.buttons[idx] = button
-        else:
-            self.buttons.append(button)
+        self.buttons.add(Button(device_id, unit_id, name))
+        self._changed(SECTION_BUTTONS, name)
     def has_button(self, name):
-        return self._button_index_by_name(name) != -1
+        return name in self.buttons
     @synchronized()
     def bind_button(self, name, state, action):
         button = self._button_by_name(name)
@@ -207,34 +378,79 @@ class AutoHub:
                 button.on_action = action
             elif state == 'off':
                 button.off_action = action
+            self._changed(SECTION_BUTTONS, name)
     @synchronized()
     def del_button(self, name):
-        idx = self._button_index_by_name(name)
-
-        del self.buttons[idx]
+        if name in self.buttons:
+            self.buttons.remove(name)
+            self._changed(SECTION_BUTTONS, name)
+    @synchronized()
+    def set_temp_sensor_name(self, sensor_id, name):
+        if sensor_id not in self.temp_sensors:
+            return False
+        self.temp_sensors[sensor_id].name = name
+        self._changed(SECTION_TEMP_SENSORS, sensor_id)
+        return True
+    @synchronized()
+    def del_temp_sensor(self, sensor_id):
+        if sensor_id not in self.temp_sensors:
+            return False
+        del self.temp_sensors[sensor_id]
+        self._changed(SECTION_TEMP_SENSORS, sensor_id)
+        self.temp_series.remove(sensor_id)
+        return True
     @synchronized()
     def clear_event_log(self):
-        self.event_log = []
+        self.event_log.clear()
     @synchronized()
     def add_event(self, event_type, device_id, unit_id, source_name,
                   event_value):
-        self.event_log.append(Event(event_type, time.time(), device_id, unit_id,
-                                    source_name, event_value))
-        while len(self.event_log) > MAX_EVENT_LOG_SIZE:
-            del self.event_log[0]
+        event_time = time.time()
+        seq = self.event_log.append(event_type, event_time, device_id,
+                                    unit_id, source_name, event_value)
+        if self.history != None:
+            self.history.append(event_type, event_time, device_id, unit_id,
+                                source_name, event_value)
+        self._new_event.notify_all()
+        event = (event_type, event_time, device_id, unit_id, source_name,
+                 event_value)
+        for listener in self._event_listeners:
+            listener(seq, event)
+    def add_event_listener(self, listener):
+        # listeners are called with the lock held, and must not block
+        self._event_listeners.append(listener)
+    def wait_for_event(self, timeout):
+        # caller holds the lock, which is released while waiting; the wait
+        # doesn't count as holding it
+        state = self._lock_state
+        if state.depth == 0:
+            self._new_event.wait(timeout)
+            return
+        self.lock_hold.add("lock", time.perf_counter() - state.locked_at)
+        self._new_event.wait(timeout)
+        state.locked_at = time.perf_counter()
     @synchronized()
     def _handle_temp(self, sensor_id, seq_no, temp, signal_level):
-        syslog.syslog(syslog.LOG_INFO, "Got reading from sensor 0x%x; "
-                      "seq no %d; signal level %d; temperature %3.2f" % \
-                          (sensor_id, seq_no, signal_level, temp))
+        # once per frame; too often to be worth more than debug
+        log.log(syslog.LOG_DEBUG, "Got reading from sensor 0x%x; seq no %d; "
+                "signal level %d; temperature %3.2f", sensor_id, seq_no,
+                signal_level, temp)
         if sensor_id not in self.temp_sensors:
-            syslog.syslog(syslog.LOG_INFO,
-                          "Sensor %d has not been seen before." % sensor_id)
+            log.log(syslog.LOG_INFO, "Sensor %d has not been seen before.",
+                    sensor_id)
             self.temp_sensors[sensor_id] = TempSensor(sensor_id)
+            self._changed(SECTION_TEMP_SENSORS, sensor_id)
         sensor = self.temp_sensors[sensor_id]
         sensor.update(temp, signal_level)
+        self.temp_series.add(sensor_id, sensor.last_update, temp)
+        self.rules.temp(sensor_id, temp, sensor.last_update)
+        self.heaters.reading(sensor_id, sensor.last_update)
+        # readings aren't worth a journal record; they go with the snapshot
+        self._store.touch()
+        self._publish(SECTION_TEMP_SENSORS, sensor_id)
         self.add_event(EVENT_TYPE_SENSOR_READING, sensor.sensor_id, None,
                        sensor.name, str(sensor.temp))
+    @synchronized()
     def _handle_button(self, device_id, unit_id, state):
         button = self._button_by_addr(device_id, unit_id)
 
@@ -245,29 +461,163 @@ class AutoHub:
             else:
                 action = button.off_action
             if action != None:
-                syslog.syslog(syslog.LOG_INFO, "Running cmd \"%s\"." % action)
-                os.system(action)
+                self._actions.submit(button_name, state, action, device_id,
+                                     unit_id)
         else:
             button_name = "Unnamed"
         self.add_event(EVENT_TYPE_BUTTON, device_id, unit_id, button_name, state)
+        self.rules.button(device_id, unit_id, state)
+    def _action_done(self, button_name, device_id, unit_id, delay, duration,
+                     status):
+        # "<exit status> <seconds waiting to start> <seconds running>"
+        if status == None:
+            status = "killed"
+        self.add_event(EVENT_TYPE_ACTION, device_id, unit_id, button_name,
+                       "%s %.3f %.3f" % (status, delay, duration))
+    def _find_sensor(self, word):
+        # the id of the sensor with that name, or None
+        for sensor in self.temp_sensors.values():
+            if sensor.name == word:
+                return sensor.sensor_id
+        try:
+            # sensors that haven't reported yet can be given by id
+            return int(word, 0)
+        except ValueError:
+            return None
+    def _resolve_sensor(self, word):
+        sensor_id = self._find_sensor(word)
+        if sensor_id == None:
+            raise rules.RuleError("No sensor \"%s\"." % word)
+        return sensor_id
+    def _resolve_button(self, word):
+        button = self._button_by_name(word)
+        if button == None:
+            raise rules.RuleError("No button \"%s\"." % word)
+        return button.device_id, button.unit_id
+    @synchronized()
+    def add_rule(self, name, text):
+        # raises RuleError if the rule can't be parsed
+        rule = rules.parse(name, text, self._resolve_sensor,
+                           self._resolve_button)
+        self.rules.add(rule)
+        self._changed(SECTION_RULES, name)
+    @synchronized()
+    def del_rule(self, name):
+        if name not in self.rules:
+            return False
+        self.rules.remove(name)
+        self._changed(SECTION_RULES, name)
+        return True
+    @synchronized()
+    def set_rule_enabled(self, name, enabled):
+        if name not in self.rules:
+            return False
+        self.rules.set_enabled(name, enabled)
+        self._changed(SECTION_RULES, name)
+        return True
+    def _rule_fired(self, rule, switch_name, state):
+        switch = self.switches.find(switch_name)
+        if switch == None:
+            log.log(syslog.LOG_WARNING, "Rule \"%s\" fired, but there is "
+                    "no switch \"%s\".", rule.name, switch_name)
+            return
+        log.log(syslog.LOG_INFO, "Rule \"%s\" fired.", rule.name)
+        self.add_event(EVENT_TYPE_RULE, switch.device_id, switch.unit_id,
+                       rule.name, rules.state_str(state))
+        self._set_switch(switch, state, txsched.PRIORITY_INTERACTIVE)
+    def _rule_changed(self, rule):
+        # hysteresis and last state are saved with the rule
+        self._store.mark(SECTION_RULES, rule.name)
+    @synchronized()
+    def add_job(self, when, switch_name, state,
+                missed=jobs.DEFAULT_MISSED_POLICY):
+        job = self.jobs.add(when, switch_name, state, missed)
+        self._store.mark(SECTION_JOBS, job.job_id)
+        return job
+    @synchronized()
+    def cancel_job(self, job_id):
+        if self.jobs.cancel(job_id) == None:
+            return False
+        self._store.mark(SECTION_JOBS, job_id)
+        return True
+    @synchronized()
+    def _job_due(self, job):
+        self._store.mark(SECTION_JOBS, job.job_id)
+        switch = self.switches.find(job.switch_name)
+        if switch == None:
+            log.log(syslog.LOG_WARNING, "Job %d is due, but there is no "
+                    "switch \"%s\".", job.job_id, job.switch_name)
+            return
+        log.log(syslog.LOG_INFO, "Job %d is due, %.3f s late.", job.job_id,
+                time.time() - job.when)
+        self._set_switch(switch, job.state, txsched.PRIORITY_INTERACTIVE)
+    @synchronized()
+    def add_heater_plan(self, name, sensor, switch_name, target,
+                        overrun=heater.DEFAULT_OVERRUN, daily=False):
+        # raises PlanError for an unknown sensor
+        sensor_id = self._find_sensor(sensor)
+        if sensor_id == None:
+            raise heater.PlanError("No sensor \"%s\"." % sensor)
+        plan = heater.Plan(name, sensor_id, switch_name, target, overrun,
+                           daily)
+        self.heaters.add(plan)
+        log.log(syslog.LOG_INFO, "Heater plan \"%s\": start at %s.", name,
+                time.ctime(plan.start))
+        return plan
+    @synchronized()
+    def del_heater_plan(self, name):
+        if name not in self.heaters:
+            return False
+        self.heaters.remove(name)
+        return True
+    def _sensor_history(self, sensor_id, start, end):
+        series = self.temp_series.series(sensor_id, start, end,
+                                         FORECAST_POINTS)
+        if series == None:
+            return []
+        return series
+    def _schedule_switch(self, when, switch_name, state):
+        return self.add_job(when, switch_name, state).job_id
+    def _heater_changed(self, name):
+        self._store.mark(SECTION_HEATER_PLANS, name)
     def _load(self):
+        if self._store.exists():
+            state = self._store.load()
+        else:
+            state = self._load_shelve()
+        self.switches.load(state.get(SECTION_SWITCHES, []))
+        self.buttons.load(state.get(SECTION_BUTTONS, []))
+        for sensor in state.get(SECTION_TEMP_SENSORS, []):
+            self.temp_sensors[sensor.sensor_id] = sensor
+        if self.series_file.exists():
+            self.series_file.load()
+        else:
+            self.temp_series.load(state.get(SECTION_TEMP_SERIES, []))
+        self.rules.load(state.get(SECTION_RULES, []))
+        self.heaters.load(state.get(SECTION_HEATER_PLANS, []))
+        for job in self.jobs.load(state.get(SECTION_JOBS, [])):
+            log.log(syslog.LOG_WARNING, "Job %d was due at %s; dropped.",
+                    job.job_id, time.ctime(job.when))
+            self._store.mark(SECTION_JOBS, job.job_id)
+        for section in (SECTION_SWITCHES, SECTION_BUTTONS,
+                        SECTION_TEMP_SENSORS):
+            self._publish(section)
+        # the series are saved before a snapshot without them replaces
+        # the one they may have been in
+        self.series_file.save()
+        self._store.flush(compact=True)
+    def _load_shelve(self):
+        # state files from before the snapshot/journal store
+        state = {}
         s = shelve.open(self.state_filename)
         if "switches" in s:
-            self.switches = s["switches"]
+            state[SECTION_SWITCHES] = s["switches"]
         if "buttons" in s:
-            self.buttons = s["buttons"]
+            state[SECTION_BUTTONS] = s["buttons"]
         if "temp_sensors" in s:
-            self.temp_sensors = s["temp_sensors"]
-#        if s.has_key("event_log"):
-#            self.event_log = s["event_log"]
-        s.close()
-    def _save(self):
-        s = shelve.open(self.state_filename)
-        s["switches"] = self.switches
-        s["buttons"] = self.buttons
-        s["temp_sensors"] = self.temp_sensors
-#        s["event_log"] = self.event_log
+            state[SECTION_TEMP_SENSORS] = list(s["temp_sensors"].values())
         s.close()
+        return state
 
 
 def quit(signum, frame):
@@ -275,24 +625,58 @@ def quit(signum, frame):
     sys.exit(1)
 
 def usage(name):
-    print("Usage: %s [-F <rfxcom-dev>] [-f <state-file>]" % name)
+    print("Usage: %s [-F <rfxcom-dev>]... [-f <state-file>] "
+          "[-i <flush-interval>] [-H <history-dir>] [-w <rpc-workers>] "
+          "[-S <stream-port>] [-T <action-timeout>] [-D <dedupe-window>] "
+          "[-C <capture-file>] [-R <capture-file> [-x <speed>]] "
+          "[-L <max-job-lateness>]" % name)
 
 DEFAULT_DEV_FILENAME = "/dev/ttyUSB0"
 DEFAULT_STATE_FILENAME = "autohub"
 
 debug = False
-dev_filename = DEFAULT_DEV_FILENAME
+dev_filenames = []
 state_filename = DEFAULT_STATE_FILENAME
+flush_interval = persist.DEFAULT_FLUSH_INTERVAL
+history_dirname = None
+rpc_workers = jsonrpcif.DEFAULT_WORKERS
+stream_port = eventstream.DEFAULT_STREAM_PORT
+action_timeout = actions.DEFAULT_TIMEOUT
+dedupe_window = dedupe.DEFAULT_WINDOW
+capture_filename = None
+replay_filename = None
+replay_speed = 1.0
+max_lateness = jobs.DEFAULT_MAX_LATENESS
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "hdf:F:", ["help"])
+    opts, args = getopt.getopt(sys.argv[1:], "hdf:F:i:H:w:S:T:D:C:R:x:L:", ["help"])
     for o, a in opts:
         if o == "-d":
             debug = True
         elif o == "-f":
             state_filename = a
         elif o == "-F":
-            dev_filename = a
+            dev_filenames.append(a)
+        elif o == "-i":
+            flush_interval = float(a)
+        elif o == "-H":
+            history_dirname = a
+        elif o == "-w":
+            rpc_workers = int(a)
+        elif o == "-S":
+            stream_port = int(a)
+        elif o == "-T":
+            action_timeout = float(a)
+        elif o == "-D":
+            dedupe_window = float(a)
+        elif o == "-C":
+            capture_filename = a
+        elif o == "-R":
+            replay_filename = a
+        elif o == "-x":
+            replay_speed = float(a)
+        elif o == "-L":
+            max_lateness = float(a)
         elif o in ("-h", "--help"):
             usage(sys.argv[0])
             sys.exit(0)
@@ -307,23 +691,34 @@ if len(args) != 0:
     usage(sys.argv[0])
     sys.exit(1)
 
+if len(dev_filenames) == 0:
+    dev_filenames.append(DEFAULT_DEV_FILENAME)
+
 
 syslog.openlog("autohub", syslog.LOG_PERROR, syslog.LOG_DAEMON)
 
 if not debug:
-    syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_INFO))
+    log.setlogmask(syslog.LOG_UPTO(syslog.LOG_INFO))
 
 signal.signal(signal.SIGHUP, quit)
 signal.signal(signal.SIGQUIT, quit)
 signal.signal(signal.SIGTERM, quit)
 signal.signal(signal.SIGINT, quit)
 
-autohub = AutoHub(dev_filename, state_filename)
-jif = jsonrpcif.JSONRPCIf(autohub)
+autohub = AutoHub(dev_filenames, state_filename, flush_interval,
+                  history_dirname, action_timeout, dedupe_window,
+                  capture_filename, replay_filename, replay_speed,
+                  max_lateness)
+jif = jsonrpcif.JSONRPCIf(autohub, rpc_workers)
 shouldStop = False
 jif.start()
+if stream_port != 0:
+    stream = eventstream.EventStream(stream_port)
+    autohub.add_event_listener(stream.publish)
+    stream.start()
 autohub.start()
-while not shouldStop:
-    time.sleep(1)
-autohub.halt()
-hif.halt()
+try:
+    while not shouldStop:
+        time.sleep(1)
+finally:
+    autohub.halt()
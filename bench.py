@@ -0,0 +1,389 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+#
+# Micro-benchmarks for the Autohub hot paths.
+#
+
+import sys
+import getopt
+import time
+import syslog
+import threading
+import json
+import http.client
+import rfxtrx433
+import registry
+import snapshot
+import log
+import capture
+
+# A short stretch of traffic recorded off a busy 433 MHz band: Lacrosse and
+# Viking temperature readings, a remote repeating a lighting 2 "on" frame,
+# a status response and a frame type we don't decode.
+RECORDED_STREAM = bytes.fromhex(
+    "08 50 05 01 99 a6 00 d7 69"
+    "08 50 07 02 44 01 80 2d 59"
+    "0b 11 00 03 01 23 45 67 01 01 0f 70"
+    "0b 11 00 04 01 23 45 67 01 01 0f 70"
+    "0b 11 00 05 01 23 45 67 01 01 0f 60"
+    "0d 01 00 00 02 53 45 00 00 00 00 00 00 00"
+    "07 20 00 06 12 34 56 00"
+    "08 50 05 07 99 a6 00 d8 59"
+    "0b 11 00 08 01 23 45 67 02 00 0f 70"
+    "0b 11 00 09 01 23 45 67 02 00 0f 70"
+)
+
+DEFAULT_ITERATIONS = 2000
+
+def usage(name):
+    print("%s [-n <iterations>] [-f <capture-file>] frames" % name)
+    print("%s [-n <iterations>] [-f <capture-file>] logging" % name)
+    print("%s [-n <iterations>] [-d <devices>] registry" % name)
+    print("%s [-s server] [-n <calls>] [-c <clients>] [-r <read-share>] rpc" %
+          name)
+    print("%s [-n <reads>] [-d <devices>] [-c <readers>] contention" % name)
+    print("%s -h" % name)
+
+def nop(*args):
+    pass
+
+def make_decoder():
+    return rfxtrx433.Decoder(nop, nop, nop)
+
+def per_byte(stream):
+    decoder = make_decoder()
+    frames = 0
+    for i in range(0, len(stream)):
+        # read(1) hands out a fresh one-byte bytes object every time
+        if decoder.put_char(stream[i:i+1]):
+            frames += 1
+    return frames
+
+READ_CHUNK = 64
+
+def framed(stream, decoder=None):
+    if decoder == None:
+        decoder = make_decoder()
+    reader = rfxtrx433.FrameReader()
+    frames = 0
+    view = memoryview(stream)
+    for i in range(0, len(stream), READ_CHUNK):
+        frames += reader.feed(view[i:i+READ_CHUNK], decoder.parse_frame)
+    return frames
+
+def run(name, f, data, unit="frame"):
+    start = time.perf_counter()
+    count = f(data)
+    latency = time.perf_counter() - start
+    print("%-10s %8d %ss %8.3f s %8.2f us/%s" %
+          (name, count, unit, latency, latency / count * 1e6, unit))
+
+def frames_bench(stream, iterations):
+    stream = stream * iterations
+    run("per-byte", per_byte, stream)
+    run("framed", framed, stream)
+    return 0
+
+TEMP_MSG = "Got reading from sensor 0x%x; seq no %d; signal level %d; " \
+    "temperature %3.2f"
+BUTTON_MSG = "Lighting 2 - AC type message received. Device address 0x%x, " \
+    "unit %d, state %d."
+
+def syslog_temp(sensor_id, seq_no, temp, signal_level):
+    syslog.syslog(syslog.LOG_INFO, TEMP_MSG %
+                  (sensor_id, seq_no, signal_level, temp))
+
+def syslog_button(device_id, unit_id, state):
+    syslog.syslog(syslog.LOG_DEBUG, BUTTON_MSG % (device_id, unit_id, state))
+
+def log_temp(sensor_id, seq_no, temp, signal_level):
+    log.log(syslog.LOG_DEBUG, TEMP_MSG, sensor_id, seq_no, signal_level, temp)
+
+def log_button(device_id, unit_id, state):
+    log.log(syslog.LOG_DEBUG, BUTTON_MSG, device_id, unit_id, state)
+
+def logging_bench(stream, iterations):
+    # the logging the hub does per frame, the way it used to be done, with
+    # readings at info, and as it is now, through the log module with
+    # readings at debug; debug is masked out, as it is by default
+    stream = stream * iterations
+    def with_syslog(stream):
+        return framed(stream, rfxtrx433.Decoder(nop, syslog_temp,
+                                                syslog_button))
+    def with_log(stream):
+        return framed(stream, rfxtrx433.Decoder(nop, log_temp, log_button))
+    run("nothing", framed, stream)
+    run("syslog", with_syslog, stream)
+    run("log", with_log, stream)
+    log.flush()
+    return 0
+
+class Device:
+    def __init__(self, device_id, unit_id, name):
+        self.device_id = device_id
+        self.unit_id = unit_id
+        self.name = name
+        self.state = False
+
+def device_addr(d):
+    return (d.device_id, d.unit_id)
+
+def device_name(d):
+    return d.name
+
+def list_find_addr(devices, device_id, unit_id):
+    for d in devices:
+        if d.device_id == device_id and d.unit_id == unit_id:
+            return d
+
+def list_find_name(devices, name):
+    for d in devices:
+        if d.name == name:
+            return d
+
+DEFAULT_DEVICES = 4000
+
+def registry_bench(iterations, num_devices):
+    devices = [ Device(0x100000 + i // 16, i % 16, "device-%d" % i)
+                for i in range(0, num_devices) ]
+    reg = registry.Registry(device_addr, device_name)
+    reg.load(devices)
+    # spread the lookups evenly over the population
+    probes = [ devices[(i * 7919) % num_devices]
+               for i in range(0, iterations) ]
+    def list_by_addr(probes):
+        for p in probes:
+            list_find_addr(devices, p.device_id, p.unit_id)
+        return len(probes)
+    def list_by_name(probes):
+        for p in probes:
+            list_find_name(devices, p.name)
+        return len(probes)
+    def registry_by_addr(probes):
+        for p in probes:
+            reg.get((p.device_id, p.unit_id))
+        return len(probes)
+    def registry_by_name(probes):
+        for p in probes:
+            reg.find(p.name)
+        return len(probes)
+    print("%d devices" % num_devices)
+    run("list-addr", list_by_addr, probes, "lookup")
+    run("list-name", list_by_name, probes, "lookup")
+    run("reg-addr", registry_by_addr, probes, "lookup")
+    run("reg-name", registry_by_name, probes, "lookup")
+    return 0
+
+class Sensor:
+    def __init__(self, sensor_id):
+        self.sensor_id = sensor_id
+        self.name = None
+        self.temp = 20.0
+        self.last_update = time.time()
+
+# how long the simulated radio thread holds the hub lock per reading (the
+# callback, syslog, history and so on), and how long it lets go in between
+RADIO_HOLD = 0.002
+RADIO_IDLE = 0.0005
+NUM_SENSORS = 32
+
+class Hub:
+    # the parts of AutoHub that the read path touches
+    def __init__(self, num_devices):
+        self.lock = threading.RLock()
+        self.switches = registry.Registry(device_addr, device_name)
+        self.switches.load([ Device(0x100000 + i // 16, i % 16,
+                                    "device-%d" % i)
+                             for i in range(0, num_devices) ])
+        self.sensors = [ Sensor(i) for i in range(0, NUM_SENSORS) ]
+        self.snapshot = snapshot.Snapshot(
+            snapshot.SensorSection(self.sensors),
+            snapshot.SwitchSection(self.switches))
+        self.should_stop = False
+    def radio(self):
+        i = 0
+        while not self.should_stop:
+            with self.lock:
+                sensor = self.sensors[i % NUM_SENSORS]
+                sensor.temp += 0.1
+                sensor.last_update = time.time()
+                self.snapshot = self.snapshot.replace(
+                    temp_sensors=self.snapshot.temp_sensors.updated(sensor))
+                time.sleep(RADIO_HOLD)
+            time.sleep(RADIO_IDLE)
+            i += 1
+
+def locked_read(hub):
+    # what list_switches used to do
+    with hub.lock:
+        return [ (s.device_id, s.unit_id, s.name, s.state)
+                 for s in hub.switches ]
+
+def snapshot_read(hub):
+    return list(hub.snapshot.switches.items)
+
+def reader(hub, read, reads, latencies, lock):
+    result = []
+    for i in range(0, reads):
+        start = time.perf_counter()
+        read(hub)
+        result.append(time.perf_counter() - start)
+    with lock:
+        latencies.extend(result)
+
+def contention_run(name, hub, read, reads, readers):
+    latencies = []
+    lock = threading.Lock()
+    threads = [ threading.Thread(target=reader,
+                                 args=(hub, read, reads, latencies, lock))
+                for i in range(0, readers) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    print("%-16s p50 %7.3f ms p99 %7.3f ms max %7.3f ms" %
+          (name, percentile(latencies, 0.5) * 1e3,
+           percentile(latencies, 0.99) * 1e3, latencies[-1] * 1e3))
+
+def contention_bench(reads, num_devices, readers):
+    hub = Hub(num_devices)
+    print("%d switches, %d readers, %d reads each" %
+          (num_devices, readers, reads))
+    contention_run("locked idle", hub, locked_read, reads, readers)
+    contention_run("snapshot idle", hub, snapshot_read, reads, readers)
+    radio = threading.Thread(target=hub.radio)
+    radio.start()
+    try:
+        contention_run("locked busy", hub, locked_read, reads, readers)
+        contention_run("snapshot busy", hub, snapshot_read, reads, readers)
+    finally:
+        hub.should_stop = True
+        radio.join()
+    return 0
+
+RPC_PORT = 3444
+DEFAULT_CLIENTS = 32
+DEFAULT_READ_SHARE = 0.9
+
+# writes go to this address, so only run the rpc benchmark against a test
+# hub (for example one on the emulator)
+BENCH_DEVICE_ID = 0xbe0c4
+
+READ_CALLS = [ ("list_switches", []), ("list_temp_sensors", []),
+               ("list_buttons", []),
+               ("get_event_log", [None, None, None, None, 10, 0, True]) ]
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def rpc_client(host, calls, read_share, client_no, latencies, lock):
+    conn = http.client.HTTPConnection(host, RPC_PORT)
+    reads = []
+    writes = []
+    errors = 0
+    for i in range(0, calls):
+        if (i * 7 + client_no) % 100 < read_share * 100:
+            method, params = READ_CALLS[i % len(READ_CALLS)]
+            kind = reads
+        else:
+            method = "set_switch"
+            params = [BENCH_DEVICE_ID, client_no % 16, i % 2, True]
+            kind = writes
+        body = json.dumps({ "jsonrpc": "2.0", "method": method,
+                            "params": params, "id": i })
+        start = time.perf_counter()
+        try:
+            conn.request("POST", "/", body,
+                         { "Content-Type": "application/json-rpc" })
+            conn.getresponse().read()
+        except (http.client.HTTPException, OSError):
+            errors += 1
+            conn.close()
+            continue
+        kind.append(time.perf_counter() - start)
+    conn.close()
+    with lock:
+        latencies["read"].extend(reads)
+        latencies["write"].extend(writes)
+        latencies["errors"] += errors
+
+def rpc_bench(host, calls, clients, read_share):
+    latencies = { "read": [], "write": [], "errors": 0 }
+    lock = threading.Lock()
+    threads = [ threading.Thread(target=rpc_client,
+                                 args=(host, calls, read_share, i, latencies,
+                                       lock))
+                for i in range(0, clients) ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print("%d clients, %d calls in %.2f s (%.0f calls/s), %d failed" %
+          (clients, calls * clients, elapsed, calls * clients / elapsed,
+           latencies["errors"]))
+    for kind in ("read", "write"):
+        values = sorted(latencies[kind])
+        if not values:
+            continue
+        print("%-6s %7d calls p50 %7.2f ms p99 %7.2f ms max %7.2f ms" %
+              (kind, len(values), percentile(values, 0.5) * 1e3,
+               percentile(values, 0.99) * 1e3, values[-1] * 1e3))
+    return 0
+
+iterations = DEFAULT_ITERATIONS
+num_devices = DEFAULT_DEVICES
+host = "localhost"
+clients = DEFAULT_CLIENTS
+read_share = DEFAULT_READ_SHARE
+stream = RECORDED_STREAM
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "n:d:s:c:r:f:h")
+    for opt, arg in opts:
+        if opt == '-h':
+            usage(sys.argv[0])
+            sys.exit(0)
+        elif opt == '-n':
+            iterations = int(arg)
+        elif opt == '-d':
+            num_devices = int(arg)
+        elif opt == '-s':
+            host = arg
+        elif opt == '-c':
+            clients = int(arg)
+        elif opt == '-r':
+            read_share = float(arg)
+        elif opt == '-f':
+            # traffic from a capture instead of the built-in sample
+            stream = capture.load_stream(arg)
+        else:
+            assert False
+except getopt.GetoptError as err:
+    print(str(err))
+    usage(sys.argv[0])
+    sys.exit(1)
+
+log.setlogmask(syslog.LOG_UPTO(syslog.LOG_INFO))
+
+ecode = None
+
+if len(args) == 1 and args[0] == "frames":
+    ecode = frames_bench(stream, iterations)
+elif len(args) == 1 and args[0] == "logging":
+    ecode = logging_bench(stream, iterations)
+elif len(args) == 1 and args[0] == "registry":
+    ecode = registry_bench(iterations, num_devices)
+elif len(args) == 1 and args[0] == "rpc":
+    ecode = rpc_bench(host, iterations, clients, read_share)
+elif len(args) == 1 and args[0] == "contention":
+    ecode = contention_bench(iterations, num_devices, clients)
+
+if ecode == None:
+    usage(sys.argv[0])
+    sys.exit(1)
+else:
+    sys.exit(ecode)
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+#
+# Bulk decoder for RF captures.
+#
+# Decodes a whole stream of RFXtrx433 frames at once with NumPy, for
+# analysing long captures offline. Frame boundaries are found from the
+# length bytes, and the fields of temperature and lighting 2 frames are
+# then pulled out of the buffer with array operations, giving one array
+# per field. The results are the same as what Decoder hands its
+# callbacks, which cross_check() verifies frame by frame.
+#
+
+import sys
+import getopt
+import numpy as np
+import capture
+import rfxtrx433
+
+TEMP_SUBTYPES = (rfxtrx433.SUBTYPE_TEMP_LACROSSE,
+                 rfxtrx433.SUBTYPE_TEMP_VIKING_02811)
+
+def frame_offsets(buf):
+    # each frame's position depends on the length of the one before it, so
+    # this part can't be vectorized
+    offsets = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        length = buf[pos] + 1
+        if pos + length > end:
+            break
+        offsets.append(pos)
+        pos += length
+    return np.array(offsets, dtype=np.int64)
+
+def decode(buf):
+    data = np.frombuffer(buf, dtype=np.uint8)
+    offsets = frame_offsets(buf)
+    lengths = data[offsets].astype(np.int64) + 1
+    frames = np.arange(len(offsets))
+    # frames too short to have a subtype are left out, like Decoder does
+    typed = lengths > 2
+    keys = np.full(len(offsets), -1, dtype=np.int64)
+    keys[typed] = (data[offsets[typed] + 1].astype(np.int64) << 8) | \
+        data[offsets[typed] + 2]
+    result = { "frames": len(offsets), "counts": {} }
+    found, counts = np.unique(keys[typed], return_counts=True)
+    for key, n in zip(found, counts):
+        result["counts"][rfxtrx433.type_name(int(key))] = int(n)
+    temp_keys = [ rfxtrx433.handler_key(rfxtrx433.TYPE_TEMP_MESSAGE, s)
+                  for s in TEMP_SUBTYPES ]
+    temp = np.isin(keys, temp_keys) & \
+        (lengths >= rfxtrx433.TempHandler.layout.size)
+    result["temp"] = decode_temp(data, offsets[temp], frames[temp])
+    lighting2 = (keys == rfxtrx433.handler_key(
+            rfxtrx433.TYPE_LIGHTING2_MESSAGE,
+            rfxtrx433.SUBTYPE_LIGHTING2_AC)) & \
+        (lengths >= rfxtrx433.Lighting2Handler.layout.size)
+    result["lighting2"] = decode_lighting2(data, offsets[lighting2],
+                                           frames[lighting2])
+    return result
+
+def field(data, offsets, i):
+    return data[offsets + i].astype(np.int64)
+
+def decode_temp(data, offsets, frames):
+    id_hi = field(data, offsets, 4)
+    id_lo = field(data, offsets, 5)
+    raw_temp = (field(data, offsets, 6) << 8) | field(data, offsets, 7)
+    level = field(data, offsets, 8)
+    temp = (raw_temp & 0x7fff) / 10.0
+    temp = np.where(raw_temp & 0x8000, -temp, temp)
+    # the ids are computed as id_hi<<8 + id_lo, as the Decoder does, which
+    # overflows 64 bits; they are Python ints
+    addr = id_hi.astype(object) << (id_lo.astype(object) + 8)
+    return { "frame": frames, "seq_no": field(data, offsets, 3),
+             "addr": addr, "temp": temp, "signal_level": level >> 4,
+             "battery": level & 0xf }
+
+def decode_lighting2(data, offsets, frames):
+    addr = (field(data, offsets, 4) << 24) | (field(data, offsets, 5) << 16) | \
+        (field(data, offsets, 6) << 8) | field(data, offsets, 7)
+    return { "frame": frames, "seq_no": field(data, offsets, 3),
+             "addr": addr, "unit": field(data, offsets, 8),
+             "state": field(data, offsets, 9),
+             "signal_level": field(data, offsets, 11) >> 4 }
+
+def nop(*args):
+    pass
+
+def cross_check(buf):
+    # runs the stream through Decoder too, and returns the differences
+    temps = []
+    buttons = []
+    decoder = rfxtrx433.Decoder(nop,
+                                lambda *args: temps.append(args),
+                                lambda *args: buttons.append(args))
+    rfxtrx433.FrameReader().feed(buf, decoder.parse_frame)
+    result = decode(buf)
+    t = result["temp"]
+    bulk_temps = list(zip(t["addr"].tolist(), t["seq_no"].tolist(),
+                          t["temp"].tolist(), t["signal_level"].tolist()))
+    b = result["lighting2"]
+    bulk_buttons = list(zip(b["addr"].tolist(), b["unit"].tolist(),
+                            b["state"].tolist()))
+    return diff("temp", temps, bulk_temps) + \
+        diff("lighting2", buttons, bulk_buttons)
+
+def diff(name, expected, got):
+    problems = []
+    if len(expected) != len(got):
+        problems.append("%s: Decoder got %d frames, bulk decoder %d." %
+                        (name, len(expected), len(got)))
+    for i, (e, g) in enumerate(zip(expected, got)):
+        if e != g:
+            problems.append("%s frame %d: Decoder got %s, bulk decoder %s." %
+                            (name, i, e, g))
+    return problems
+
+def usage(name):
+    print("Usage: %s [-c] <capture-file>" % name)
+
+def summary(result):
+    print("%d frames" % result["frames"])
+    for key in sorted(result["counts"].keys()):
+        print("  %s: %d" % (key, result["counts"][key]))
+    t = result["temp"]
+    if len(t["temp"]) > 0:
+        print("temperature: %d readings from %d sensors, %.1f to %.1f" %
+              (len(t["temp"]), len(set(t["addr"].tolist())),
+               t["temp"].min(), t["temp"].max()))
+    b = result["lighting2"]
+    if len(b["state"]) > 0:
+        print("lighting 2: %d commands from %d devices" %
+              (len(b["state"]), len(np.unique(b["addr"]))))
+
+if __name__ == "__main__":
+    check = False
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ch")
+        for opt, arg in opts:
+            if opt == '-h':
+                usage(sys.argv[0])
+                sys.exit(0)
+            elif opt == '-c':
+                check = True
+            else:
+                assert False
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage(sys.argv[0])
+        sys.exit(1)
+    if len(args) != 1:
+        usage(sys.argv[0])
+        sys.exit(1)
+    buf = capture.load_stream(args[0])
+    if check:
+        problems = cross_check(buf)
+        for p in problems:
+            print(p)
+        sys.exit(len(problems) != 0)
+    summary(decode(buf))
@@ -0,0 +1,56 @@
+#
+# RF capture files.
+#
+# A capture is a header followed by one record per frame received from
+# the RFXtrx433: the wall clock time it was read, its length and the frame
+# itself, length byte included, just as it came off the wire.
+#
+
+import struct
+import time
+
+MAGIC = b"RFXCAP\x00\x01"
+RECORD_HEADER = struct.Struct("<dH")
+
+class CaptureError (Exception):
+    pass
+
+class CaptureWriter:
+    def __init__(self, filename):
+        self.filename = filename
+        self.frames = 0
+        self._file = open(filename, "wb")
+        self._file.write(MAGIC)
+    def write(self, frame, t=None):
+        if t == None:
+            t = time.time()
+        self._file.write(RECORD_HEADER.pack(t, len(frame)))
+        self._file.write(frame)
+        self.frames += 1
+    def flush(self):
+        self._file.flush()
+    def close(self):
+        self._file.close()
+
+def read_capture(filename):
+    # yields (time, frame) pairs; a truncated last record, as left by a hub
+    # that didn't shut down cleanly, is ignored
+    f = open(filename, "rb")
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise CaptureError("%s is not a capture file." % filename)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            t, length = RECORD_HEADER.unpack(header)
+            frame = f.read(length)
+            if len(frame) < length:
+                return
+            yield t, frame
+    finally:
+        f.close()
+
+def load_stream(filename):
+    # all frames of a capture back to back, as the device would send them
+    return b"".join(frame for t, frame in read_capture(filename))
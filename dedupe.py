@@ -0,0 +1,54 @@
+#
+# Duplicate frame suppression.
+#
+# Remotes and sensors send every message several times in a row. A
+# message whose key was already seen less than a window ago is a
+# duplicate. Keys are kept in an ordered dict in the order they were
+# first seen, which is also the order they expire in, so both the lookup
+# and expiring old keys are O(1) per message.
+#
+# With several radios, their reader threads share one Deduper, which has
+# a lock for that.
+#
+
+import collections
+import threading
+
+DEFAULT_WINDOW = 1.0
+
+class Deduper:
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.passed = 0
+        self.suppressed = 0
+        self._seen = collections.OrderedDict()
+        self._lock = threading.Lock()
+    def duplicate(self, key, now):
+        with self._lock:
+            return self._duplicate(key, now)
+    def mark(self, key, now):
+        # copies of a message we sent ourselves, heard by another radio,
+        # aren't passed on either
+        with self._lock:
+            self._expire(now)
+            if key not in self._seen:
+                self._seen[key] = now
+    def _expire(self, now):
+        seen = self._seen
+        cutoff = now - self.window
+        while seen:
+            oldest_key, oldest = next(iter(seen.items()))
+            if oldest > cutoff:
+                break
+            del seen[oldest_key]
+    def _duplicate(self, key, now):
+        self._expire(now)
+        seen = self._seen
+        if key in seen:
+            self.suppressed += 1
+            return True
+        # the window starts at the first copy, so a message repeated for
+        # longer than the window gets through once per window
+        seen[key] = now
+        self.passed += 1
+        return False
@@ -0,0 +1,168 @@
+#
+# Fixed-capacity event log.
+#
+# Events are kept in a ring buffer stored as one array per field, with
+# the event type and source names interned. Once full, the oldest event
+# is overwritten. Events are assumed to be appended in time order, which
+# lets time range queries binary search instead of scanning.
+#
+# Every event gets a sequence number, one more than the event before it,
+# which readers use as a cursor to fetch only what is new since last time.
+#
+
+from array import array
+
+NO_ID = -1
+# the id is in _wide_ids; temperature sensor ids can be wider than 64 bits
+WIDE_ID = -2
+
+MIN_ID = -(1 << 63)
+MAX_ID = (1 << 63) - 1
+
+class Interner:
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+    def intern(self, value):
+        value_id = self._ids.get(value)
+        if value_id == None:
+            value_id = len(self.values)
+            self.values.append(value)
+            self._ids[value] = value_id
+        return value_id
+    def lookup(self, value):
+        return self._ids.get(value)
+
+def to_id(v):
+    if v == None:
+        return NO_ID
+    return v
+
+def from_id(v):
+    if v == NO_ID:
+        return None
+    return v
+
+class EventLog:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._times = array('d', [0.0]) * capacity
+        self._types = array('H', [0]) * capacity
+        self._device_ids = array('q', [0]) * capacity
+        self._unit_ids = array('q', [0]) * capacity
+        self._sources = array('L', [0]) * capacity
+        self._values = [None] * capacity
+        self._wide_ids = {}
+        self._type_names = Interner()
+        self._source_names = Interner()
+        self._head = 0
+        self._count = 0
+        self._next_seq = 0
+    def __len__(self):
+        return self._count
+    def clear(self):
+        # sequence numbers keep counting, so cursors stay valid
+        self._head = 0
+        self._count = 0
+        self._values = [None] * self.capacity
+        self._wide_ids = {}
+    def append(self, event_type, event_time, device_id, unit_id, source_name,
+               event_value):
+        if self._count < self.capacity:
+            slot = (self._head + self._count) % self.capacity
+            self._count += 1
+        else:
+            slot = self._head
+            self._head = (self._head + 1) % self.capacity
+        self._times[slot] = event_time
+        self._types[slot] = self._type_names.intern(event_type)
+        device_id = to_id(device_id)
+        if MIN_ID <= device_id <= MAX_ID:
+            self._device_ids[slot] = device_id
+            self._wide_ids.pop(slot, None)
+        else:
+            self._device_ids[slot] = WIDE_ID
+            self._wide_ids[slot] = device_id
+        self._unit_ids[slot] = to_id(unit_id)
+        self._sources[slot] = self._source_names.intern(source_name)
+        self._values[slot] = event_value
+        self._next_seq += 1
+        return self._next_seq - 1
+    def _slot(self, i):
+        return (self._head + i) % self.capacity
+    def _device_id(self, slot):
+        device_id = self._device_ids[slot]
+        if device_id == WIDE_ID:
+            return self._wide_ids[slot]
+        return device_id
+    def _event(self, slot):
+        return (self._type_names.values[self._types[slot]],
+                self._times[slot], from_id(self._device_id(slot)),
+                from_id(self._unit_ids[slot]),
+                self._source_names.values[self._sources[slot]],
+                self._values[slot])
+    def _bisect(self, t):
+        # first position whose time is >= t
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._times[self._slot(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    def __iter__(self):
+        for i in range(0, self._count):
+            yield self._event(self._slot(i))
+    def since(self, cursor, limit=None):
+        # returns (next cursor, number of events lost, events); a cursor of
+        # None just returns the current end of the log
+        first_seq = self._next_seq - self._count
+        if cursor == None:
+            return self._next_seq, 0, []
+        if cursor > self._next_seq:
+            # from before a restart
+            cursor = first_seq
+        lost = 0
+        if cursor < first_seq:
+            lost = first_seq - cursor
+            cursor = first_seq
+        last = self._count
+        if limit != None:
+            last = min(last, cursor - first_seq + limit)
+        events = [ self._event(self._slot(i))
+                   for i in range(cursor - first_seq, last) ]
+        return cursor + len(events), lost, events
+    def query(self, start=None, end=None, event_type=None, device_id=None,
+              limit=None, offset=0, newest_first=False):
+        if start != None:
+            first = self._bisect(start)
+        else:
+            first = 0
+        if end != None:
+            last = self._bisect(end)
+        else:
+            last = self._count
+        type_id = None
+        if event_type != None:
+            type_id = self._type_names.lookup(event_type)
+            if type_id == None:
+                return []
+        positions = range(first, last)
+        if newest_first:
+            positions = reversed(positions)
+        result = []
+        for i in positions:
+            slot = self._slot(i)
+            if type_id != None and self._types[slot] != type_id:
+                continue
+            if device_id != None and self._device_id(slot) != device_id:
+                continue
+            if offset > 0:
+                offset -= 1
+                continue
+            if limit != None and len(result) >= limit:
+                break
+            result.append(self._event(slot))
+        return result
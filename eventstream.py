@@ -0,0 +1,96 @@
+#
+# Live event stream.
+#
+# Clients connect to a TCP port and get every new event as a line of
+# JSON. Each subscriber has a bounded queue and a writer thread of its
+# own, so publishing never blocks: if a subscriber falls too far behind,
+# its oldest queued events are dropped, and it is told how many it lost
+# in a {"lost": n} line before the next event.
+#
+
+import socket
+import threading
+import collections
+import json
+import syslog
+
+DEFAULT_STREAM_PORT = 3445
+DEFAULT_QUEUE_SIZE = 1000
+
+def to_line(seq, event):
+    (event_type, event_time, device_id, unit_id, source_name,
+     event_value) = event
+    return json.dumps({ "seq": seq, "type": event_type, "time": event_time,
+                        "device_id": device_id, "unit_id": unit_id,
+                        "source": source_name, "value": event_value }) + "\n"
+
+class Subscriber (threading.Thread):
+    def __init__(self, stream, sock, addr, queue_size):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.addr = addr
+        self.queue_size = queue_size
+        self._stream = stream
+        self._sock = sock
+        self._queue = collections.deque()
+        self._lost = 0
+        self._cond = threading.Condition()
+    def put(self, seq, event):
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                self._queue.popleft()
+                self._lost += 1
+            self._queue.append((seq, event))
+            self._cond.notify()
+    def run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue:
+                        self._cond.wait()
+                    items = list(self._queue)
+                    self._queue.clear()
+                    lost = self._lost
+                    self._lost = 0
+                lines = []
+                if lost:
+                    lines.append(json.dumps({ "lost": lost }) + "\n")
+                for seq, event in items:
+                    lines.append(to_line(seq, event))
+                self._sock.sendall("".join(lines).encode("UTF-8"))
+        except OSError:
+            pass
+        finally:
+            self._sock.close()
+            self._stream.remove(self)
+
+class EventStream (threading.Thread):
+    def __init__(self, port=DEFAULT_STREAM_PORT, queue_size=DEFAULT_QUEUE_SIZE):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        # replaced rather than modified, so publish() can go without a lock
+        self._subscribers = ()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('', port))
+        self._sock.listen(16)
+    def publish(self, seq, event):
+        for subscriber in self._subscribers:
+            subscriber.put(seq, event)
+    def remove(self, subscriber):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers
+                                      if s is not subscriber)
+        syslog.syslog(syslog.LOG_DEBUG, "Event subscriber %s:%d left." %
+                      subscriber.addr[:2])
+    def run(self):
+        while True:
+            sock, addr = self._sock.accept()
+            subscriber = Subscriber(self, sock, addr, self.queue_size)
+            with self._lock:
+                self._subscribers = self._subscribers + (subscriber, )
+            syslog.syslog(syslog.LOG_DEBUG, "Event subscriber %s:%d joined." %
+                          addr[:2])
+            subscriber.start()
@@ -0,0 +1,214 @@
+#
+# Engine heater planner.
+#
+# A plan says a vehicle should be warm at a target time. The heater is
+# switched on a heating time before that, which depends on the outside
+# temperature when it starts, and off a while after the target. The
+# temperature at the start is forecast from the sensor's history: the
+# change seen over the same hours the day before, added to the current
+# temperature, or, with less than a day of history, the current trend.
+#
+# Plans are indexed by sensor. Every reading from a sensor re-plans all
+# the plans on it in one pass, with one forecast, and the on job is only
+# moved if the start time has drifted enough to matter. Once the heater
+# has been switched on, the plan is left alone. Daily plans move on to
+# the next day once done; others are removed.
+#
+
+import time
+
+MINUTE = 60
+HOUR = 60*60
+DAY = 24*60*60
+
+# how long the heater is left on after the target time
+DEFAULT_OVERRUN = 30*MINUTE
+# a new start time closer than this to the planned one isn't worth
+# moving the job for
+REPLAN_THRESHOLD = 5*MINUTE
+
+class PlanError (Exception):
+    pass
+
+TREND_WINDOW = 3*HOUR
+MAX_TREND_HORIZON = 3*HOUR
+# the history around a point in time that is averaged to get its value
+SAMPLE_WINDOW = 30*MINUTE
+
+def heating_time(temp):
+    # in minutes; unknown temperatures get the longest time
+    if temp == None or temp < -15:
+        return 3*60
+    elif temp < 15:
+        return 30+(-temp+15.0)/30*(2*60+30)
+    else:
+        return 30
+
+class Forecast:
+    # series_fn(start, end) -> [ (t, min, max, mean, count) ... ]
+    def __init__(self, series_fn, now):
+        self.now = now
+        self._series_fn = series_fn
+        recent = series_fn(now - TREND_WINDOW, None)
+        self.current = None
+        self.slope = 0.0
+        if recent:
+            self.current = recent[-1][3]
+            self.slope = trend(recent)
+        self._now_yesterday = self._sample(now - DAY)
+    def _sample(self, t):
+        points = self._series_fn(t - SAMPLE_WINDOW / 2, t + SAMPLE_WINDOW / 2)
+        if not points:
+            return None
+        count = sum(p[4] for p in points)
+        return sum(p[3] * p[4] for p in points) / count
+    def temp(self, t):
+        if self.current == None:
+            return None
+        if t <= self.now:
+            return self.current
+        if self._now_yesterday != None and t - self.now < DAY:
+            then_yesterday = self._sample(t - DAY)
+            if then_yesterday != None:
+                return self.current + then_yesterday - self._now_yesterday
+        horizon = min(t - self.now, MAX_TREND_HORIZON)
+        return self.current + self.slope * horizon
+
+def trend(points):
+    # least squares slope of the means, in degrees per second
+    if len(points) < 2:
+        return 0.0
+    n = sum(p[4] for p in points)
+    mean_t = sum(p[0] * p[4] for p in points) / n
+    mean_v = sum(p[3] * p[4] for p in points) / n
+    var = sum(p[4] * (p[0] - mean_t) ** 2 for p in points)
+    if var == 0:
+        return 0.0
+    cov = sum(p[4] * (p[0] - mean_t) * (p[3] - mean_v) for p in points)
+    return cov / var
+
+class Plan:
+    def __init__(self, name, sensor_id, switch_name, target,
+                 overrun=DEFAULT_OVERRUN, daily=False):
+        self.name = name
+        self.sensor_id = sensor_id
+        self.switch_name = switch_name
+        self.target = target
+        self.overrun = overrun
+        self.daily = daily
+        self.start = None
+        self.forecast = None
+        self.start_job = None
+        self.stop_job = None
+    def __getstate__(self):
+        # the forecast is redone on every reading, and not worth saving
+        state = self.__dict__.copy()
+        state["forecast"] = None
+        return state
+    def stop(self):
+        return self.target + self.overrun
+    def started(self, now):
+        return self.start != None and self.start <= now
+
+class HeaterPlanner:
+    # not thread safe; the hub calls it with its lock held
+    def __init__(self, series_fn, schedule_cb, cancel_cb, changed_cb):
+        # series_fn(sensor_id, start, end) gives the sensor's history,
+        # schedule_cb(when, switch_name, state) adds a job and returns its
+        # id, cancel_cb(job_id) cancels it, and changed_cb(name) is called
+        # when a plan needs saving
+        self.series_fn = series_fn
+        self.schedule_cb = schedule_cb
+        self.cancel_cb = cancel_cb
+        self.changed_cb = changed_cb
+        self.plans = {}
+        self._by_sensor = {}
+        self.replans = 0
+    def __contains__(self, name):
+        return name in self.plans
+    def get(self, name):
+        return self.plans.get(name)
+    def values(self):
+        return self.plans.values()
+    def load(self, plans):
+        for plan in plans:
+            self._index(plan)
+    def _index(self, plan):
+        self.plans[plan.name] = plan
+        self._by_sensor.setdefault(plan.sensor_id, []).append(plan)
+    def add(self, plan, now=None):
+        if now == None:
+            now = time.time()
+        if plan.name in self.plans:
+            self.remove(plan.name, now)
+        self._index(plan)
+        self._update([ plan ], self._forecast(plan.sensor_id, now), now)
+    def remove(self, name, now=None):
+        # a heater that is already on is still switched off in time
+        if now == None:
+            now = time.time()
+        plan = self._drop(name)
+        if not plan.started(now):
+            for job_id in (plan.start_job, plan.stop_job):
+                if job_id != None:
+                    self.cancel_cb(job_id)
+        return plan
+    def _drop(self, name):
+        plan = self.plans.pop(name)
+        plans = self._by_sensor[plan.sensor_id]
+        plans.remove(plan)
+        if not plans:
+            del self._by_sensor[plan.sensor_id]
+        self.changed_cb(name)
+        return plan
+    def reading(self, sensor_id, now=None):
+        plans = self._by_sensor.get(sensor_id)
+        if plans == None:
+            return
+        if now == None:
+            now = time.time()
+        self._update(list(plans), self._forecast(sensor_id, now), now)
+    def _forecast(self, sensor_id, now):
+        def series(start, end):
+            return self.series_fn(sensor_id, start, end)
+        return Forecast(series, now)
+    def _update(self, plans, forecast, now):
+        for plan in plans:
+            if plan.stop() <= now:
+                # its jobs have run, or are about to
+                if not plan.daily:
+                    self._drop(plan.name)
+                    continue
+                while plan.stop() <= now:
+                    plan.target += DAY
+                plan.start = None
+                plan.start_job = None
+                plan.stop_job = None
+            if plan.started(now):
+                continue
+            self._plan(plan, forecast, now)
+    def _plan(self, plan, forecast, now):
+        # the start time depends on the temperature at the start time;
+        # a few rounds settle it
+        start = plan.target - heating_time(forecast.temp(now)) * MINUTE
+        for i in range(0, 3):
+            temp = forecast.temp(max(start, now))
+            start = plan.target - heating_time(temp) * MINUTE
+        start = max(start, now)
+        # only shown, so a new forecast alone doesn't need saving
+        plan.forecast = temp
+        changed = False
+        if plan.start_job == None or \
+                abs(start - plan.start) >= REPLAN_THRESHOLD:
+            if plan.start_job != None:
+                self.cancel_cb(plan.start_job)
+                self.replans += 1
+            plan.start = start
+            plan.start_job = self.schedule_cb(start, plan.switch_name, True)
+            changed = True
+        if plan.stop_job == None:
+            plan.stop_job = self.schedule_cb(plan.stop(), plan.switch_name,
+                                             False)
+            changed = True
+        if changed:
+            self.changed_cb(plan.name)
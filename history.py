@@ -0,0 +1,279 @@
+#
+# Append-only on-disk event history.
+#
+# Events are written as fixed-size records to segment files, which roll
+# over when they reach a certain size or age. Next to every segment is a
+# sparse index holding the time of every INDEX_INTERVAL:th record. A
+# query maps the segments covering the requested time range, and binary
+# searches the index and then the records to find where to start.
+# Segments older than the retention period are removed.
+#
+# The store has a lock of its own, as it is synced from the state store
+# thread while events are appended from the radio threads.
+#
+
+import os
+import mmap
+import struct
+import bisect
+import syslog
+import threading
+
+import log
+
+RECORD = struct.Struct("<d40s16shB5x32s24s")
+RECORD_TIME = struct.Struct("<d")
+INDEX_ENTRY = struct.Struct("<dQ")
+
+INDEX_INTERVAL = 128
+
+DEFAULT_SEGMENT_SIZE = 4*1024*1024
+DEFAULT_SEGMENT_AGE = 24*60*60
+DEFAULT_RETENTION = 365*24*60*60
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+
+VALUE_NONE = 0
+VALUE_INT = 1
+VALUE_FLOAT = 2
+VALUE_STR = 3
+
+NO_ID = -1
+# room for the widest temperature sensor ids
+DEVICE_ID_SIZE = 40
+
+def encode_str(s, size):
+    if s == None:
+        return b''
+    return str(s).encode("UTF-8")[:size]
+
+def decode_str(b):
+    return b.rstrip(b'\0').decode("UTF-8", "ignore")
+
+def encode_value(v):
+    if v == None:
+        return VALUE_NONE, b''
+    elif isinstance(v, int):
+        return VALUE_INT, str(v).encode("UTF-8")
+    elif isinstance(v, float):
+        return VALUE_FLOAT, repr(v).encode("UTF-8")
+    else:
+        return VALUE_STR, encode_str(v, 24)
+
+def decode_value(kind, b):
+    if kind == VALUE_NONE:
+        return None
+    s = decode_str(b)
+    if kind == VALUE_INT:
+        return int(s)
+    elif kind == VALUE_FLOAT:
+        return float(s)
+    else:
+        return s
+
+def encode_record(event_type, event_time, device_id, unit_id, source_name,
+                  event_value):
+    if device_id == None:
+        device_id = NO_ID
+    if unit_id == None:
+        unit_id = NO_ID
+    kind, value = encode_value(event_value)
+    device_id = device_id.to_bytes(DEVICE_ID_SIZE, "little", signed=True)
+    return RECORD.pack(event_time, device_id, encode_str(event_type, 16),
+                       unit_id, kind, encode_str(source_name, 32), value)
+
+def decode_record(buf, offset):
+    (event_time, device_id, event_type, unit_id, kind, source_name,
+     value) = RECORD.unpack_from(buf, offset)
+    device_id = int.from_bytes(device_id, "little", signed=True)
+    if device_id == NO_ID:
+        device_id = None
+    if unit_id == NO_ID:
+        unit_id = None
+    source_name = decode_str(source_name)
+    if source_name == "":
+        source_name = None
+    return (decode_str(event_type), event_time, device_id, unit_id,
+            source_name, decode_value(kind, value))
+
+def segment_start(filename):
+    return int(filename[:-len(SEGMENT_SUFFIX)]) / 1000.0
+
+class Segment:
+    def __init__(self, dirname, start):
+        self.start = start
+        base = os.path.join(dirname, "%016d" % int(start * 1000))
+        self.filename = base + SEGMENT_SUFFIX
+        self.index_filename = base + INDEX_SUFFIX
+    def read_index(self):
+        try:
+            f = open(self.index_filename, "rb")
+        except FileNotFoundError:
+            return [], []
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        times = []
+        records = []
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for t, n in INDEX_ENTRY.iter_unpack(data[:usable]):
+            times.append(t)
+            records.append(n)
+        return times, records
+    def remove(self):
+        for filename in (self.filename, self.index_filename):
+            try:
+                os.unlink(filename)
+            except FileNotFoundError:
+                pass
+
+class HistoryStore:
+    def __init__(self, dirname, segment_size=DEFAULT_SEGMENT_SIZE,
+                 segment_age=DEFAULT_SEGMENT_AGE, retention=DEFAULT_RETENTION):
+        self.dirname = dirname
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.retention = retention
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._segments = [ Segment(dirname, segment_start(f))
+                           for f in sorted(os.listdir(dirname))
+                           if f.endswith(SEGMENT_SUFFIX) ]
+        self._file = None
+        self._index_file = None
+        self._records = 0
+        self._lock = threading.Lock()
+    def _roll(self, event_time):
+        self._close()
+        if self._segments and event_time <= self._segments[-1].start:
+            # keep segment names unique and in order
+            event_time = self._segments[-1].start + 0.001
+        segment = Segment(self.dirname, event_time)
+        self._segments.append(segment)
+        self._file = open(segment.filename, "ab")
+        self._index_file = open(segment.index_filename, "ab")
+        self._records = 0
+        self._purge(event_time)
+    def append(self, event_type, event_time, device_id, unit_id, source_name,
+               event_value):
+        with self._lock:
+            self._append(event_type, event_time, device_id, unit_id,
+                         source_name, event_value)
+    def _append(self, event_type, event_time, device_id, unit_id, source_name,
+                event_value):
+        if self._file == None or \
+                self._records * RECORD.size >= self.segment_size or \
+                event_time - self._segments[-1].start >= self.segment_age:
+            self._roll(event_time)
+        if self._records % INDEX_INTERVAL == 0:
+            self._index_file.write(INDEX_ENTRY.pack(event_time, self._records))
+        self._file.write(encode_record(event_type, event_time, device_id,
+                                       unit_id, source_name, event_value))
+        self._records += 1
+    def sync(self):
+        with self._lock:
+            self._sync()
+    def _sync(self):
+        if self._file != None:
+            self._file.flush()
+            self._index_file.flush()
+    def close(self):
+        with self._lock:
+            self._close()
+    def _close(self):
+        if self._file != None:
+            self._file.close()
+            self._index_file.close()
+            self._file = None
+            self._index_file = None
+    def purge(self, now):
+        with self._lock:
+            self._purge(now)
+    def _purge(self, now):
+        # a segment is only removed once all of it is past retention,
+        # which is when the segment after it starts before the cutoff
+        cutoff = now - self.retention
+        while len(self._segments) > 1 and self._segments[1].start < cutoff:
+            segment = self._segments.pop(0)
+            log.log(syslog.LOG_INFO, "Removing history segment %s.",
+                    segment.filename)
+            segment.remove()
+    def _covering(self, start, end):
+        starts = [ s.start for s in self._segments ]
+        first = 0
+        if start != None:
+            first = max(0, bisect.bisect_right(starts, start) - 1)
+        last = len(starts)
+        if end != None:
+            last = bisect.bisect_left(starts, end)
+        return self._segments[first:last]
+    def query(self, start=None, end=None, event_type=None, device_id=None,
+              limit=None):
+        with self._lock:
+            self._sync()
+            segments = self._covering(start, end)
+        # segments are only appended to, or removed, which the query
+        # copes with, so it doesn't need to hold the lock
+        result = []
+        for segment in segments:
+            if not self._query_segment(segment, start, end, event_type,
+                                       device_id, limit, result):
+                break
+        return result
+    def _query_segment(self, segment, start, end, event_type, device_id, limit,
+                       result):
+        try:
+            f = open(segment.filename, "rb")
+        except FileNotFoundError:
+            return True
+        try:
+            size = os.fstat(f.fileno()).st_size
+            count = size // RECORD.size
+            if count == 0:
+                return True
+            buf = mmap.mmap(f.fileno(), count * RECORD.size,
+                            access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            pos = 0
+            if start != None:
+                pos = self._find(buf, count, segment, start)
+            while pos < count:
+                offset = pos * RECORD.size
+                pos += 1
+                (event_time, ) = RECORD_TIME.unpack_from(buf, offset)
+                if end != None and event_time >= end:
+                    return False
+                event = decode_record(buf, offset)
+                if event_type != None and event[0] != event_type:
+                    continue
+                if device_id != None and event[2] != device_id:
+                    continue
+                if limit != None and len(result) >= limit:
+                    return False
+                result.append(event)
+            return True
+        finally:
+            buf.close()
+    def _find(self, buf, count, segment, t):
+        # the sparse index narrows it down to one block of records, which
+        # is then binary searched
+        times, records = segment.read_index()
+        i = bisect.bisect_left(times, t)
+        lo = 0
+        if i > 0:
+            lo = records[i - 1]
+        hi = count
+        if i < len(records):
+            hi = min(count, records[i])
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (event_time, ) = RECORD_TIME.unpack_from(buf, mid * RECORD.size)
+            if event_time < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
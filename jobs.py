@@ -0,0 +1,132 @@
+#
+# Job scheduler.
+#
+# Jobs set a switch at a given wall clock time. They are kept in a heap
+# ordered by due time, and a thread sleeps until the first one is due,
+# so pending jobs cost nothing until then. The wait is capped, to notice
+# the clock being set. Jobs are saved with the hub state; ones that came
+# due while the hub wasn't running are run or dropped when it starts,
+# according to their missed-job policy.
+#
+
+import heapq
+import threading
+import time
+import syslog
+
+# what to do with a job that came due while the hub was down
+MISSED_RUN = "run"
+MISSED_SKIP = "skip"
+MISSED_POLICIES = (MISSED_RUN, MISSED_SKIP)
+
+DEFAULT_MISSED_POLICY = MISSED_RUN
+# a missed job older than this is dropped even if it would be run
+DEFAULT_MAX_LATENESS = 12*60*60
+
+MAX_SLEEP = 60.0
+
+class Job:
+    def __init__(self, job_id, when, switch_name, state,
+                 missed=DEFAULT_MISSED_POLICY):
+        self.job_id = job_id
+        self.when = when
+        self.switch_name = switch_name
+        self.state = state
+        self.missed = missed
+
+class JobScheduler (threading.Thread):
+    def __init__(self, fire_cb, max_lateness=DEFAULT_MAX_LATENESS):
+        # fire_cb(job) is called from the scheduler thread, without any
+        # lock held, once the job is due and removed
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fire_cb = fire_cb
+        self.max_lateness = max_lateness
+        self.jobs = {}
+        self._heap = []
+        self._next_id = 1
+        self._cond = threading.Condition()
+        self.shouldStop = False
+        self.fired = 0
+        self.missed = 0
+        self.lateness = None
+    def get(self, job_id):
+        with self._cond:
+            return self.jobs.get(job_id)
+    def values(self):
+        with self._cond:
+            return sorted(self.jobs.values(), key=lambda job: job.when)
+    def load(self, jobs, now=None):
+        # returns the jobs that were missed and are dropped
+        if now == None:
+            now = time.time()
+        dropped = []
+        with self._cond:
+            for job in jobs:
+                self._next_id = max(self._next_id, job.job_id + 1)
+                if job.when < now and \
+                        (job.missed == MISSED_SKIP or
+                         now - job.when > self.max_lateness):
+                    self.missed += 1
+                    dropped.append(job)
+                    continue
+                self._add(job)
+        return dropped
+    def add(self, when, switch_name, state, missed=DEFAULT_MISSED_POLICY):
+        assert missed in MISSED_POLICIES
+        with self._cond:
+            job = Job(self._next_id, when, switch_name, state, missed)
+            self._next_id += 1
+            self._add(job)
+            return job
+    def _add(self, job):
+        self.jobs[job.job_id] = job
+        heapq.heappush(self._heap, (job.when, job.job_id))
+        # it may be due before whatever the thread is waiting for
+        self._cond.notify()
+    def cancel(self, job_id):
+        # the heap entry is left, and skipped when it comes up
+        with self._cond:
+            return self.jobs.pop(job_id, None)
+    def _due(self):
+        # caller holds the condition; returns a due job, or how long to wait
+        while self._heap:
+            when, job_id = self._heap[0]
+            job = self.jobs.get(job_id)
+            if job == None or job.when != when:
+                heapq.heappop(self._heap)
+                continue
+            delay = when - time.time()
+            if delay > 0:
+                return None, min(delay, MAX_SLEEP)
+            heapq.heappop(self._heap)
+            del self.jobs[job_id]
+            return job, None
+        return None, MAX_SLEEP
+    def halt(self):
+        with self._cond:
+            self.shouldStop = True
+            self._cond.notify()
+        if self.is_alive():
+            self.join()
+    def run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self.shouldStop:
+                        return
+                    job, timeout = self._due()
+                    if job != None:
+                        break
+                    self._cond.wait(timeout)
+            self.lateness = time.time() - job.when
+            self.fired += 1
+            try:
+                self.fire_cb(job)
+            except Exception as e:
+                syslog.syslog(syslog.LOG_ERR, "Job %d failed: %s" %
+                              (job.job_id, e))
+    def stats(self):
+        with self._cond:
+            return { "pending": len(self.jobs), "fired": self.fired,
+                     "missed": self.missed, "last_lateness": self.lateness }
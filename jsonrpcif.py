@@ -1,17 +1,122 @@
-from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer, \
+    SimpleJSONRPCRequestHandler
 import threading
 import traceback
 import time
+import concurrent.futures
+import txsched
+import tempseries
+import stats
+import rules
+import jobs
+import heater
 
 DEFAULT_PORT=3444
 
+# calls executing at the same time
+DEFAULT_WORKERS=8
+# open connections, each served by a thread of its own; more than this
+# and we stop accepting new ones until one closes
+MAX_CONNECTIONS=64
+KEEPALIVE_TIMEOUT=5
+
+# methods that modify hub state; at most half of the workers may be busy
+# with these, so reads always have workers left to run on
+WRITE_METHODS = set([ "set_switch", "set_switch_name", "set_switch_by_name",
+                      "del_switch", "set_temp_sensor_name", "del_temp_sensor",
+                      "set_button_name", "bind_button", "del_button",
+                      "add_rule", "del_rule", "set_rule_enabled",
+                      "add_job", "cancel_job",
+                      "add_heater_plan", "del_heater_plan",
+                      "multicall" ])
+
+# methods that spend most of their time waiting, and which therefore
+# don't take up a worker
+LONG_POLL_METHODS = set([ "get_events_since" ])
+
+MAX_LONG_POLL = 60
+
+class KeepAliveRequestHandler (SimpleJSONRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # idle persistent connections give their thread back after this long
+    timeout = KEEPALIVE_TIMEOUT
+    def do_POST(self):
+        if not self.is_rpc_path_valid():
+            self.report_404()
+            return
+        try:
+            length = int(self.headers["content-length"])
+            data = self.rfile.read(length).decode("UTF-8")
+            response = self.server._marshaled_dispatch(data)
+            if response == None:
+                response = b''
+            elif isinstance(response, str):
+                response = response.encode("UTF-8")
+            code = 200
+        except Exception as e:
+            traceback.print_exc()
+            response = b''
+            code = 500
+        self.send_response(code)
+        self.send_header("Content-type", "application/json-rpc")
+        self.send_header("Content-length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+        self.wfile.flush()
+
+class PooledJSONRPCServer (SimpleJSONRPCServer):
+    # the listen backlog; connections beyond MAX_CONNECTIONS wait in it
+    # while the accept loop is blocked, rather than being refused
+    request_queue_size = MAX_CONNECTIONS
+    def __init__(self, addr, workers, **kw):
+        SimpleJSONRPCServer.__init__(self, addr,
+                                     requestHandler=KeepAliveRequestHandler,
+                                     **kw)
+        self._pool = concurrent.futures.ThreadPoolExecutor(MAX_CONNECTIONS)
+        self._slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self._workers = threading.BoundedSemaphore(workers)
+        self._write_slots = threading.BoundedSemaphore(max(1, workers // 2))
+    def process_request(self, request, client_address):
+        # blocks the accept loop once all connection threads are busy
+        self._slots.acquire()
+        self._pool.submit(self._process_request, request, client_address)
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+    def _dispatch(self, method, *args):
+        if method in LONG_POLL_METHODS:
+            return SimpleJSONRPCServer._dispatch(self, method, *args)
+        if method in WRITE_METHODS:
+            with self._write_slots:
+                with self._workers:
+                    return SimpleJSONRPCServer._dispatch(self, method, *args)
+        with self._workers:
+            return SimpleJSONRPCServer._dispatch(self, method, *args)
+
+def tx_priority(bulk):
+    if bulk:
+        return txsched.PRIORITY_BULK
+    else:
+        return txsched.PRIORITY_INTERACTIVE
+
 class JSONRPCIf (threading.Thread):
-    def __init__(self, autohub):
+    def __init__(self, autohub, workers=DEFAULT_WORKERS):
         threading.Thread.__init__(self)
         self.daemon = True
         self.autohub = autohub
-        self.server = SimpleJSONRPCServer(('', DEFAULT_PORT),
-                                          logRequests=False)
+        self._methods = {}
+        self.latency = stats.HistogramSet()
+        if workers > 0:
+            self.server = PooledJSONRPCServer(('', DEFAULT_PORT), workers,
+                                              logRequests=False)
+        else:
+            self.server = SimpleJSONRPCServer(('', DEFAULT_PORT),
+                                              logRequests=False)
         for f in [ self.list_temp_sensors, self.list_switches, \
                        self.get_switch, self.set_switch, \
                        self.set_switch_name, self.set_switch_by_name, \
@@ -23,62 +128,84 @@ class JSONRPCIf (threading.Thread):
                        self.set_button_name, \
                        self.bind_button, \
                        self.del_button, \
-                       self.get_event_log]:
-            self.server.register_function(f)
+                       self.get_event_log, \
+                       self.get_events_since, \
+                       self.get_history, \
+                       self.get_temp_series, \
+                       self.get_stats, \
+                       self.list_radio_routes, \
+                       self.list_rules, \
+                       self.add_rule, \
+                       self.del_rule, \
+                       self.set_rule_enabled, \
+                       self.list_jobs, \
+                       self.add_job, \
+                       self.cancel_job, \
+                       self.list_heater_plans, \
+                       self.add_heater_plan, \
+                       self.del_heater_plan]:
+            self.server.register_function(self._timed(f), f.__name__)
+            self._methods[f.__name__] = f
+        self.server.register_function(self._timed(self.multicall),
+                                      "multicall")
+    def _timed(self, f):
+        name = f.__name__
+        def timed(*args, **kw):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kw)
+            finally:
+                self.latency.add(name, time.perf_counter() - start)
+        return timed
+    def get_stats(self):
+        return { "hub": self.autohub.stats(), "rpc": self.latency.to_dict() }
+    def list_radio_routes(self):
+        # the radio that best hears each device; the radio set has a lock
+        # of its own
+        return self.autohub.radios.routes()
     def list_temp_sensors(self):
+        # read off the current snapshot; no need for the lock
         result = []
-        self.autohub.lock()
-        for s in list(self.autohub.temp_sensors.values()):
-            if s.name == None:
-                name = "%d" % s.sensor_id
-            else:
-                name = s.name
-            if s.last_update:
-                age = time.time()-s.last_update
+        now = time.time()
+        for sensor_id, name, temp, last_update in \
+                self.autohub.snapshot.temp_sensors.items:
+            if name == None:
+                name = "%d" % sensor_id
+            if last_update:
+                age = now - last_update
             else:
                 age = None
-            result.append((s.sensor_id, name, s.temp, age))
-        self.autohub.unlock()
+            result.append((sensor_id, name, temp, age))
         return result
     def del_temp_sensor(self, sensor_id):
         self.autohub.lock()
-        sensors = self.autohub.temp_sensors
-        if sensor_id in sensors:
-            del sensors[sensor_id]
-            retval = True
-        else:
-            retval = False
+        retval = self.autohub.del_temp_sensor(sensor_id)
         self.autohub.unlock()
         return retval
     def set_temp_sensor_name(self, sensor_id, name):
         self.autohub.lock()
-        if sensor_id in self.autohub.temp_sensors:
-            self.autohub.temp_sensors[sensor_id].name = name
-            result = True
-        else:
-            result = False
+        result = self.autohub.set_temp_sensor_name(sensor_id, name)
         self.autohub.unlock()
         return result
-    def list_switches(self):
-        result = []
+    def get_temp_series(self, sensor_id, start=None, end=None,
+                        max_points=tempseries.DEFAULT_MAX_POINTS):
         self.autohub.lock()
-        for s in self.autohub.switches:
-            result.append((s.device_id, s.unit_id, s.name, s.state))
+        result = self.autohub.temp_series.series(sensor_id, start, end,
+                                                 max_points)
         self.autohub.unlock()
         return result
+    def list_switches(self):
+        return list(self.autohub.snapshot.switches.items)
     def get_switch(self, device_id, unit_id):
-        self.autohub.lock()
-        if not self.autohub.has_switch(device_id, unit_id):
-            result = [ False, None ]
-        else:
-            s = self.autohub.get_switch(device_id, unit_id)
-            result = [ True, s.state ]
-        self.autohub.unlock()
-        return result
-    def set_switch(self, device_id, unit_id, state):
+        s = self.autohub.snapshot.switches.get((device_id, unit_id))
+        if s == None:
+            return [ False, None ]
+        return [ True, s[3] ]
+    def set_switch(self, device_id, unit_id, state, bulk=False):
         self.autohub.lock()
         try:
-            self.autohub.set_switch(device_id, unit_id, state)
+            self.autohub.set_switch(device_id, unit_id, state,
+                                    tx_priority(bulk))
         except Exception as e:
             traceback.print_exc()
         self.autohub.unlock()
@@ -89,12 +216,12 @@ class JSONRPCIf (threading.Thread):
         except Exception as e:
             traceback.print_exc()
         self.autohub.unlock()
-    def set_switch_by_name(self, name, state):
+    def set_switch_by_name(self, name, state, bulk=False):
         result = None
         self.autohub.lock()
         try:
             if self.autohub.has_switch_by_name(name):
-                self.autohub.set_switch_by_name(name, state)
+                self.autohub.set_switch_by_name(name, state, tx_priority(bulk))
                 result = True
             else:
                 result = False
@@ -103,14 +230,10 @@ class JSONRPCIf (threading.Thread):
         self.autohub.unlock()
         return result
     def get_switch_by_name(self, name):
-        self.autohub.lock()
-        if not self.autohub.has_switch_by_name(name):
-            result = [ False, None ]
-        else:
-            s = self.autohub.get_switch_by_name(name)
-            result = [ True, s.state ]
-        self.autohub.unlock()
-        return result
+        s = self.autohub.snapshot.switches.find(name)
+        if s == None:
+            return [ False, None ]
+        return [ True, s[3] ]
     def del_switch(self, name):
         self.autohub.lock()
         if self.autohub.has_switch_by_name(name):
@@ -121,12 +244,7 @@ class JSONRPCIf (threading.Thread):
         self.autohub.unlock()
         return result
     def list_buttons(self):
-        result = []
-        self.autohub.lock()
-        for b in self.autohub.buttons:
-            result.append((b.device_id, b.unit_id, b.name, b.on_action, b.off_action))
-        self.autohub.unlock()
-        return result
+        return list(self.autohub.snapshot.buttons)
     def set_button_name(self, device_id, unit_id, name):
         self.autohub.lock()
         try:
@@ -149,13 +267,134 @@ class JSONRPCIf (threading.Thread):
         except Exception as e:
             traceback.print_exc()
         self.autohub.unlock()
-    def get_event_log(self):
-        result = []
+    def list_rules(self):
         self.autohub.lock()
-        for e in self.autohub.event_log:
-            result.append((e.event_type, e.event_time, e.device_id,
-                           e.unit_id, e.source_name, e.event_value))
+        result = [ (rule.name, rule.text, rule.enabled, rule.active)
+                   for rule in self.autohub.rules.values() ]
         self.autohub.unlock()
         return result
+    def add_rule(self, name, text):
+        # [ True, None ], or [ False, <what is wrong with the rule> ]
+        self.autohub.lock()
+        try:
+            self.autohub.add_rule(name, text)
+            result = [ True, None ]
+        except rules.RuleError as e:
+            result = [ False, str(e) ]
+        finally:
+            self.autohub.unlock()
+        return result
+    def del_rule(self, name):
+        self.autohub.lock()
+        result = self.autohub.del_rule(name)
+        self.autohub.unlock()
+        return result
+    def set_rule_enabled(self, name, enabled):
+        self.autohub.lock()
+        result = self.autohub.set_rule_enabled(name, enabled)
+        self.autohub.unlock()
+        return result
+    def list_jobs(self):
+        return [ (job.job_id, job.when, job.switch_name, job.state,
+                  job.missed) for job in self.autohub.jobs.values() ]
+    def add_job(self, when, switch_name, state,
+                missed=jobs.DEFAULT_MISSED_POLICY):
+        # [ True, <job id> ], or [ False, <why not> ]
+        if missed not in jobs.MISSED_POLICIES:
+            return [ False, "Unknown missed job policy \"%s\"." % missed ]
+        if self.autohub.snapshot.switches.find(switch_name) == None:
+            return [ False, "No switch \"%s\"." % switch_name ]
+        self.autohub.lock()
+        job = self.autohub.add_job(when, switch_name, state, missed)
+        self.autohub.unlock()
+        return [ True, job.job_id ]
+    def cancel_job(self, job_id):
+        self.autohub.lock()
+        result = self.autohub.cancel_job(job_id)
+        self.autohub.unlock()
+        return result
+    def list_heater_plans(self):
+        self.autohub.lock()
+        result = [ (plan.name, plan.sensor_id, plan.switch_name, plan.target,
+                    plan.start, plan.forecast, plan.daily)
+                   for plan in self.autohub.heaters.values() ]
+        self.autohub.unlock()
+        return result
+    def add_heater_plan(self, name, sensor, switch_name, target, daily=False,
+                        overrun=heater.DEFAULT_OVERRUN):
+        # [ True, <start time> ], or [ False, <why not> ]
+        if self.autohub.snapshot.switches.find(switch_name) == None:
+            return [ False, "No switch \"%s\"." % switch_name ]
+        self.autohub.lock()
+        try:
+            plan = self.autohub.add_heater_plan(name, sensor, switch_name,
+                                                target, overrun, daily)
+            result = [ True, plan.start ]
+        except heater.PlanError as e:
+            result = [ False, str(e) ]
+        finally:
+            self.autohub.unlock()
+        return result
+    def del_heater_plan(self, name):
+        self.autohub.lock()
+        result = self.autohub.del_heater_plan(name)
+        self.autohub.unlock()
+        return result
+    def get_event_log(self, start=None, end=None, event_type=None,
+                      device_id=None, limit=None, offset=0,
+                      newest_first=False):
+        self.autohub.lock()
+        result = self.autohub.event_log.query(start, end, event_type,
+                                              device_id, limit, offset,
+                                              newest_first)
+        self.autohub.unlock()
+        return result
+    def get_events_since(self, cursor, timeout=0, limit=None):
+        # long-polls for up to timeout seconds if there's nothing new
+        deadline = time.time() + min(timeout, MAX_LONG_POLL)
+        self.autohub.lock()
+        try:
+            while True:
+                next_cursor, lost, events = \
+                    self.autohub.event_log.since(cursor, limit)
+                remaining = deadline - time.time()
+                if events or lost or cursor == None or remaining <= 0:
+                    return [ next_cursor, lost, events ]
+                self.autohub.wait_for_event(remaining)
+        finally:
+            self.autohub.unlock()
+    def get_history(self, start=None, end=None, event_type=None,
+                    device_id=None, limit=None):
+        self.autohub.lock()
+        if self.autohub.history != None:
+            result = self.autohub.history.query(start, end, event_type,
+                                                device_id, limit)
+        else:
+            result = None
+        self.autohub.unlock()
+        return result
+    def multicall(self, calls):
+        # runs [method, params] pairs back to back under a single lock
+        # acquisition, so their changes also land in the same flush; a long
+        # poll would hold the lock, and a write slot, while it waits
+        results = []
+        self.autohub.lock()
+        try:
+            for method, params in calls:
+                if method not in self._methods:
+                    results.append([ False, "No such method %s." % method ])
+                    continue
+                if method in LONG_POLL_METHODS:
+                    results.append([ False, "%s can't be part of a "
+                                     "multicall." % method ])
+                    continue
+                try:
+                    results.append([ True, self._methods[method](*params) ])
+                except Exception as e:
+                    traceback.print_exc()
+                    results.append([ False, str(e) ])
+        finally:
+            self.autohub.unlock()
+        return results
     def run(self):
         self.server.serve_forever()
@@ -0,0 +1,101 @@
+#
+# Non-blocking logging.
+#
+# log() checks the priority against the log mask before doing anything
+# else, so a disabled message costs a bit test and no formatting. Enabled
+# messages are queued, unformatted, for a background thread that formats
+# them and hands them to syslog. The queue is bounded; if the writer falls
+# behind, messages are dropped and counted rather than blocking the
+# caller, which may be the radio thread holding the hub lock.
+#
+# Since formatting happens later, on another thread, arguments should not
+# be objects that are modified after the call. A message that fails to
+# format or write is reported on stderr, and the writer goes on with the
+# next one.
+#
+
+import sys
+import syslog
+import threading
+import collections
+import atexit
+
+MAX_QUEUED = 1000
+
+_mask = syslog.LOG_UPTO(syslog.LOG_DEBUG)
+_queue = collections.deque()
+_cond = threading.Condition()
+_dropped = 0
+_writer = None
+
+def setlogmask(mask):
+    global _mask
+    _mask = mask
+    return syslog.setlogmask(mask)
+
+def enabled(priority):
+    return _mask & syslog.LOG_MASK(priority & 0x7) != 0
+
+def log(priority, msg, *args):
+    global _dropped
+    if _mask & syslog.LOG_MASK(priority & 0x7) == 0:
+        return
+    with _cond:
+        if len(_queue) >= MAX_QUEUED:
+            _dropped += 1
+            return
+        _queue.append((priority, msg, args))
+        if _writer == None:
+            _start()
+        _cond.notify()
+
+def _start():
+    global _writer
+    _writer = threading.Thread(target=_run)
+    _writer.daemon = True
+    _writer.start()
+
+def _take():
+    global _dropped
+    with _cond:
+        while not _queue:
+            _cond.wait()
+        records = list(_queue)
+        _queue.clear()
+        dropped = _dropped
+        _dropped = 0
+    return records, dropped
+
+def _write(records, dropped):
+    if dropped:
+        records.insert(0, (syslog.LOG_WARNING, "Dropped %d log messages.",
+                           (dropped, )))
+    for priority, msg, args in records:
+        try:
+            if args:
+                msg = msg % args
+            syslog.syslog(priority, msg)
+        except Exception as e:
+            _report(msg, e)
+
+def _report(msg, e):
+    try:
+        sys.stderr.write("Unable to log %r: %s\n" % (msg, e))
+    except Exception:
+        pass
+
+def _run():
+    while True:
+        _write(*_take())
+
+def flush():
+    # writes whatever is queued from the calling thread
+    global _dropped
+    with _cond:
+        records = list(_queue)
+        _queue.clear()
+        dropped = _dropped
+        _dropped = 0
+    _write(records, dropped)
+
+atexit.register(flush)
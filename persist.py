@@ -0,0 +1,223 @@
+#
+# Incremental persistence of hub state.
+#
+# State is kept as a snapshot plus a journal. Entities that change are
+# marked dirty, and a background thread periodically appends their
+# current state to the journal, so a flush only writes what actually
+# changed. When the journal has grown large (or on close) everything is
+# compacted into a new snapshot, written to a temporary file and renamed
+# into place. The snapshot and journal carry a generation number, so a
+# journal left over from before a compaction is never replayed on top of
+# the newer snapshot.
+#
+
+import os
+import pickle
+import struct
+import threading
+import time
+import collections
+import syslog
+
+DEFAULT_FLUSH_INTERVAL = 10
+MAX_JOURNAL_SIZE = 256*1024
+# how often state that isn't journalled, like sensor readings, is snapshotted
+SNAPSHOT_INTERVAL = 60*60
+
+RECORD_HEADER = struct.Struct("!I")
+
+class Section:
+    def __init__(self, key_fn, lookup_fn, items_fn):
+        self.key_fn = key_fn
+        self.lookup_fn = lookup_fn
+        self.items_fn = items_fn
+
+def fsync_dir(filename):
+    fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_atomically(filename, data):
+    tmp_filename = filename + ".tmp"
+    f = open(tmp_filename, "wb")
+    try:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmp_filename, filename)
+    fsync_dir(filename)
+
+def encode_record(record):
+    data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    return RECORD_HEADER.pack(len(data)) + data
+
+def read_records(filename):
+    # a torn record at the end, from a write that never finished, is
+    # ignored along with anything after it
+    try:
+        f = open(filename, "rb")
+    except FileNotFoundError:
+        return
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    pos = 0
+    while pos + RECORD_HEADER.size <= len(data):
+        (length, ) = RECORD_HEADER.unpack_from(data, pos)
+        pos += RECORD_HEADER.size
+        if pos + length > len(data):
+            syslog.syslog(syslog.LOG_WARNING,
+                          "Ignoring truncated record in %s." % filename)
+            return
+        record = pickle.loads(data[pos:pos + length])
+        pos += length
+        yield record
+
+class StateStore (threading.Thread):
+    def __init__(self, filename, lock, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.snapshot_filename = filename + ".snapshot"
+        self.journal_filename = filename + ".journal"
+        self.flush_interval = flush_interval
+        self._lock = lock
+        self._sections = collections.OrderedDict()
+        self._flush_hooks = []
+        self._dirty = collections.OrderedDict()
+        self._touched = False
+        self._generation = 0
+        self._journal = None
+        self._journal_size = 0
+        self._last_snapshot = time.time()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+    def add_section(self, name, key_fn, lookup_fn, items_fn):
+        self._sections[name] = Section(key_fn, lookup_fn, items_fn)
+    def add_flush_hook(self, fn):
+        # called on every flush interval, for state kept outside the store
+        self._flush_hooks.append(fn)
+    def exists(self):
+        return os.path.exists(self.snapshot_filename)
+    def mark(self, section, key):
+        # caller holds the hub lock
+        self._dirty[(section, key)] = True
+    def touch(self):
+        self._touched = True
+    def load(self):
+        f = open(self.snapshot_filename, "rb")
+        try:
+            self._generation, snapshot = pickle.load(f)
+        finally:
+            f.close()
+        state = {}
+        for name, items in snapshot.items():
+            key_fn = self._sections[name].key_fn
+            state[name] = collections.OrderedDict((key_fn(item), item)
+                                                  for item in items)
+        for name, key, item in self._read_journal():
+            entities = state.setdefault(name, collections.OrderedDict())
+            if item == None:
+                entities.pop(key, None)
+            else:
+                entities[key] = item
+        return dict((name, list(entities.values()))
+                    for name, entities in state.items())
+    def _read_journal(self):
+        generation = None
+        for record in read_records(self.journal_filename):
+            if generation == None:
+                generation = record
+                if generation != self._generation:
+                    syslog.syslog(syslog.LOG_INFO, "Ignoring stale journal.")
+                    return
+            else:
+                yield record
+    def _open_journal(self):
+        header = encode_record(self._generation)
+        write_atomically(self.journal_filename, header)
+        self._journal = open(self.journal_filename, "ab")
+        self._journal_size = len(header)
+    def flush(self, compact=False):
+        with self._flush_lock:
+            with self._lock:
+                if not compact:
+                    compact = self._journal == None or \
+                        self._journal_size > MAX_JOURNAL_SIZE or \
+                        (self._touched and
+                         time.time() - self._last_snapshot > SNAPSHOT_INTERVAL)
+                if not compact and not self._dirty:
+                    return
+                if compact:
+                    snapshot = dict((name, list(section.items_fn()))
+                                    for name, section in
+                                    self._sections.items())
+                    data = pickle.dumps((self._generation + 1, snapshot),
+                                        pickle.HIGHEST_PROTOCOL)
+                else:
+                    data = b''.join(encode_record((name, key,
+                                                  self._sections[name].
+                                                  lookup_fn(key)))
+                                    for name, key in self._dirty)
+                dirty = self._dirty
+                touched = self._touched
+                self._dirty = collections.OrderedDict()
+                if compact:
+                    self._touched = False
+            try:
+                if compact:
+                    self._compact(data)
+                else:
+                    self._write_journal(data)
+            except Exception:
+                with self._lock:
+                    # put the marks back, ahead of any made since, so the
+                    # next flush saves them
+                    dirty.update(self._dirty)
+                    self._dirty = dirty
+                    self._touched = self._touched or touched
+                raise
+    def _write_journal(self, data):
+        try:
+            self._journal.write(data)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        except Exception:
+            # the journal may end in part of a record now; the next flush
+            # starts over with a snapshot
+            journal = self._journal
+            self._journal = None
+            try:
+                journal.close()
+            except OSError:
+                pass
+            raise
+        self._journal_size += len(data)
+    def _compact(self, data):
+        if self._journal != None:
+            self._journal.close()
+            self._journal = None
+        write_atomically(self.snapshot_filename, data)
+        self._generation += 1
+        self._last_snapshot = time.time()
+        self._open_journal()
+    def close(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.flush(compact=True)
+        if self._journal != None:
+            self._journal.close()
+            self._journal = None
+    def run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+                for fn in self._flush_hooks:
+                    fn()
+            except Exception as e:
+                syslog.syslog(syslog.LOG_ERR, "Failed to save state: %s" % e)
@@ -0,0 +1,160 @@
+#
+# A set of transceivers.
+#
+# The hub may have several RFXtrx433s, for coverage, each with its own
+# reader thread. They share one Deduper, so a message heard by more than
+# one of them is only passed on once. Every copy a radio decodes, whether
+# or not it is a duplicate, is reported here with its signal level, and
+# for each device the radio that has heard it best recently is kept.
+#
+# A switch command goes out through the radio that best hears the device
+# at that address. If none has heard it lately, every radio sends it,
+# staggered by a frame's airtime so their repeats don't collide. What
+# one radio sends, the others hear; those copies are marked as seen in
+# the Deduper, so they don't look like button presses, and are not
+# taken as the device being heard either, as that would make the radio
+# that happened to be closest to the sender its route. With a single
+# radio nobody else hears it, so a remote sending the same is real.
+#
+# Times are taken from the same clock as the decoders', which is the
+# capture time when replaying.
+#
+
+import collections
+import threading
+import time
+import txsched
+
+# How long a signal level is trusted for picking a radio.
+ROUTE_MAX_AGE = 3600.0
+# How long after a command is sent copies of it are taken to be ours;
+# long enough for a fanned out command and its repeats to be on air.
+ECHO_WINDOW = 5.0
+
+STAGGER = txsched.FRAME_AIRTIME
+
+class Route:
+    def __init__(self):
+        # radio index -> (signal level, time heard)
+        self.heard = {}
+    def best(self, cutoff):
+        best = None
+        best_level = None
+        best_t = None
+        for i, (level, t) in self.heard.items():
+            if t < cutoff:
+                continue
+            if best == None or (level, t) > (best_level, best_t):
+                best = i
+                best_level = level
+                best_t = t
+        return best, best_level
+
+class RadioSet:
+    def __init__(self, deduper=None, max_age=ROUTE_MAX_AGE):
+        self.deduper = deduper
+        self.max_age = max_age
+        self.names = []
+        self.radios = []
+        self.routed = 0
+        self.fanned_out = 0
+        self.echoes = 0
+        self._routes = {}
+        # (ptype, addr, unit, state) -> when we last sent it, oldest first
+        self._sent = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.clock = time.monotonic
+    def heard_cb(self, index):
+        # the callback for the decoder of radio number index
+        def heard(ptype, addr, unit, payload, level):
+            self.heard(index, ptype, addr, unit, payload, level)
+        return heard
+    def add(self, name, radio):
+        self.names.append(name)
+        self.radios.append(radio)
+    def heard(self, index, ptype, addr, unit, payload, level):
+        now = self.clock()
+        with self._lock:
+            self._expire_sent(now)
+            if (ptype, addr, unit, payload) in self._sent:
+                self.echoes += 1
+                return
+            self._heard((ptype, addr, unit), index, level, now)
+            if unit != None:
+                # a device's units are usually in the same place
+                self._heard((ptype, addr, None), index, level, now)
+    def _heard(self, key, index, level, now):
+        route = self._routes.get(key)
+        if route == None:
+            route = Route()
+            self._routes[key] = route
+        route.heard[index] = (level, now)
+    def _expire_sent(self, now):
+        sent = self._sent
+        cutoff = now - ECHO_WINDOW
+        while sent:
+            oldest_key, oldest = next(iter(sent.items()))
+            if oldest > cutoff:
+                break
+            del sent[oldest_key]
+    def _sending(self, key, now):
+        with self._lock:
+            self._expire_sent(now)
+            # moved to the end, to keep the oldest first
+            self._sent.pop(key, None)
+            self._sent[key] = now
+    def best_radio(self, ptype, addr, unit=None):
+        # index of the radio that hears the device best, or None
+        cutoff = self.clock() - self.max_age
+        with self._lock:
+            for key in ((ptype, addr, unit), (ptype, addr, None)):
+                route = self._routes.get(key)
+                if route != None:
+                    best, level = route.best(cutoff)
+                    if best != None:
+                        return best
+        return None
+    def routes(self):
+        cutoff = self.clock() - self.max_age
+        with self._lock:
+            result = []
+            for (ptype, addr, unit), route in self._routes.items():
+                best, level = route.best(cutoff)
+                if best != None:
+                    result.append((ptype, addr, unit, self.names[best],
+                                   level))
+            return result
+    def set_switch(self, ptype, device_id, unit_id, seq_no, state, priority):
+        if len(self.radios) > 1:
+            key = (ptype, device_id, unit_id, int(bool(state)))
+            now = self.clock()
+            self._sending(key, now)
+            if self.deduper != None:
+                self.deduper.mark(key, now)
+        best = self.best_radio(ptype, device_id, unit_id)
+        if best != None:
+            self.routed += 1
+            self.radios[best].set_switch(device_id, unit_id, seq_no, state,
+                                         priority)
+            return
+        self.fanned_out += 1
+        for i, radio in enumerate(self.radios):
+            radio.set_switch(device_id, unit_id, seq_no, state, priority,
+                             i * STAGGER)
+    def start(self):
+        for radio in self.radios:
+            radio.start()
+    def halt(self):
+        for radio in self.radios:
+            radio.shouldStop = True
+        for radio in self.radios:
+            radio.halt()
+    def stats(self):
+        result = { "radios": dict((name, radio.stats()) for name, radio
+                                  in zip(self.names, self.radios)),
+                   "routed": self.routed, "fanned_out": self.fanned_out,
+                   "echoes": self.echoes }
+        if self.deduper != None:
+            result["dedupe"] = { "passed": self.deduper.passed,
+                                 "suppressed": self.deduper.suppressed }
+        return result
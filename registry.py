@@ -0,0 +1,55 @@
+#
+# Ordered device registry with O(1) lookups.
+#
+# Items are kept in insertion order under a unique key, and are also
+# indexed on a second, not necessarily unique, attribute. Replacing an
+# item under an existing key keeps its position, just like assigning to
+# a list slot did.
+#
+
+class Registry:
+    def __init__(self, key_fn, index_fn):
+        self._key_fn = key_fn
+        self._index_fn = index_fn
+        self._items = {}
+        self._index = {}
+    def _index_add(self, value, key):
+        self._index.setdefault(value, []).append(key)
+    def _index_remove(self, value, key):
+        keys = self._index[value]
+        keys.remove(key)
+        if not keys:
+            del self._index[value]
+    def add(self, item):
+        key = self._key_fn(item)
+        old = self._items.get(key)
+        if old != None:
+            self._index_remove(self._index_fn(old), key)
+        self._items[key] = item
+        self._index_add(self._index_fn(item), key)
+    def remove(self, key):
+        item = self._items.pop(key)
+        self._index_remove(self._index_fn(item), key)
+        return item
+    def get(self, key):
+        return self._items.get(key)
+    def find(self, value):
+        keys = self._index.get(value)
+        if keys:
+            return self._items[keys[0]]
+    def reindex(self, item, old_value):
+        # to be called after the indexed attribute of item has changed
+        key = self._key_fn(item)
+        self._index_remove(old_value, key)
+        self._index_add(self._index_fn(item), key)
+    def load(self, items):
+        self._items = {}
+        self._index = {}
+        for item in items:
+            self.add(item)
+    def __contains__(self, key):
+        return key in self._items
+    def __iter__(self):
+        return iter(self._items.values())
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,70 @@
+#
+# Capture replay.
+#
+# ReplayRadio stands in for RFXtrx433: it feeds the frames of a capture
+# file through a Decoder to the same callbacks, keeping the original
+# spacing between frames, scaled by a speed factor; a speed of 0 replays
+# as fast as possible. Switch commands have nowhere to go, and are only
+# counted.
+#
+
+import threading
+import time
+import syslog
+import capture
+import rfxtrx433
+import txsched
+
+class ReplayRadio (threading.Thread):
+    def __init__(self, filename, temp_cb, button_cb, deduper=None, speed=1.0,
+                 heard_cb=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.filename = filename
+        self.speed = speed
+        self._decoder = rfxtrx433.Decoder(self._handle_status_response,
+                                          temp_cb, button_cb, deduper,
+                                          heard_cb=heard_cb)
+        # repeats are told apart by capture time, not by when they happen
+        # to be replayed
+        self._decoder.clock = self.capture_time
+        self._t = 0
+        self.firmware_rev = None
+        self.frames_replayed = 0
+        self.commands_ignored = 0
+        self.shouldStop = False
+        self._halted = threading.Event()
+    def capture_time(self):
+        return self._t
+    def _handle_status_response(self, firmware_rev):
+        self.firmware_rev = firmware_rev
+    def set_switch(self, device_id, unit_id, seq_no, state,
+                   priority=txsched.PRIORITY_INTERACTIVE, delay=0):
+        self.commands_ignored += 1
+    def stats(self):
+        result = { "frames_replayed": self.frames_replayed,
+                   "commands_ignored": self.commands_ignored,
+                   "decoder": self._decoder.stats() }
+        return result
+    def halt(self):
+        self.shouldStop = True
+        self._halted.set()
+        self.join()
+    def run(self):
+        syslog.syslog(syslog.LOG_INFO, "Replaying %s." % self.filename)
+        start = time.monotonic()
+        first = None
+        for t, frame in capture.read_capture(self.filename):
+            if self.shouldStop:
+                return
+            if first == None:
+                first = t
+            if self.speed > 0:
+                delay = start + (t - first) / self.speed - time.monotonic()
+                if delay > 0 and self._halted.wait(delay):
+                    return
+            self._t = t
+            self._decoder.parse_frame(frame)
+            self.frames_replayed += 1
+        syslog.syslog(syslog.LOG_INFO, "Replay of %s done; %d frames." %
+                      (self.filename, self.frames_replayed))
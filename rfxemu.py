@@ -0,0 +1,258 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+#
+# RFXtrx433 emulator.
+#
+# Speaks the RFXtrx433 protocol on the slave side of a pseudo-terminal,
+# so the hub can be run with -F pointed at it on a machine without the
+# hardware. It answers interface commands, acknowledges lighting 2
+# transmits, and once the hub has asked for status, it sends temperature
+# readings and button presses from a synthetic population of devices, at
+# random with a given average rate, each repeated like a real remote does.
+#
+
+import os
+import sys
+import tty
+import time
+import random
+import getopt
+import heapq
+import signal
+import selectors
+import rfxtrx433
+
+DEFAULT_RATE = 1.0
+DEFAULT_SENSORS = 8
+DEFAULT_BUTTONS = 4
+DEFAULT_REPEATS = 3
+REPEAT_INTERVAL = 0.05
+FIRMWARE_REV = 0x45
+MAX_OUTPUT = 64*1024
+
+SENSOR_ID_BASE = 0x1000
+BUTTON_ID_BASE = 0x3c0000
+
+class Emulator:
+    def __init__(self, rate=DEFAULT_RATE, sensors=DEFAULT_SENSORS,
+                 buttons=DEFAULT_BUTTONS, repeats=DEFAULT_REPEATS, seed=None):
+        self.rate = rate
+        self.repeats = repeats
+        self._random = random.Random(seed)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.slave_name = os.ttyname(self.slave)
+        self.temps = dict((SENSOR_ID_BASE + i,
+                           self._random.uniform(-10, 25))
+                          for i in range(0, sensors))
+        self.buttons = [ (BUTTON_ID_BASE + i // 16, i % 16)
+                         for i in range(0, buttons) ]
+        self.enabled = False
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.commands = 0
+        self.transmits = 0
+        self._seq = 0
+        self._in = bytearray()
+        self._out = bytearray()
+        self._queue = []
+        self._order = 0
+        self._next_message = None
+    def _next_seq(self):
+        self._seq = (self._seq + 1) % 256
+        return self._seq
+    def _send(self, frame):
+        if len(self._out) + len(frame) > MAX_OUTPUT:
+            # the hub isn't reading
+            self.frames_dropped += 1
+            return
+        self._out.extend(frame)
+        self.frames_sent += 1
+    def _schedule(self, due, frame):
+        self._order += 1
+        heapq.heappush(self._queue, (due, self._order, frame))
+    def _interface_response(self, seq_no, cmd):
+        return bytes([ 0x0d, rfxtrx433.TYPE_INTERFACE_MESSAGE,
+                       rfxtrx433.SUBTYPE_INTERFACE_RESPONSE, seq_no, cmd,
+                       0x53, FIRMWARE_REV, 0, 0, 0, 0, 0, 0, 0 ])
+    def _transmitter_response(self, seq_no):
+        return bytes([ 0x04, rfxtrx433.TYPE_TRANSMITTER_MESSAGE,
+                       rfxtrx433.SUBTYPE_TRANSMITTER_RESPONSE, seq_no,
+                       rfxtrx433.TRANSMITTER_ACK ])
+    def _handle_packet(self, packet):
+        if len(packet) < 3:
+            return
+        ptype = packet[0]
+        seq_no = packet[2]
+        if ptype == rfxtrx433.TYPE_INTERFACE_CONTROL and len(packet) >= 4:
+            self.commands += 1
+            cmd = packet[3]
+            if cmd == rfxtrx433.COMMAND_RESET:
+                # quiet until asked for status again
+                self.enabled = False
+                self._queue = []
+                self._next_message = None
+                return
+            self._send(self._interface_response(seq_no, cmd))
+            if cmd == rfxtrx433.COMMAND_STATUS and not self.enabled:
+                self.enabled = True
+                self._next_message = time.monotonic()
+        elif ptype == rfxtrx433.TYPE_LIGHTING2_MESSAGE:
+            self.transmits += 1
+            self._send(self._transmitter_response(seq_no))
+    def _handle_input(self):
+        try:
+            data = os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        self._in.extend(data)
+        while self._in:
+            length = self._in[0]
+            if length == 0:
+                # the hub writes a two-byte length; the high byte reads as
+                # an empty packet
+                del self._in[0]
+                continue
+            if len(self._in) < length + 1:
+                break
+            packet = bytes(self._in[1:length + 1])
+            del self._in[:length + 1]
+            self._handle_packet(packet)
+    def _flush_output(self):
+        try:
+            n = os.write(self.master, self._out)
+        except (BlockingIOError, OSError):
+            return
+        del self._out[:n]
+    def _temp_frame(self, sensor_id):
+        temp = self.temps[sensor_id] + self._random.uniform(-0.3, 0.3)
+        self.temps[sensor_id] = temp
+        t = int(round(abs(temp) * 10))
+        hi = (t >> 8) & 0x7f
+        if temp < 0:
+            hi |= 0x80
+        return bytes([ 0x08, rfxtrx433.TYPE_TEMP_MESSAGE,
+                       rfxtrx433.SUBTYPE_TEMP_LACROSSE, self._next_seq(),
+                       sensor_id >> 8, sensor_id & 0xff, hi, t & 0xff,
+                       0x69 ])
+    def _button_frame(self, device_id, unit_id):
+        state = self._random.randint(0, 1)
+        return bytes([ 0x0b, rfxtrx433.TYPE_LIGHTING2_MESSAGE,
+                       rfxtrx433.SUBTYPE_LIGHTING2_AC, self._next_seq() ]) + \
+            device_id.to_bytes(4, 'big') + \
+            bytes([ unit_id, state, 0x0f, 0x70 ])
+    def _generate(self, now):
+        population = len(self.temps) + len(self.buttons)
+        if population == 0:
+            return
+        i = self._random.randrange(0, population)
+        if i < len(self.temps):
+            frame = self._temp_frame(list(self.temps.keys())[i])
+        else:
+            frame = self._button_frame(*self.buttons[i - len(self.temps)])
+        for n in range(0, self.repeats):
+            self._schedule(now + n * REPEAT_INTERVAL, frame)
+    def _timeout(self, now):
+        due = None
+        if self._queue:
+            due = self._queue[0][0]
+        if self._next_message != None and \
+                (due == None or self._next_message < due):
+            due = self._next_message
+        if due == None:
+            return None
+        return max(0, due - now)
+    def run(self, duration=None):
+        sel = selectors.DefaultSelector()
+        sel.register(self.master, selectors.EVENT_READ)
+        end = None
+        if duration != None:
+            end = time.monotonic() + duration
+        try:
+            while True:
+                now = time.monotonic()
+                if end != None and now >= end:
+                    return
+                if self.enabled and self.rate > 0 and \
+                        self._next_message != None and \
+                        self._next_message <= now:
+                    self._generate(now)
+                    self._next_message = now + \
+                        self._random.expovariate(self.rate)
+                while self._queue and self._queue[0][0] <= now:
+                    self._send(heapq.heappop(self._queue)[2])
+                events = selectors.EVENT_READ
+                if self._out:
+                    events |= selectors.EVENT_WRITE
+                sel.modify(self.master, events)
+                timeout = self._timeout(now)
+                if end != None:
+                    if timeout == None:
+                        timeout = end - now
+                    timeout = min(timeout, end - now)
+                for key, mask in sel.select(timeout):
+                    if mask & selectors.EVENT_READ:
+                        self._handle_input()
+                    if mask & selectors.EVENT_WRITE:
+                        self._flush_output()
+        finally:
+            sel.close()
+
+def usage(name):
+    print("Usage: %s [-r <messages-per-s>] [-s <sensors>] [-b <buttons>] "
+          "[-n <repeats>] [-t <duration>] [-S <seed>]" % name)
+
+def print_stats(emu):
+    sys.stderr.write("%d frames sent, %d dropped, %d commands, "
+                     "%d transmits.\n" % (emu.frames_sent, emu.frames_dropped,
+                                          emu.commands, emu.transmits))
+
+def quit(signum, frame):
+    sys.exit(0)
+
+if __name__ == "__main__":
+    rate = DEFAULT_RATE
+    sensors = DEFAULT_SENSORS
+    buttons = DEFAULT_BUTTONS
+    repeats = DEFAULT_REPEATS
+    duration = None
+    seed = None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "r:s:b:n:t:S:h", ["help"])
+        for o, a in opts:
+            if o == "-r":
+                rate = float(a)
+            elif o == "-s":
+                sensors = int(a)
+            elif o == "-b":
+                buttons = int(a)
+            elif o == "-n":
+                repeats = int(a)
+            elif o == "-t":
+                duration = float(a)
+            elif o == "-S":
+                seed = int(a)
+            elif o in ("-h", "--help"):
+                usage(sys.argv[0])
+                sys.exit(0)
+            else:
+                assert False, "unhandled option"
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage(sys.argv[0])
+        sys.exit(1)
+    if len(args) != 0:
+        usage(sys.argv[0])
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, quit)
+    signal.signal(signal.SIGINT, quit)
+    emu = Emulator(rate, sensors, buttons, repeats, seed)
+    # the hub is pointed at this
+    print(emu.slave_name)
+    sys.stdout.flush()
+    try:
+        emu.run(duration)
+    finally:
+        print_stats(emu)
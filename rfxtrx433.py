@@ -6,6 +6,12 @@ import time
 import threading
 import syslog
 import struct
+import os
+import selectors
+import txsched
+import log
+import stats
+import capture
 
 TYPE_INTERFACE_CONTROL = 0x0
 SUBTYPE_INTERFACE_COMMAND = 0x0
@@ -17,6 +23,10 @@ COMMAND_ENABLE_ALL = 0x4
 TYPE_INTERFACE_MESSAGE = 0x1
 SUBTYPE_INTERFACE_RESPONSE = 0x0
 
+TYPE_TRANSMITTER_MESSAGE = 0x2
+SUBTYPE_TRANSMITTER_RESPONSE = 0x1
+TRANSMITTER_ACK = 0x0
+
 TYPE_TEMP_MESSAGE = 0x50
 SUBTYPE_TEMP_LACROSSE = 0x5
 SUBTYPE_TEMP_VIKING_02811 = 0x7
@@ -34,12 +44,115 @@ TYPE_REMOTE_MESSAGE = 0x30
 def to_byte(v):
     return v.to_bytes(1, 'big')
 
+# Handlers decode one (type, subtype) of packet. The layout is unpacked
+# from the whole frame, length byte included, and the resulting fields
+# are passed to handle() along with the decoder, whose callbacks the
+# handler calls.
+class PacketHandler:
+    layout = struct.Struct("")
+    def handle(self, decoder, fields):
+        pass
+
+class TempHandler (PacketHandler):
+    # seq no, id (2 bytes), temperature, signal level and battery
+    layout = struct.Struct(">3xBBBHB")
+    def handle(self, decoder, fields):
+        seq_no, id_hi, id_lo, raw_temp, level = fields
+        # not (id_hi << 8) + id_lo, but sensor ids have always been
+        # computed like this, and changing it would orphan named sensors
+        addr = id_hi<<8 + id_lo
+        temp = (raw_temp & 0x7fff) / 10.0
+        if raw_temp & 0x8000:
+            temp = -temp
+        decoder.heard(TYPE_TEMP_MESSAGE, addr, None, temp, level >> 4)
+        if decoder.duplicate(TYPE_TEMP_MESSAGE, addr, None, temp):
+            return
+        decoder.temp_cb(addr, seq_no, temp, level >> 4)
+        if level & 0xf == 0:
+            log.log(syslog.LOG_WARNING, "Battery for sensor %d is low.", addr)
+
+class Lighting2Handler (PacketHandler):
+    # seq no, device address, unit, state and signal level
+    layout = struct.Struct(">3xBIBBxB")
+    def handle(self, decoder, fields):
+        seq_no, addr, unit, state, level = fields
+        decoder.heard(TYPE_LIGHTING2_MESSAGE, addr, unit, state, level >> 4)
+        if decoder.duplicate(TYPE_LIGHTING2_MESSAGE, addr, unit, state):
+            return
+        log.log(syslog.LOG_DEBUG, "Lighting 2 - AC type message received. Seqno %d, device address 0x%x, unit %d, state %d, signal_level %d.", seq_no, addr, unit, state, level >> 4)
+        decoder.button_cb(addr, unit, state)
+
+class TransmitterHandler (PacketHandler):
+    # seq no and status
+    layout = struct.Struct(">3xBB")
+    def handle(self, decoder, fields):
+        seq_no, status = fields
+        if status == TRANSMITTER_ACK:
+            decoder.tx_acked += 1
+        else:
+            decoder.tx_failed += 1
+            log.log(syslog.LOG_WARNING, "Transmit %d failed; response 0x%x.",
+                    seq_no, status)
+
+class InterfaceResponseHandler (PacketHandler):
+    # command and firmware revision
+    layout = struct.Struct(">4xBxB")
+    def handle(self, decoder, fields):
+        cmd, firmware_rev = fields
+        if cmd == COMMAND_STATUS:
+            decoder.status_cb(firmware_rev)
+        else:
+            log.log(syslog.LOG_DEBUG,
+                    "Unknown interface response for command 0x%x", cmd)
+
+class UndecodedHandler (PacketHandler):
+    layout = struct.Struct(">3x")
+    def handle(self, decoder, fields):
+        log.log(syslog.LOG_DEBUG, "Undecoded message: %s",
+                bytes(decoder.packet_data[3:]).hex())
+
+HANDLERS = {}
+
+def handler_key(ptype, subtype):
+    return ptype << 8 | subtype
+
+def register_handler(ptype, subtype, handler):
+    # for adding device types; replaces any handler already registered
+    HANDLERS[handler_key(ptype, subtype)] = handler
+
+register_handler(TYPE_INTERFACE_MESSAGE, SUBTYPE_INTERFACE_RESPONSE,
+                 InterfaceResponseHandler())
+register_handler(TYPE_UNDECODED_MESSAGE, SUBTYPE_UNDECODED_LACROSSE,
+                 UndecodedHandler())
+register_handler(TYPE_TEMP_MESSAGE, SUBTYPE_TEMP_LACROSSE, TempHandler())
+register_handler(TYPE_TEMP_MESSAGE, SUBTYPE_TEMP_VIKING_02811, TempHandler())
+register_handler(TYPE_LIGHTING2_MESSAGE, SUBTYPE_LIGHTING2_AC,
+                 Lighting2Handler())
+register_handler(TYPE_TRANSMITTER_MESSAGE, SUBTYPE_TRANSMITTER_RESPONSE,
+                 TransmitterHandler())
+
 class Decoder:
-    def __init__(self, status_cb, temp_cb, button_cb):
+    def __init__(self, status_cb, temp_cb, button_cb, deduper=None,
+                 handlers=HANDLERS, heard_cb=None):
         self.packet_data = bytearray()
         self.status_cb = status_cb
         self.temp_cb = temp_cb
         self.button_cb = button_cb
+        self.deduper = deduper
+        self.handlers = handlers
+        self.heard_cb = heard_cb
+        self.clock = time.monotonic
+        self.type_counts = {}
+        self.short = 0
+        self.unknown = 0
+        self.tx_acked = 0
+        self.tx_failed = 0
+        self.parse_time = stats.Histogram()
+    def stats(self):
+        return { "frames": stats.counts_to_dict(self.type_counts, type_name),
+                 "short": self.short, "unknown": self.unknown,
+                 "tx_acked": self.tx_acked, "tx_failed": self.tx_failed,
+                 "parse": self.parse_time.to_dict() }
     def packet_done(self):
         data_len = len(self.packet_data)
         return data_len > 0 and data_len == (self.packet_data[0] + 1)
@@ -51,95 +164,106 @@ class Decoder:
             return True
         else:
             return False
-    def get_byte(self, index):
-        return self.packet_data[index]
-    def get_uint(self, index):
-        return struct.unpack_from("!I", self.packet_data, index)[0]
+    def parse_frame(self, frame):
+        pending = self.packet_data
+        self.packet_data = frame
+        try:
+            self.parse_packet()
+        finally:
+            self.packet_data = pending
+    def heard(self, ptype, addr, unit, payload, level):
+        # every copy of a message, before duplicates are dropped
+        if self.heard_cb != None:
+            self.heard_cb(ptype, addr, unit, payload, level)
+    def duplicate(self, ptype, addr, unit, payload):
+        # repeats of a message, identical except for seq no and signal level
+        if self.deduper == None:
+            return False
+        return self.deduper.duplicate((ptype, addr, unit, payload),
+                                      self.clock())
     def parse_packet(self):
-        if len(self.packet_data) <= 1:
-            syslog.syslog(syslog.LOG_WARNING, "Got too short packet (%d bytes)." % len(self.packet_data))
+        # timed including the callbacks
+        start = time.perf_counter()
+        try:
+            self._parse_packet()
+        finally:
+            self.parse_time.add(time.perf_counter() - start)
+    def _parse_packet(self):
+        data = self.packet_data
+        if len(data) <= 2:
+            self.short += 1
+            log.log(syslog.LOG_WARNING, "Got too short packet (%d bytes).",
+                    len(data))
             return
-        ptype = self.get_byte(1)
-        if ptype == TYPE_INTERFACE_MESSAGE:
-            self.parse_interface_control()
-        elif ptype == TYPE_UNDECODED_MESSAGE:
-            self.parse_undecoded()
-        elif ptype == TYPE_TEMP_MESSAGE:
-            self.parse_temp()
-        elif ptype == TYPE_LIGHTING2_MESSAGE:
-            self.parse_lighting2()
-        else:
-            syslog.syslog(syslog.LOG_DEBUG, "Unknown packet type 0x%x" % ptype)
-    def parse_temp(self):
-        subtype = self.get_byte(2)
-        if subtype == SUBTYPE_TEMP_LACROSSE or SUBTYPE_TEMP_VIKING_02811:
-            seq_no = self.get_byte(3)
-            addr = self.get_byte(4)<<8 + self.get_byte(5)
-            if (self.get_byte(6) & 0x80) == 0:
-                temp = (self.get_byte(6)*256+self.get_byte(7)) / 10.0
-            else:
-                temp = - ((self.get_byte(6) & 0x7F)*256 + self.get_byte(7)) / 10.0
-            signal_level = (self.get_byte(8) & 0xf0) >> 4
-            self.temp_cb(addr, seq_no, temp, signal_level)
-            if self.get_byte(8) & 0xf == 0:
-                syslog.syslog(syslog.LOG_WARNING,
-                              "Battery for sensor %d is low." % addr)
-        else:
-            syslog.syslog(syslog.LOG_DEBUG,
-                          "Unknown temperature message subtype 0x%x" % subtype)
-    def parse_lighting2(self):
-        subtype = self.get_byte(2)
-        if subtype == SUBTYPE_LIGHTING2_AC:
-            seq_no = self.get_byte(3)
-            addr = self.get_uint(4)
-            unit = self.get_byte(8)
-            state = self.get_byte(9)
-            signal_level = (self.get_byte(11) & 0xf0) >> 4
-            syslog.syslog(syslog.LOG_DEBUG, "Lighting 2 - AC type message received. Seqno %d, device address 0x%x, unit %d, state %d, signal_level %d." % (seq_no, addr, unit, state, signal_level))
-            self.button_cb(addr, unit, state)
-        else:
-            syslog.syslog(syslog.LOG_WARNING,
-                          "Unknown Lighting 2 subtype 0x%x" % state)
-    def parse_undecoded(self):
-        subtype = self.get_byte(2)
-        if subtype == SUBTYPE_UNDECODED_LACROSSE:
-            msg = ""
-            for b in self.packet_data[2:]:
-                msg += ("%d " % b)
-            msg += "\n"
-            for b in self.packet_data[2:]:
-                msg += ("[%d %d] " % (b&0xf, (b>>4)&0xf))
-            msg += "\n"
-            for b in self.packet_data[2:]:
-                for i in range(7, -1, -1):
-                    if (b >> i) & 1 == 1:
-                        msg += "1"
-                    else:
-                        msg += "0"
-                msg += " "
-            msg += "\n"
-        else:
-            syslog.syslog(syslog.LOG_DEBUG,
-                          "Unknown undecoded message subtype 0x%x" % subtype)
-        
-    def parse_interface_control(self):
-        subtype = self.get_byte(2)
-        if subtype == SUBTYPE_INTERFACE_RESPONSE:
-            self.parse_interface_response()
-        else:
-            syslog.syslog(syslog.LOG_DEBUG,
-                          "Unknown interface control packet 0x%x" % subtype)
-    def parse_interface_response(self):
-        cmd = self.get_byte(4)
-        if cmd == COMMAND_STATUS:
-            firmware_rev = self.get_byte(6)
-            self.status_cb(firmware_rev)
-        else:
-            syslog.syslog(syslog.LOG_DEBUG,
-                          "Unknown interface response for command 0x%x" % cmd)
+        key = data[1] << 8 | data[2]
+        counts = self.type_counts
+        counts[key] = counts.get(key, 0) + 1
+        handler = self.handlers.get(key)
+        if handler == None:
+            self.unknown += 1
+            log.log(syslog.LOG_DEBUG, "Unknown packet type 0x%x/0x%x",
+                    data[1], data[2])
+            return
+        layout = handler.layout
+        if len(data) < layout.size:
+            self.short += 1
+            log.log(syslog.LOG_WARNING, "Got too short packet (%d bytes).",
+                    len(data))
+            return
+        handler.handle(self, layout.unpack_from(data))
     def reset(self):
         self.packet_data = bytearray()
 
+def type_name(key):
+    return "0x%02x/0x%02x" % (key >> 8, key & 0xff)
+
+FRAME_BUFFER_SIZE = 4096
+
+# Accumulates bytes read from the device in a single preallocated buffer,
+# and hands out complete length-prefixed frames as memoryview slices of
+# it. A frame view is only valid until the next fill() or feed().
+class FrameReader:
+    def __init__(self, size=FRAME_BUFFER_SIZE):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._len = 0
+    def fill(self, dev):
+        n = dev.in_waiting
+        if n <= 0:
+            n = 1
+        n = min(n, len(self._buf) - self._len)
+        got = dev.readinto(self._view[self._len:self._len + n])
+        if got:
+            self._len += got
+        return got
+    def feed(self, data, frame_cb):
+        data = memoryview(data)
+        count = 0
+        while len(data) > 0:
+            n = min(len(data), len(self._buf) - self._len)
+            self._view[self._len:self._len + n] = data[:n]
+            self._len += n
+            data = data[n:]
+            count += self.process(frame_cb)
+        return count
+    def process(self, frame_cb):
+        buf = self._buf
+        view = self._view
+        end = self._len
+        pos = 0
+        count = 0
+        while pos < end:
+            frame_len = buf[pos] + 1
+            if pos + frame_len > end:
+                break
+            frame_cb(view[pos:pos + frame_len])
+            pos += frame_len
+            count += 1
+        if pos > 0:
+            view[0:end - pos] = view[pos:end]
+            self._len = end - pos
+        return count
+
 def pad(ary, plen):
     while len(ary) < plen:
         ary += b'\x00'
@@ -149,15 +273,31 @@ RESEND_TIMES = 3
 RESEND_DELAY = 0.15
 
 class RFXtrx433 (threading.Thread):
-    def __init__(self, dev_filename, temp_cb, button_cb):
+    def __init__(self, dev_filename, temp_cb, button_cb, deduper=None,
+                 capture_filename=None, heard_cb=None):
         threading.Thread.__init__(self)
         self.daemon = True
         self.dev_filename = dev_filename
         self._seq = 1
+        # without a deduper every repeat is passed on
         self._decoder = Decoder(self._handle_status_response,
-                                temp_cb, button_cb)
+                                temp_cb, button_cb, deduper,
+                                heard_cb=heard_cb)
+        self._reader = FrameReader()
+        # every frame read is also written to the capture file, if any
+        self._capture = None
+        self._frame_cb = self._decoder.parse_frame
+        if capture_filename != None:
+            self._capture = capture.CaptureWriter(capture_filename)
+            self._frame_cb = self._record_frame
+        self.bytes_read = 0
+        self.frames_written = 0
         self.firmware_rev = None
         self.shouldStop = False
+        self._scheduler = txsched.TxScheduler(RESEND_TIMES, RESEND_DELAY)
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
     def init(self):
         self._open()
         self._reset()
@@ -169,11 +309,18 @@ class RFXtrx433 (threading.Thread):
         self._process_response()
     def close(self):
         self._dev.close()
-    def set_switch(self, device_id, unit_id, seq_no, state):
-        for i in range(0, RESEND_TIMES):
-            self._set_switch(device_id, unit_id, seq_no, state)
-            time.sleep(RESEND_DELAY)
-    def _set_switch(self, device_id, unit_id, seq_no, state):
+        if self._capture != None:
+            self._capture.close()
+    def _record_frame(self, frame):
+        self._capture.write(frame)
+        self._decoder.parse_frame(frame)
+    def set_switch(self, device_id, unit_id, seq_no, state,
+                   priority=txsched.PRIORITY_INTERACTIVE, delay=0):
+        payload = self._switch_payload(device_id, unit_id, seq_no, state)
+        self._scheduler.submit((device_id, unit_id), payload, priority,
+                               time.monotonic() + delay)
+        self._wake()
+    def _switch_payload(self, device_id, unit_id, seq_no, state):
         # we assume all switches are "lighting 2" type
         if state:
             state_code = 1
@@ -190,7 +337,31 @@ class RFXtrx433 (threading.Thread):
                               0, # dim value
                               0, # dunno
                               )
-        self._write_packet(payload)
+        return payload
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            pass # a wakeup is already pending
+    def _handle_wakeup(self):
+        try:
+            while os.read(self._wake_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+    def _handle_readable(self):
+        got = self._reader.fill(self._dev)
+        if got:
+            self.bytes_read += got
+            self._reader.process(self._frame_cb)
+            if self._capture != None:
+                self._capture.flush()
+    def _flush_tx(self):
+        while True:
+            payload = self._scheduler.next_packet(time.monotonic())
+            if payload == None:
+                break
+            self._write_packet(payload)
     def _open(self):
         self._dev = serial.Serial(port=self.dev_filename,
                                   parity=serial.PARITY_NONE,
@@ -210,6 +381,7 @@ class RFXtrx433 (threading.Thread):
         packet += payload
         self._dev.write(packet)
         self._dev.flush()
+        self.frames_written += 1
     def _reset(self):
         syslog.syslog(syslog.LOG_DEBUG,
                       "Resetting device.")
@@ -237,19 +409,43 @@ class RFXtrx433 (threading.Thread):
                            to_byte(SUBTYPE_INTERFACE_COMMAND) +
                            self._nextSeq() + to_byte(cmd))
     def _process_response(self):
-        completed = False
-        while not completed:
-            c = self._dev.read(1)
-            if not c:
+        while True:
+            got = self._reader.fill(self._dev)
+            if not got:
                 return # timeout
-            completed = self._decoder.put_char(c)
+            self.bytes_read += got
+            if self._reader.process(self._frame_cb) > 0:
+                return
+    def stats(self):
+        result = { "bytes_read": self.bytes_read,
+                   "frames_written": self.frames_written,
+                   "sent": self._scheduler.sent,
+                   "resent": self._scheduler.resent,
+                   "superseded": self._scheduler.superseded,
+                   "pending": self._scheduler.pending(),
+                   "firmware_rev": self.firmware_rev,
+                   "decoder": self._decoder.stats() }
+        return result
     def halt(self):
         self.shouldStop = True
-        self._dev.close()
+        self._wake()
         self.join()
     def run(self):
         self.init()
-        while not self.shouldStop:
-            self._process_response()
+        # from here on the selector does all the waiting
+        self._dev.timeout = 0
+        sel = selectors.DefaultSelector()
+        sel.register(self._dev.fileno(), selectors.EVENT_READ,
+                     self._handle_readable)
+        sel.register(self._wake_r, selectors.EVENT_READ, self._handle_wakeup)
+        try:
+            while not self.shouldStop:
+                self._flush_tx()
+                timeout = self._scheduler.timeout(time.monotonic())
+                for key, events in sel.select(timeout):
+                    key.data()
+        finally:
+            sel.close()
+            self.close()
 
 
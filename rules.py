@@ -0,0 +1,264 @@
+#
+# Rule engine.
+#
+# A rule is a set of conditions that must all hold, and a switch that is
+# turned on or off when they start to, and optionally set the other way
+# when they stop to. Rules are written as text, e.g.
+#
+#   temp garage < 2 hysteresis 1 and time 06:00-22:00 then heater on else off
+#   button hall on then "hall light" on
+#
+# Conditions are on temperature readings (with hysteresis), on the state
+# of the last press of a button, and on the time of day. Sensors and
+# buttons are given by name or id, and are resolved when the rule is
+# added; switches are looked up by name when the rule fires.
+#
+# Rules are indexed by the devices their conditions are on, so a reading
+# or a button press only evaluates the rules that depend on that device.
+# Time windows are only looked at then too; a rule needs at least one
+# device condition. Rules act on changes only, so a rule that holds
+# doesn't set its switch again on every reading.
+#
+
+import shlex
+import time
+
+ON = "on"
+OFF = "off"
+
+class RuleError (Exception):
+    pass
+
+def state_str(state):
+    if state:
+        return ON
+    return OFF
+
+def parse_state(word):
+    if word == ON:
+        return True
+    elif word == OFF:
+        return False
+    raise RuleError("Expected on or off, got \"%s\"." % word)
+
+def parse_number(word):
+    try:
+        return float(word)
+    except ValueError:
+        raise RuleError("Expected a number, got \"%s\"." % word)
+
+def parse_clock(word):
+    try:
+        hours, minutes = word.split(":")
+        t = int(hours) * 60 + int(minutes)
+    except ValueError:
+        raise RuleError("Expected a time of day, got \"%s\"." % word)
+    if t < 0 or t >= 24 * 60:
+        raise RuleError("Expected a time of day, got \"%s\"." % word)
+    return t
+
+class TempCondition:
+    # holds once the temperature is past the threshold, and stops to once
+    # it is back past threshold +/- hysteresis
+    def __init__(self, sensor_id, op, threshold, hysteresis=0.0):
+        self.sensor_id = sensor_id
+        self.op = op
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.active = False
+    def key(self):
+        return ("sensor", self.sensor_id)
+    def update(self, temp):
+        if self.op == "<":
+            if temp < self.threshold:
+                active = True
+            elif temp >= self.threshold + self.hysteresis:
+                active = False
+            else:
+                active = self.active
+        else:
+            if temp > self.threshold:
+                active = True
+            elif temp <= self.threshold - self.hysteresis:
+                active = False
+            else:
+                active = self.active
+        changed = active != self.active
+        self.active = active
+        return changed
+    def holds(self, now):
+        return self.active
+
+class ButtonCondition:
+    def __init__(self, device_id, unit_id, state):
+        self.device_id = device_id
+        self.unit_id = unit_id
+        self.state = state
+        self.active = False
+    def key(self):
+        return ("button", self.device_id, self.unit_id)
+    def update(self, state):
+        active = bool(state) == self.state
+        changed = active != self.active
+        self.active = active
+        return changed
+    def holds(self, now):
+        return self.active
+
+class TimeCondition:
+    # local time of day, start inclusive; may wrap past midnight
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+    def key(self):
+        return None
+    def holds(self, now):
+        t = time.localtime(now)
+        minute = t.tm_hour * 60 + t.tm_min
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+class Rule:
+    def __init__(self, name, text, conditions, switch_name, state,
+                 else_state=None):
+        self.name = name
+        self.text = text
+        self.conditions = conditions
+        self.switch_name = switch_name
+        self.state = state
+        self.else_state = else_state
+        self.enabled = True
+        # whether the conditions held the last time the rule was evaluated;
+        # None until it first is
+        self.active = None
+    def keys(self):
+        return set(c.key() for c in self.conditions if c.key() != None)
+    def evaluate(self, now):
+        # the state to set the switch to, or None
+        active = all(c.holds(now) for c in self.conditions)
+        if active == self.active:
+            return None
+        self.active = active
+        if active:
+            return self.state
+        return self.else_state
+
+def parse(name, text, resolve_sensor, resolve_button):
+    # resolve_sensor(name) -> sensor id, resolve_button(name) ->
+    # (device id, unit id); both raise RuleError for unknown names
+    try:
+        words = shlex.split(text)
+    except ValueError as e:
+        raise RuleError(str(e))
+    if "then" not in words:
+        raise RuleError("A rule needs a \"then\".")
+    then = words.index("then")
+    conditions = []
+    clause = []
+    for word in words[:then] + ["and"]:
+        if word != "and":
+            clause.append(word)
+            continue
+        conditions.append(parse_condition(clause, resolve_sensor,
+                                          resolve_button))
+        clause = []
+    if not [ c for c in conditions if c.key() != None ]:
+        raise RuleError("A rule needs a temp or button condition.")
+    action = words[then + 1:]
+    if len(action) == 2:
+        return Rule(name, text, conditions, action[0],
+                    parse_state(action[1]))
+    elif len(action) == 4 and action[2] == "else":
+        return Rule(name, text, conditions, action[0],
+                    parse_state(action[1]), parse_state(action[3]))
+    raise RuleError("Expected \"then <switch> on|off [else on|off]\".")
+
+def parse_condition(words, resolve_sensor, resolve_button):
+    if len(words) == 0:
+        raise RuleError("Empty condition.")
+    kind = words[0]
+    if kind == "temp" and len(words) in (4, 6) and words[2] in ("<", ">"):
+        hysteresis = 0.0
+        if len(words) == 6:
+            if words[4] != "hysteresis":
+                raise RuleError("Expected \"hysteresis\", got \"%s\"." %
+                                words[4])
+            hysteresis = parse_number(words[5])
+        return TempCondition(resolve_sensor(words[1]), words[2],
+                             parse_number(words[3]), hysteresis)
+    elif kind == "button" and len(words) == 3:
+        device_id, unit_id = resolve_button(words[1])
+        return ButtonCondition(device_id, unit_id, parse_state(words[2]))
+    elif kind == "time" and len(words) == 2 and "-" in words[1]:
+        start, end = words[1].split("-", 1)
+        return TimeCondition(parse_clock(start), parse_clock(end))
+    raise RuleError("Can't parse condition \"%s\"." % " ".join(words))
+
+class RuleEngine:
+    # not thread safe; the hub calls it with its lock held
+    def __init__(self, action_cb, changed_cb):
+        # action_cb(rule, switch_name, state) is called for rules that fire,
+        # changed_cb(rule) for rules whose state needs saving
+        self.action_cb = action_cb
+        self.changed_cb = changed_cb
+        self.rules = {}
+        self._index = {}
+        self.evaluated = 0
+        self.fired = 0
+    def __contains__(self, name):
+        return name in self.rules
+    def get(self, name):
+        return self.rules.get(name)
+    def values(self):
+        return self.rules.values()
+    def load(self, rules):
+        for rule in rules:
+            self.add(rule)
+    def add(self, rule):
+        if rule.name in self.rules:
+            self.remove(rule.name)
+        self.rules[rule.name] = rule
+        for key in rule.keys():
+            self._index.setdefault(key, []).append(rule)
+    def remove(self, name):
+        rule = self.rules.pop(name)
+        for key in rule.keys():
+            dependent = self._index[key]
+            dependent.remove(rule)
+            if not dependent:
+                del self._index[key]
+        return rule
+    def set_enabled(self, name, enabled):
+        rule = self.rules[name]
+        rule.enabled = enabled
+        if enabled:
+            # acts on what holds from now on, not on what held before
+            rule.active = None
+    def temp(self, sensor_id, temp, now=None):
+        self._update(("sensor", sensor_id), temp, now)
+    def button(self, device_id, unit_id, state, now=None):
+        self._update(("button", device_id, unit_id), state, now)
+    def _update(self, key, value, now):
+        dependent = self._index.get(key)
+        if dependent == None:
+            return
+        if now == None:
+            now = time.time()
+        for rule in list(dependent):
+            changed = False
+            for condition in rule.conditions:
+                if condition.key() == key and condition.update(value):
+                    changed = True
+            if not rule.enabled:
+                if changed:
+                    self.changed_cb(rule)
+                continue
+            self.evaluated += 1
+            was_active = rule.active
+            state = rule.evaluate(now)
+            if changed or rule.active != was_active:
+                self.changed_cb(rule)
+            if state != None:
+                self.fired += 1
+                self.action_cb(rule, rule.switch_name, state)
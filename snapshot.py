@@ -0,0 +1,86 @@
+#
+# Immutable snapshots of hub state.
+#
+# Writers build a new snapshot after every change, reusing the sections
+# that didn't change, and publish it by replacing a single reference.
+# Readers grab whatever snapshot is current and never need the hub lock.
+# Everything in a snapshot is plain tuples, ready to be sent over JSON-RPC.
+#
+# A change to a single switch or sensor, such as a new state or reading,
+# copies its section with just that entry replaced. The entries stay
+# where they were, so the lookup tables are shared by the copies. Adding,
+# removing or renaming moves things around, and rebuilds the section.
+#
+
+import copy
+
+def switch_item(s):
+    return (s.device_id, s.unit_id, s.name, s.state)
+
+def sensor_item(s):
+    return (s.sensor_id, s.name, s.temp, s.last_update)
+
+def replaced(items, i, item):
+    return items[:i] + (item, ) + items[i + 1:]
+
+class SwitchSection:
+    def __init__(self, switches=()):
+        self.items = tuple(switch_item(s) for s in switches)
+        # address and name -> position in items; the first switch of a
+        # name is the one found by it
+        self._by_addr = {}
+        self._by_name = {}
+        for i, item in enumerate(self.items):
+            self._by_addr[(item[0], item[1])] = i
+            self._by_name.setdefault(item[2], i)
+    def get(self, addr):
+        i = self._by_addr.get(addr)
+        if i == None:
+            return None
+        return self.items[i]
+    def find(self, name):
+        i = self._by_name.get(name)
+        if i == None:
+            return None
+        return self.items[i]
+    def updated(self, switch):
+        # a copy with the switch's entry replaced, or None if it is new or
+        # has been renamed
+        i = self._by_addr.get((switch.device_id, switch.unit_id))
+        if i == None or self.items[i][2] != switch.name:
+            return None
+        section = copy.copy(self)
+        section.items = replaced(self.items, i, switch_item(switch))
+        return section
+
+class SensorSection:
+    def __init__(self, temp_sensors=()):
+        self.items = tuple(sensor_item(s) for s in temp_sensors)
+        self._by_id = dict((item[0], i) for i, item in enumerate(self.items))
+    def updated(self, sensor):
+        # a copy with the sensor's entry replaced, or None if it is new
+        i = self._by_id.get(sensor.sensor_id)
+        if i == None:
+            return None
+        section = copy.copy(self)
+        section.items = replaced(self.items, i, sensor_item(sensor))
+        return section
+
+def button_section(buttons):
+    return tuple((b.device_id, b.unit_id, b.name, b.on_action, b.off_action)
+                 for b in buttons)
+
+class Snapshot:
+    def __init__(self, temp_sensors=SensorSection(), switches=SwitchSection(),
+                 buttons=()):
+        self.temp_sensors = temp_sensors
+        self.switches = switches
+        self.buttons = buttons
+    def replace(self, temp_sensors=None, switches=None, buttons=None):
+        if temp_sensors == None:
+            temp_sensors = self.temp_sensors
+        if switches == None:
+            switches = self.switches
+        if buttons == None:
+            buttons = self.buttons
+        return Snapshot(temp_sensors, switches, buttons)
@@ -0,0 +1,68 @@
+#
+# Latency histograms.
+#
+# Samples go into power-of-two buckets of microseconds, so adding one is
+# a few integer operations and memory use doesn't grow, cheap enough to
+# always leave on. Percentiles are reported as the upper bound of the
+# bucket they fall in.
+#
+# A histogram isn't thread safe by itself; it is expected to only be
+# updated by one thread, or with some lock held.
+#
+
+import threading
+
+BUCKETS = 32
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    def add(self, seconds):
+        # samples are durations, and never negative
+        bucket = int(seconds * 1000000).bit_length()
+        if bucket >= BUCKETS:
+            bucket = BUCKETS - 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+    def percentile(self, p):
+        target = self.count * p
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return min((1 << i) / 1000000.0, self.max)
+        return self.max
+    def to_dict(self):
+        if self.count == 0:
+            return { "count": 0 }
+        return { "count": self.count, "mean": self.total / self.count,
+                 "p50": self.percentile(0.5), "p90": self.percentile(0.9),
+                 "p99": self.percentile(0.99), "max": self.max }
+
+class HistogramSet:
+    # named histograms, with a lock of their own for when they are updated
+    # from several threads
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+    def add(self, name, seconds):
+        with self._lock:
+            h = self._histograms.get(name)
+            if h == None:
+                h = Histogram()
+                self._histograms[name] = h
+            h.add(seconds)
+    def to_dict(self):
+        with self._lock:
+            return dict((name, h.to_dict())
+                        for name, h in self._histograms.items())
+
+def counts_to_dict(counts, key_fn=str):
+    # JSON objects only have string keys
+    return dict((key_fn(key), n) for key, n in list(counts.items()))
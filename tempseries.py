@@ -0,0 +1,271 @@
+#
+# Temperature time series.
+#
+# Every sensor keeps its recent raw readings, plus minute, hour and day
+# rollups (min/max/sum/count per bucket) which are updated as readings
+# arrive. A query picks the finest resolution that reaches back to the
+# start of the requested window, and merges adjacent buckets until the
+# result fits in the requested number of points.
+#
+# The series are saved to a file of their own rather than with the hub
+# state, as they are large and change with every reading. Each tier
+# remembers the first bucket changed since the last save, and only the
+# buckets from there on are appended to the file. The copies are taken
+# under the hub lock, but pickled and written outside it. Once the file
+# has grown to twice its compacted size it is rewritten whole.
+#
+
+import os
+import bisect
+import math
+from array import array
+
+import persist
+
+MINUTE = 60
+HOUR = 60*60
+DAY = 24*60*60
+
+RAW_CAPACITY = 4096
+MINUTE_CAPACITY = 2*24*60
+HOUR_CAPACITY = 90*24
+DAY_CAPACITY = 10*365
+
+DEFAULT_MAX_POINTS = 500
+
+MIN_COMPACT_SIZE = 1024*1024
+
+class Rollup:
+    def __init__(self, period, capacity):
+        self.period = period
+        self.capacity = capacity
+        self.starts = array('d')
+        self.mins = array('d')
+        self.maxs = array('d')
+        self.sums = array('d')
+        self.counts = array('L')
+        # index of the first bucket changed since the last save
+        self.dirty = None
+    def __len__(self):
+        return len(self.starts)
+    def oldest(self):
+        return self.starts[0]
+    def arrays(self):
+        return (self.starts, self.mins, self.maxs, self.sums, self.counts)
+    def _changed(self, i):
+        if self.dirty == None or i < self.dirty:
+            self.dirty = i
+    def _trim(self, limit):
+        excess = len(self.starts) - self.capacity
+        if excess > limit:
+            for a in self.arrays():
+                del a[:excess]
+            if self.dirty != None:
+                self.dirty = max(0, self.dirty - excess)
+    def add(self, t, value):
+        start = t - t % self.period
+        if self.starts and self.starts[-1] == start:
+            self.mins[-1] = min(self.mins[-1], value)
+            self.maxs[-1] = max(self.maxs[-1], value)
+            self.sums[-1] += value
+            self.counts[-1] += 1
+            self._changed(len(self.starts) - 1)
+            return
+        self.starts.append(start)
+        self.mins.append(value)
+        self.maxs.append(value)
+        self.sums.append(value)
+        self.counts.append(1)
+        self._changed(len(self.starts) - 1)
+        # trimmed a chunk at a time, to keep appends amortized O(1)
+        self._trim(self.capacity // 4)
+    def tail(self, full=False):
+        # copies of the buckets changed since the last call, or of all of
+        # them; None if none have
+        if full:
+            first = 0
+        else:
+            first = self.dirty
+        self.dirty = None
+        if first == None:
+            return None
+        return [ a[first:] for a in self.arrays() ]
+    def _replaced_from(self, t):
+        # the last bucket may have been saved before it was complete
+        return bisect.bisect_left(self.starts, t)
+    def restore(self, tail):
+        # puts back buckets from tail(), replacing any from the first of
+        # them on
+        if len(tail[0]) == 0:
+            return
+        first = self._replaced_from(tail[0][0])
+        for a, saved in zip(self.arrays(), tail):
+            del a[first:]
+            if saved.typecode != a.typecode:
+                # saved when min and max were single precision
+                saved = array(a.typecode, saved)
+            a.extend(saved)
+        self._trim(0)
+    def window(self, start, end):
+        first = 0
+        if start != None:
+            first = bisect.bisect_left(self.starts, start - self.period + 1)
+        last = len(self.starts)
+        if end != None:
+            last = bisect.bisect_left(self.starts, end)
+        return first, last
+    def points(self, first, last, max_points):
+        group = max(1, int(math.ceil((last - first) / float(max_points))))
+        result = []
+        for i in range(first, last, group):
+            j = min(i + group, last)
+            count = sum(self.counts[i:j])
+            result.append((self.starts[i], min(self.mins[i:j]),
+                           max(self.maxs[i:j]), sum(self.sums[i:j]) / count,
+                           count))
+        return result
+
+class Raw (Rollup):
+    # raw readings, seen as buckets holding a single reading each
+    def __init__(self, capacity):
+        Rollup.__init__(self, 0, capacity)
+    def arrays(self):
+        return (self.starts, self.mins)
+    def add(self, t, value):
+        self.starts.append(t)
+        self.mins.append(value)
+        self._changed(len(self.starts) - 1)
+        self._trim(self.capacity // 4)
+    def _replaced_from(self, t):
+        # readings are never changed once saved
+        return bisect.bisect_right(self.starts, t)
+    def window(self, start, end):
+        first = 0
+        if start != None:
+            first = bisect.bisect_left(self.starts, start)
+        last = len(self.starts)
+        if end != None:
+            last = bisect.bisect_left(self.starts, end)
+        return first, last
+    def points(self, first, last, max_points):
+        group = max(1, int(math.ceil((last - first) / float(max_points))))
+        result = []
+        for i in range(first, last, group):
+            values = self.mins[i:min(i + group, last)]
+            result.append((self.starts[i], min(values), max(values),
+                           sum(values) / len(values), len(values)))
+        return result
+
+class TempSeries:
+    def __init__(self, sensor_id):
+        self.sensor_id = sensor_id
+        self.tiers = [ Raw(RAW_CAPACITY), Rollup(MINUTE, MINUTE_CAPACITY),
+                       Rollup(HOUR, HOUR_CAPACITY), Rollup(DAY, DAY_CAPACITY) ]
+    def add(self, t, temp):
+        for tier in self.tiers:
+            tier.add(t, temp)
+    def tails(self, full=False):
+        tails = [ tier.tail(full) for tier in self.tiers ]
+        if tails.count(None) == len(tails):
+            return None
+        return tails
+    def restore(self, tails):
+        for tier, tail in zip(self.tiers, tails):
+            if tail != None:
+                tier.restore(tail)
+    def series(self, start, end, max_points=DEFAULT_MAX_POINTS):
+        for tier in self.tiers:
+            if len(tier) == 0:
+                return []
+            if tier is not self.tiers[-1] and start != None and \
+                    tier.oldest() > start:
+                # this resolution doesn't reach back far enough
+                continue
+            first, last = tier.window(start, end)
+            return tier.points(first, last, max_points)
+
+class TempSeriesStore:
+    def __init__(self):
+        self._series = {}
+        self._removed = []
+    def _get_or_create(self, sensor_id):
+        series = self._series.get(sensor_id)
+        if series == None:
+            series = TempSeries(sensor_id)
+            self._series[sensor_id] = series
+        return series
+    def add(self, sensor_id, t, temp):
+        self._get_or_create(sensor_id).add(t, temp)
+    def get(self, sensor_id):
+        return self._series.get(sensor_id)
+    def remove(self, sensor_id):
+        if self._series.pop(sensor_id, None) != None:
+            self._removed.append(sensor_id)
+    def values(self):
+        return self._series.values()
+    def load(self, items):
+        # series pickled whole, as they were with the hub state
+        for series in items:
+            self.restore(series.sensor_id, series.tails(True))
+    def changes(self, full=False):
+        # (sensor id, tier tails) records for what has changed since the
+        # last call, or for everything; a removed sensor has None for tails
+        records = []
+        if not full:
+            records.extend((sensor_id, None) for sensor_id in self._removed)
+        self._removed = []
+        for series in self._series.values():
+            tails = series.tails(full)
+            if tails != None:
+                records.append((series.sensor_id, tails))
+        return records
+    def restore(self, sensor_id, tails):
+        if tails == None:
+            self._series.pop(sensor_id, None)
+        else:
+            self._get_or_create(sensor_id).restore(tails)
+    def series(self, sensor_id, start, end, max_points=DEFAULT_MAX_POINTS):
+        series = self._series.get(sensor_id)
+        if series == None:
+            return None
+        return series.series(start, end, max_points)
+
+class SeriesFile:
+    def __init__(self, filename, store, lock):
+        self.filename = filename
+        self.store = store
+        # the hub lock, held while changes are taken from the store
+        self._lock = lock
+        self._file = None
+        self._size = 0
+        self._compacted_size = 0
+    def exists(self):
+        return os.path.exists(self.filename)
+    def load(self):
+        for sensor_id, tails in persist.read_records(self.filename):
+            self.store.restore(sensor_id, tails)
+    def save(self):
+        # not thread safe; called from the state store thread, and before
+        # and after it runs
+        with self._lock:
+            compact = self._file == None or \
+                self._size > max(MIN_COMPACT_SIZE, 2 * self._compacted_size)
+            records = self.store.changes(compact)
+        data = b''.join(persist.encode_record(record) for record in records)
+        if compact:
+            if self._file != None:
+                self._file.close()
+            persist.write_atomically(self.filename, data)
+            self._file = open(self.filename, "ab")
+            self._size = len(data)
+            self._compacted_size = len(data)
+        elif data:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._size += len(data)
+    def close(self):
+        self.save()
+        if self._file != None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,93 @@
+#
+# Tests for the button action runner.
+#
+
+import os
+import queue
+import shutil
+import tempfile
+import time
+import unittest
+
+import actions
+
+def alive(pid):
+    # a killed child of ours may linger as a zombie until reaped
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            return f.read().split(")")[-1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+class ActionRunnerTest (unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.done = queue.Queue()
+        self.runners = []
+    def tearDown(self):
+        for runner in self.runners:
+            runner.close()
+        shutil.rmtree(self.dirname)
+    def runner(self, **kw):
+        runner = actions.ActionRunner(self.done_cb, **kw)
+        self.runners.append(runner)
+        return runner
+    def done_cb(self, name, device_id, unit_id, wait, duration, status):
+        self.done.put((name, device_id, unit_id, status))
+    def wait_done(self):
+        return self.done.get(timeout=10)
+    def test_run(self):
+        runner = self.runner()
+        self.assertTrue(runner.submit("door", True, "exit 3", 7, 1))
+        self.assertEqual(self.wait_done(), ("door", 7, 1, 3))
+    def test_debounce(self):
+        runner = self.runner(debounce=60, max_per_button=4)
+        self.assertTrue(runner.submit("door", True, "true", 7, 1))
+        # the same press repeated by the remote
+        self.assertFalse(runner.submit("door", True, "true", 7, 1))
+        self.assertTrue(runner.submit("door", False, "true", 7, 1))
+        self.assertTrue(runner.submit("hall", True, "true", 8, 1))
+        for i in range(0, 3):
+            self.wait_done()
+        self.assertFalse(runner.submit("door", True, "true", 7, 1))
+    def test_debounce_expires(self):
+        runner = self.runner(debounce=0.1)
+        self.assertTrue(runner.submit("door", True, "true", 7, 1))
+        self.wait_done()
+        time.sleep(0.2)
+        self.assertTrue(runner.submit("door", True, "true", 7, 1))
+        self.wait_done()
+    def test_one_command_per_button(self):
+        runner = self.runner(debounce=0)
+        flag = os.path.join(self.dirname, "flag")
+        self.assertTrue(runner.submit("door", True,
+                                      "while [ ! -e %s ]; do sleep 0.01; done"
+                                      % flag, 7, 1))
+        self.assertFalse(runner.submit("door", False, "true", 7, 1))
+        self.assertTrue(runner.submit("hall", True, "true", 8, 1))
+        self.assertEqual(self.wait_done()[0], "hall")
+        open(flag, "w").close()
+        self.assertEqual(self.wait_done(), ("door", 7, 1, 0))
+        self.assertTrue(runner.submit("door", False, "true", 7, 1))
+        self.wait_done()
+    def test_timeout_kills_process_group(self):
+        runner = self.runner(timeout=0.5)
+        pidfile = os.path.join(self.dirname, "pid")
+        # the shell waits on a child of its own, which must go too
+        self.assertTrue(runner.submit("door", True,
+                                      "sleep 30 & echo $! > %s; wait" %
+                                      pidfile, 7, 1))
+        self.assertEqual(self.wait_done(), ("door", 7, 1, None))
+        with open(pidfile) as f:
+            pid = int(f.read())
+        deadline = time.monotonic() + 5
+        while alive(pid) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(alive(pid))
+    def test_closed(self):
+        runner = self.runner()
+        runner.close()
+        self.assertFalse(runner.submit("door", True, "true", 7, 1))
+
+if __name__ == "__main__":
+    unittest.main()
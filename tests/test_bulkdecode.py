@@ -0,0 +1,81 @@
+#
+# Tests for the NumPy bulk decoder.
+#
+
+import random
+import unittest
+
+import bulkdecode
+
+BUTTON_FRAME = bytes.fromhex("0b 11 00 03 01 23 45 67 01 01 0f 70")
+STATUS_FRAME = bytes.fromhex("0d 01 00 00 02 53 45 00 00 00 00 00 00 00")
+UNKNOWN_FRAME = bytes.fromhex("07 20 00 06 12 34 56 00")
+# a temperature frame of a subtype neither decoder handles
+OTHER_TEMP_FRAME = bytes.fromhex("08 50 01 01 99 a6 00 d7 69")
+SHORT_FRAME = bytes.fromhex("01 50")
+
+def temp_frame(rng, seq):
+    raw = rng.randrange(0, 400)
+    if rng.random() < 0.3:
+        raw |= 0x8000
+    return bytes([ 0x08, 0x50, rng.choice((0x05, 0x07)), seq & 0xff,
+                   rng.randrange(0, 256), rng.randrange(0, 8), raw >> 8,
+                   raw & 0xff, rng.randrange(0, 256) ])
+
+def button_frame(rng, seq):
+    return bytes([ 0x0b, 0x11, 0x00, seq & 0xff ]) + \
+        rng.randrange(0, 1 << 26).to_bytes(4, "big") + \
+        bytes([ rng.randrange(1, 17), rng.randrange(0, 2), 0x0f,
+                rng.randrange(0, 16) << 4 ])
+
+def stream(n, seed=1):
+    rng = random.Random(seed)
+    frames = []
+    for seq in range(0, n):
+        kind = rng.random()
+        if kind < 0.6:
+            frames.append(temp_frame(rng, seq))
+        elif kind < 0.9:
+            frames.append(button_frame(rng, seq))
+        else:
+            frames.append(rng.choice((STATUS_FRAME, UNKNOWN_FRAME,
+                                      OTHER_TEMP_FRAME, SHORT_FRAME)))
+    return b"".join(frames)
+
+class BulkDecodeTest (unittest.TestCase):
+    def test_decode(self):
+        buf = bytes.fromhex("08 50 07 02 44 01 80 2d 50") + SHORT_FRAME + \
+            BUTTON_FRAME + OTHER_TEMP_FRAME + BUTTON_FRAME[:5]
+        result = bulkdecode.decode(buf)
+        # the cut off frame at the end isn't one
+        self.assertEqual(result["frames"], 4)
+        self.assertEqual(result["counts"], { "0x50/0x07": 1, "0x11/0x00": 1,
+                                             "0x50/0x01": 1 })
+        t = result["temp"]
+        self.assertEqual(t["frame"].tolist(), [ 0 ])
+        self.assertEqual(t["addr"].tolist(), [ 0x44 << (8 + 0x01) ])
+        self.assertEqual(t["temp"].tolist(), [ -4.5 ])
+        self.assertEqual((t["seq_no"].tolist(), t["signal_level"].tolist(),
+                          t["battery"].tolist()), ([ 2 ], [ 5 ], [ 0 ]))
+        b = result["lighting2"]
+        self.assertEqual(b["frame"].tolist(), [ 2 ])
+        self.assertEqual((b["addr"].tolist(), b["unit"].tolist(),
+                          b["state"].tolist(), b["signal_level"].tolist()),
+                         ([ 0x01234567 ], [ 1 ], [ 1 ], [ 7 ]))
+    def test_empty(self):
+        result = bulkdecode.decode(b"")
+        self.assertEqual((result["frames"], result["counts"]), (0, {}))
+        self.assertEqual(len(result["temp"]["temp"]), 0)
+        self.assertEqual(bulkdecode.cross_check(b""), [])
+    def test_cross_check(self):
+        buf = stream(5000)
+        self.assertEqual(bulkdecode.cross_check(buf), [])
+        self.assertGreater(len(bulkdecode.decode(buf)["temp"]["temp"]), 2500)
+    def test_diff(self):
+        self.assertEqual(bulkdecode.diff("temp", [ (1, 2) ], [ (1, 2) ]), [])
+        problems = bulkdecode.diff("temp", [ (1, 2), (3, 4) ], [ (1, 3) ])
+        self.assertEqual(len(problems), 2)
+        self.assertIn("frame 0", problems[1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#
+# Tests for RF capture files and their replay.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import capture
+import dedupe
+import replay
+
+TEMP_FRAME = bytes.fromhex("08 50 05 01 99 a6 00 d7 69")
+BUTTON_FRAME = bytes.fromhex("0b 11 00 03 01 23 45 67 01 01 0f 70")
+
+class CaptureTest (unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirname, "capture")
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+    def write(self, records):
+        writer = capture.CaptureWriter(self.filename)
+        for t, frame in records:
+            writer.write(frame, t)
+        writer.close()
+        return writer
+    def test_round_trip(self):
+        records = [ (1000.0, TEMP_FRAME), (1000.25, BUTTON_FRAME),
+                    (1001.5, TEMP_FRAME) ]
+        self.assertEqual(self.write(records).frames, 3)
+        self.assertEqual(list(capture.read_capture(self.filename)), records)
+        self.assertEqual(capture.load_stream(self.filename),
+                         TEMP_FRAME + BUTTON_FRAME + TEMP_FRAME)
+    def test_truncated_record(self):
+        self.write([ (1000.0, TEMP_FRAME), (1001.0, BUTTON_FRAME) ])
+        size = os.path.getsize(self.filename)
+        for cut in (1, len(BUTTON_FRAME) + 1):
+            os.truncate(self.filename, size - cut)
+            self.assertEqual(list(capture.read_capture(self.filename)),
+                             [ (1000.0, TEMP_FRAME) ])
+            size -= cut
+    def test_empty(self):
+        self.write([])
+        self.assertEqual(list(capture.read_capture(self.filename)), [])
+    def test_not_a_capture(self):
+        with open(self.filename, "wb") as f:
+            f.write(b"\x08\x50\x05\x01\x99\xa6\x00\xd7\x69")
+        with self.assertRaises(capture.CaptureError):
+            list(capture.read_capture(self.filename))
+
+class ReplayRadioTest (unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirname, "capture")
+        self.calls = []
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+    def temp(self, sensor_id, seq_no, temp, signal_level):
+        self.calls.append(("temp", temp))
+    def button(self, device_id, unit_id, state):
+        self.calls.append(("button", device_id, unit_id, state))
+    def replay(self, records, **kw):
+        writer = capture.CaptureWriter(self.filename)
+        for t, frame in records:
+            writer.write(frame, t)
+        writer.close()
+        radio = replay.ReplayRadio(self.filename, self.temp, self.button,
+                                   speed=0, **kw)
+        radio.start()
+        radio.join(10)
+        self.assertFalse(radio.is_alive())
+        return radio
+    def test_replay(self):
+        radio = self.replay([ (1000.0, TEMP_FRAME), (1000.5, BUTTON_FRAME) ])
+        self.assertEqual(self.calls, [ ("temp", 21.5),
+                                       ("button", 0x01234567, 1, 1) ])
+        self.assertEqual(radio.frames_replayed, 2)
+        self.assertEqual(radio.capture_time(), 1000.5)
+        radio.set_switch(1, 1, 0, True)
+        self.assertEqual(radio.stats()["commands_ignored"], 1)
+    def test_dedupe_by_capture_time(self):
+        # replayed back to back, but an hour apart when captured
+        self.replay([ (1000.0, BUTTON_FRAME), (1000.2, BUTTON_FRAME),
+                      (4600.0, BUTTON_FRAME) ], deduper=dedupe.Deduper(1.0))
+        self.assertEqual(len(self.calls), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+#
+# Tests for duplicate frame suppression.
+#
+
+import unittest
+
+import dedupe
+
+class DeduperTest (unittest.TestCase):
+    def test_window(self):
+        deduper = dedupe.Deduper(1.0)
+        self.assertFalse(deduper.duplicate("a", 10.0))
+        self.assertTrue(deduper.duplicate("a", 10.5))
+        self.assertFalse(deduper.duplicate("b", 10.5))
+        # the window counts from the first copy
+        self.assertFalse(deduper.duplicate("a", 11.0))
+        self.assertTrue(deduper.duplicate("b", 11.2))
+        self.assertEqual((deduper.passed, deduper.suppressed), (3, 2))
+    def test_long_repeat(self):
+        deduper = dedupe.Deduper(1.0)
+        passed = [ t / 10.0 for t in range(0, 35)
+                   if not deduper.duplicate("a", t / 10.0) ]
+        self.assertEqual(passed, [ 0.0, 1.0, 2.0, 3.0 ])
+    def test_many_keys_expire(self):
+        deduper = dedupe.Deduper(1.0)
+        for i in range(0, 1000):
+            self.assertFalse(deduper.duplicate(i, i * 0.01))
+        self.assertTrue(deduper.duplicate(999, 10.0))
+        self.assertFalse(deduper.duplicate(0, 10.0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#
+# Tests for the event log ring buffer.
+#
+
+import unittest
+
+import eventlog
+
+def fill(log, count, start=0):
+    for i in range(start, start + count):
+        log.append("button", 1000.0 + i, i, i % 3, "source%d" % (i % 2), i)
+
+class EventLogTest (unittest.TestCase):
+    def test_append_and_iterate(self):
+        log = eventlog.EventLog(4)
+        fill(log, 3)
+        self.assertEqual(len(log), 3)
+        self.assertEqual(list(log)[0],
+                         ("button", 1000.0, 0, 0, "source0", 0))
+        self.assertEqual([ e[5] for e in log ], [ 0, 1, 2 ])
+    def test_wraparound(self):
+        log = eventlog.EventLog(4)
+        fill(log, 10)
+        self.assertEqual(len(log), 4)
+        # the oldest are overwritten, and order is kept
+        self.assertEqual([ e[5] for e in log ], [ 6, 7, 8, 9 ])
+        self.assertEqual([ e[1] for e in log ],
+                         [ 1006.0, 1007.0, 1008.0, 1009.0 ])
+    def test_query_after_wraparound(self):
+        log = eventlog.EventLog(4)
+        fill(log, 10)
+        self.assertEqual([ e[5] for e in log.query(start=1007.0) ],
+                         [ 7, 8, 9 ])
+        self.assertEqual([ e[5] for e in log.query(end=1008.0) ], [ 6, 7 ])
+        self.assertEqual([ e[5] for e in log.query(newest_first=True,
+                                                     limit=2) ], [ 9, 8 ])
+        self.assertEqual(log.query(start=1000.0, end=1005.0), [])
+        self.assertEqual([ e[5] for e in log.query(device_id=8) ], [ 8 ])
+        self.assertEqual(log.query(event_type="no-such-type"), [])
+    def test_none_ids(self):
+        log = eventlog.EventLog(2)
+        log.append("switch-set", 1.0, None, None, None, None)
+        self.assertEqual(list(log), [ ("switch-set", 1.0, None, None, None,
+                                       None) ])
+    def test_wide_ids(self):
+        log = eventlog.EventLog(2)
+        wide = 1 << 200
+        log.append("sensor-reading", 1.0, wide, None, "outside", "1.5")
+        log.append("sensor-reading", 2.0, 5, None, "inside", "20.0")
+        self.assertEqual([ e[2] for e in log ], [ wide, 5 ])
+        self.assertEqual(len(log.query(device_id=wide)), 1)
+        # overwriting the slot of a wide id forgets it
+        log.append("sensor-reading", 3.0, 6, None, "inside", "20.1")
+        self.assertEqual([ e[2] for e in log ], [ 5, 6 ])
+        self.assertEqual(log.query(device_id=wide), [])
+    def test_clear(self):
+        log = eventlog.EventLog(4)
+        fill(log, 3)
+        log.clear()
+        self.assertEqual(len(log), 0)
+        self.assertEqual(list(log), [])
+    def test_since(self):
+        log = eventlog.EventLog(4)
+        cursor, lost, events = log.since(None)
+        self.assertEqual((cursor, lost, events), (0, 0, []))
+        fill(log, 3)
+        cursor, lost, events = log.since(cursor)
+        self.assertEqual((cursor, lost), (3, 0))
+        self.assertEqual([ e[5] for e in events ], [ 0, 1, 2 ])
+        self.assertEqual(log.since(cursor), (3, 0, []))
+    def test_since_limit(self):
+        log = eventlog.EventLog(8)
+        fill(log, 5)
+        cursor, lost, events = log.since(0, limit=2)
+        self.assertEqual((cursor, [ e[5] for e in events ]), (2, [ 0, 1 ]))
+        cursor, lost, events = log.since(cursor, limit=10)
+        self.assertEqual((cursor, [ e[5] for e in events ]),
+                         (5, [ 2, 3, 4 ]))
+    def test_since_after_wraparound(self):
+        log = eventlog.EventLog(4)
+        fill(log, 2)
+        cursor = log.since(None)[0]
+        fill(log, 5, 2)
+        # one of the new events was overwritten before being fetched
+        cursor, lost, events = log.since(cursor)
+        self.assertEqual((cursor, lost), (7, 1))
+        self.assertEqual([ e[5] for e in events ], [ 3, 4, 5, 6 ])
+    def test_since_stale_cursor(self):
+        # a cursor from before a restart starts over from the oldest event
+        log = eventlog.EventLog(4)
+        fill(log, 2)
+        cursor, lost, events = log.since(100)
+        self.assertEqual((cursor, lost), (2, 0))
+        self.assertEqual([ e[5] for e in events ], [ 0, 1 ])
+    def test_since_after_clear(self):
+        log = eventlog.EventLog(4)
+        fill(log, 3)
+        cursor = log.since(None)[0]
+        log.clear()
+        fill(log, 1, 3)
+        self.assertEqual(log.since(cursor)[0], 4)
+        self.assertEqual([ e[5] for e in log.since(cursor)[2] ], [ 3 ])
+
+if __name__ == "__main__":
+    unittest.main()
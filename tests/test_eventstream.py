@@ -0,0 +1,80 @@
+#
+# Tests for the live event stream.
+#
+
+import json
+import socket
+import threading
+import unittest
+
+import eventstream
+
+def event(n):
+    return ("temp", 1000.0 + n, 7, 1, "porch", n)
+
+class Stream:
+    def __init__(self):
+        self.removed = threading.Event()
+    def remove(self, subscriber):
+        self.removed.set()
+
+class SubscriberTest (unittest.TestCase):
+    def setUp(self):
+        self.stream = Stream()
+        self.sock, self.peer = socket.socketpair()
+        self.peer.settimeout(5)
+        self.reader = self.peer.makefile("r", encoding="UTF-8")
+    def tearDown(self):
+        self.reader.close()
+        self.peer.close()
+    def subscriber(self, queue_size):
+        return eventstream.Subscriber(self.stream, self.sock, ("test", 0),
+                                      queue_size)
+    def read(self, n):
+        return [ json.loads(self.reader.readline()) for i in range(0, n) ]
+    def test_events(self):
+        subscriber = self.subscriber(10)
+        subscriber.start()
+        subscriber.put(1, event(1))
+        subscriber.put(2, event(2))
+        self.assertEqual(self.read(2), [
+            { "seq": 1, "type": "temp", "time": 1001.0, "device_id": 7,
+              "unit_id": 1, "source": "porch", "value": 1 },
+            { "seq": 2, "type": "temp", "time": 1002.0, "device_id": 7,
+              "unit_id": 1, "source": "porch", "value": 2 } ])
+    def test_lost_events(self):
+        subscriber = self.subscriber(3)
+        # queued before the writer runs, so the oldest two are dropped
+        for seq in range(1, 6):
+            subscriber.put(seq, event(seq))
+        subscriber.start()
+        lines = self.read(4)
+        self.assertEqual(lines[0], { "lost": 2 })
+        self.assertEqual([ line["seq"] for line in lines[1:] ], [ 3, 4, 5 ])
+        # and the count starts over
+        subscriber.put(6, event(6))
+        self.assertEqual([ line["seq"] for line in self.read(1) ], [ 6 ])
+    def test_removed_on_disconnect(self):
+        subscriber = self.subscriber(10)
+        subscriber.start()
+        self.reader.close()
+        self.peer.close()
+        for seq in range(0, 100):
+            subscriber.put(seq, event(seq))
+            if self.stream.removed.wait(0.01):
+                break
+        self.assertTrue(self.stream.removed.is_set())
+        subscriber.join(5)
+        self.assertFalse(subscriber.is_alive())
+
+class ToLineTest (unittest.TestCase):
+    def test_to_line(self):
+        line = eventstream.to_line(3, ("button", 5.0, None, None, None, None))
+        self.assertTrue(line.endswith("\n"))
+        self.assertEqual(json.loads(line),
+                         { "seq": 3, "type": "button", "time": 5.0,
+                           "device_id": None, "unit_id": None, "source": None,
+                           "value": None })
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+#
+# Tests for the engine heater planner.
+#
+
+import pickle
+import unittest
+
+import heater
+from heater import MINUTE, HOUR, DAY
+
+NOW = 1700000000.0
+STEP = 10*MINUTE
+
+def history(temp_fn, now=NOW, since=NOW - 2*DAY):
+    # series_fn over readings every STEP, from temp_fn(t), up to now
+    def series(start, end):
+        if end == None or end > now:
+            end = now
+        t = max(start, since)
+        t -= t % STEP
+        points = []
+        while t < end:
+            if t >= start:
+                v = temp_fn(t)
+                points.append((t, v, v, v, 1))
+            t += STEP
+        return points
+    return series
+
+def constant(temp):
+    return lambda t: temp
+
+class HeatingTimeTest (unittest.TestCase):
+    def test_heating_time(self):
+        self.assertEqual(heater.heating_time(None), 180)
+        self.assertEqual(heater.heating_time(-20), 180)
+        self.assertEqual(heater.heating_time(-15), 180)
+        self.assertEqual(heater.heating_time(0), 105)
+        self.assertEqual(heater.heating_time(15), 30)
+        self.assertEqual(heater.heating_time(25), 30)
+
+class ForecastTest (unittest.TestCase):
+    def test_no_history(self):
+        forecast = heater.Forecast(lambda start, end: [], NOW)
+        self.assertEqual(forecast.temp(NOW + HOUR), None)
+    def test_yesterday(self):
+        # yesterday it got 6 degrees warmer between now and four hours
+        # from now; today is 2 degrees colder than yesterday
+        def temp(t):
+            if t < NOW - DAY + 4*HOUR:
+                return 0.0
+            elif t < NOW - DAY + 8*HOUR:
+                return 6.0
+            return -2.0
+        forecast = heater.Forecast(history(temp), NOW)
+        self.assertEqual(forecast.current, -2.0)
+        self.assertEqual(forecast.temp(NOW - HOUR), -2.0)
+        self.assertAlmostEqual(forecast.temp(NOW + 2*HOUR), -2.0)
+        self.assertAlmostEqual(forecast.temp(NOW + 6*HOUR), 4.0)
+    def test_trend(self):
+        # less than a day of history, rising a degree an hour
+        series = history(lambda t: (t - NOW) / HOUR, since=NOW - 5*HOUR)
+        forecast = heater.Forecast(series, NOW)
+        self.assertAlmostEqual(forecast.slope * HOUR, 1.0)
+        current = forecast.current
+        self.assertAlmostEqual(forecast.temp(NOW + HOUR), current + 1.0)
+        # extrapolated no further than MAX_TREND_HORIZON
+        self.assertAlmostEqual(forecast.temp(NOW + 10*HOUR),
+                               current + heater.MAX_TREND_HORIZON / HOUR)
+    def test_trend_weights(self):
+        self.assertEqual(heater.trend([ (0, 1, 1, 1, 1) ]), 0.0)
+        self.assertEqual(heater.trend([ (0, 1, 1, 1, 1), (0, 2, 2, 2, 1) ]),
+                         0.0)
+        self.assertAlmostEqual(heater.trend([ (0, 0, 0, 0.0, 1),
+                                              (10, 0, 0, 1.0, 3) ]), 0.1)
+
+class HeaterPlannerTest (unittest.TestCase):
+    def setUp(self):
+        self.temp_fn = constant(-15.0)
+        self.jobs = {}
+        self.next_id = 1
+        self.cancelled = []
+        self.changed = []
+        self.series_calls = 0
+        self.planner = heater.HeaterPlanner(self.series, self.schedule,
+                                            self.cancel, self.changed.append)
+    def series(self, sensor_id, start, end):
+        self.assertEqual(sensor_id, 7)
+        self.series_calls += 1
+        return history(lambda t: self.temp_fn(t), self.now)(start, end)
+    def schedule(self, when, switch_name, state):
+        job_id = self.next_id
+        self.next_id += 1
+        self.jobs[job_id] = (when, switch_name, state)
+        return job_id
+    def cancel(self, job_id):
+        self.cancelled.append(job_id)
+        del self.jobs[job_id]
+    def add(self, target, daily=False, now=NOW):
+        self.now = now
+        plan = heater.Plan("car", 7, "heater", target, 30*MINUTE, daily)
+        self.planner.add(plan, now)
+        return plan
+    def reading(self, now):
+        self.now = now
+        self.planner.reading(7, now)
+    def assertNotListening(self):
+        # readings from the sensor are no longer looked at
+        calls = self.series_calls
+        self.reading(NOW + 8*HOUR)
+        self.assertEqual(self.series_calls, calls)
+    def test_cold(self):
+        plan = self.add(NOW + 6*HOUR)
+        self.assertEqual(plan.start, NOW + 3*HOUR)
+        self.assertEqual(plan.forecast, -15.0)
+        self.assertEqual(sorted(self.jobs.values()),
+                         [ (NOW + 3*HOUR, "heater", True),
+                           (NOW + 6*HOUR + 30*MINUTE, "heater", False) ])
+        self.assertEqual(self.changed, [ "car" ])
+    def test_warm(self):
+        self.temp_fn = constant(20.0)
+        plan = self.add(NOW + 6*HOUR)
+        self.assertEqual(plan.start, NOW + 6*HOUR - 30*MINUTE)
+    def test_starts_now_if_late(self):
+        plan = self.add(NOW + HOUR)
+        self.assertEqual(plan.start, NOW)
+    def test_forecast_from_yesterday(self):
+        # yesterday it warmed from -15 to 15 before the heater would start
+        # at -15; the start is settled at the warmer temperature
+        def temp(t):
+            if NOW - DAY + 90*MINUTE <= t < NOW - 6*HOUR:
+                return 15.0
+            return -15.0
+        self.temp_fn = temp
+        plan = self.add(NOW + 5*HOUR)
+        self.assertAlmostEqual(plan.forecast, 15.0)
+        self.assertAlmostEqual(plan.start, NOW + 5*HOUR - 30*MINUTE)
+    def test_small_drift_not_replanned(self):
+        plan = self.add(NOW + 6*HOUR)
+        start_job = plan.start_job
+        # -14.5 degrees takes 2.5 minutes less, within the threshold
+        self.temp_fn = constant(-14.5)
+        self.reading(NOW + MINUTE)
+        self.assertEqual(plan.start_job, start_job)
+        self.assertEqual(plan.start, NOW + 3*HOUR)
+        self.assertEqual(plan.forecast, -14.5)
+        self.assertEqual(self.planner.replans, 0)
+        # nothing that is saved changed
+        self.assertEqual(self.changed, [ "car" ])
+    def test_replanned(self):
+        plan = self.add(NOW + 6*HOUR)
+        start_job = plan.start_job
+        stop_job = plan.stop_job
+        self.temp_fn = constant(15.0)
+        self.reading(NOW + MINUTE)
+        self.assertEqual(self.cancelled, [ start_job ])
+        self.assertNotEqual(plan.start_job, start_job)
+        self.assertEqual(plan.stop_job, stop_job)
+        self.assertEqual(plan.start, NOW + 6*HOUR - 30*MINUTE)
+        self.assertEqual(self.jobs[plan.start_job],
+                         (plan.start, "heater", True))
+        self.assertEqual(self.planner.replans, 1)
+        self.assertEqual(self.changed, [ "car", "car" ])
+    def test_forecast_not_saved(self):
+        plan = self.add(NOW + 6*HOUR)
+        loaded = pickle.loads(pickle.dumps(plan))
+        self.assertEqual(loaded.forecast, None)
+        self.assertEqual((loaded.start, loaded.start_job, loaded.stop_job),
+                         (plan.start, plan.start_job, plan.stop_job))
+        self.assertEqual(plan.forecast, -15.0)
+    def test_left_alone_once_started(self):
+        plan = self.add(NOW + 6*HOUR)
+        self.temp_fn = constant(15.0)
+        self.reading(NOW + 4*HOUR)
+        self.assertEqual(plan.start, NOW + 3*HOUR)
+        self.assertEqual(self.cancelled, [])
+    def test_done(self):
+        self.add(NOW + 6*HOUR)
+        self.reading(NOW + 7*HOUR)
+        self.assertFalse("car" in self.planner)
+        self.assertNotListening()
+    def test_daily(self):
+        plan = self.add(NOW + 6*HOUR, daily=True)
+        self.reading(NOW + 7*HOUR)
+        self.assertTrue("car" in self.planner)
+        self.assertEqual(plan.target, NOW + DAY + 6*HOUR)
+        self.assertEqual(plan.start, NOW + DAY + 3*HOUR)
+        self.assertEqual(len(self.jobs), 4)
+    def test_remove(self):
+        self.add(NOW + 6*HOUR)
+        self.planner.remove("car", NOW)
+        self.assertEqual(self.jobs, {})
+        self.assertNotListening()
+    def test_remove_started(self):
+        # a heater that is on is still switched off
+        self.add(NOW + 6*HOUR)
+        self.planner.remove("car", NOW + 4*HOUR)
+        self.assertEqual(self.cancelled, [])
+    def test_replaced(self):
+        self.add(NOW + 6*HOUR)
+        plan = self.add(NOW + 8*HOUR)
+        self.assertEqual(len(self.cancelled), 2)
+        self.assertEqual(sorted(self.jobs), [ plan.start_job, plan.stop_job ])
+
+if __name__ == "__main__":
+    unittest.main()
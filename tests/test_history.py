@@ -0,0 +1,120 @@
+#
+# Tests for the on-disk event history.
+#
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import history
+
+DAY = 24*60*60
+NOW = 1500000000.0
+
+class HistoryStoreTest (unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.stores = []
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.dirname)
+    def open_store(self, **kw):
+        store = history.HistoryStore(self.dirname, **kw)
+        self.stores.append(store)
+        return store
+    def segments(self):
+        return sorted(f for f in os.listdir(self.dirname)
+                      if f.endswith(history.SEGMENT_SUFFIX))
+    def test_round_trip(self):
+        store = self.open_store()
+        wide = 1 << 300
+        store.append("temp", NOW, wide, 1, "porch", 21.5)
+        store.append("button", NOW + 1, 7, 2, None, 1)
+        store.append("action", NOW + 2, None, None, "lights", "done")
+        store.append("status", NOW + 3, 3, None, None, None)
+        self.assertEqual(store.query(), [
+            ("temp", NOW, wide, 1, "porch", 21.5),
+            ("button", NOW + 1, 7, 2, None, 1),
+            ("action", NOW + 2, None, None, "lights", "done"),
+            ("status", NOW + 3, 3, None, None, None) ])
+    def test_query_filters(self):
+        store = self.open_store()
+        for i in range(0, 1000):
+            store.append("temp" if i % 2 else "button", NOW + i, i % 5, 1,
+                         None, i)
+        result = store.query(start=NOW + 300, end=NOW + 310)
+        self.assertEqual([ e[5] for e in result ], list(range(300, 310)))
+        result = store.query(start=NOW + 300, event_type="temp", limit=3)
+        self.assertEqual([ e[5] for e in result ], [ 301, 303, 305 ])
+        result = store.query(end=NOW + 20, device_id=4)
+        self.assertEqual([ e[5] for e in result ], [ 4, 9, 14, 19 ])
+        # a start time between records, and one past the end
+        self.assertEqual(store.query(start=NOW + 999.5), [])
+        self.assertEqual(store.query(start=NOW + 998.5)[0][5], 999)
+    def test_segment_roll_by_size(self):
+        store = self.open_store(segment_size=100 * history.RECORD.size)
+        for i in range(0, 1000):
+            store.append("temp", NOW + i, 1, 1, None, i)
+        self.assertEqual(len(self.segments()), 10)
+        result = store.query(start=NOW + 250.5, end=NOW + 750)
+        self.assertEqual([ e[5] for e in result ], list(range(251, 750)))
+    def test_segment_roll_by_age(self):
+        store = self.open_store(segment_age=60)
+        for i in range(0, 10):
+            store.append("temp", NOW + i * 30, 1, 1, None, i)
+        self.assertEqual(len(self.segments()), 5)
+        self.assertEqual(len(store.query()), 10)
+    def test_reopen(self):
+        store = self.open_store()
+        store.append("temp", NOW, 1, 1, None, 1)
+        store.close()
+        store = self.open_store()
+        store.append("temp", NOW, 1, 1, None, 2)
+        # the new segment gets a name of its own even at the same time
+        self.assertEqual(len(self.segments()), 2)
+        self.assertEqual([ e[5] for e in store.query() ], [ 1, 2 ])
+    def test_retention(self):
+        store = self.open_store(segment_age=DAY, retention=3 * DAY)
+        for day in range(0, 10):
+            store.append("temp", NOW + day * DAY, 1, 1, None, day)
+        # a segment goes once the one after it starts past retention too
+        self.assertEqual([ e[5] for e in store.query() ], [ 5, 6, 7, 8, 9 ])
+        self.assertEqual(len(self.segments()), 5)
+        store.purge(NOW + 20 * DAY)
+        # the current segment is always kept
+        self.assertEqual([ e[5] for e in store.query() ], [ 9 ])
+    def test_sync_while_rolling(self):
+        # the state store thread syncs without the hub lock
+        store = self.open_store(segment_size=10 * history.RECORD.size)
+        errors = []
+        done = threading.Event()
+        def sync():
+            try:
+                while not done.is_set():
+                    store.sync()
+            except Exception as e:
+                errors.append(e)
+        thread = threading.Thread(target=sync)
+        thread.start()
+        try:
+            for i in range(0, 2000):
+                store.append("temp", NOW + i, 1, 1, None, i)
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(store.query()), 2000)
+    def test_torn_record_ignored(self):
+        store = self.open_store()
+        store.append("temp", NOW, 1, 1, None, 1)
+        store.close()
+        with open(os.path.join(self.dirname, self.segments()[0]), "ab") as f:
+            f.write(b"\1\2\3")
+        store = self.open_store()
+        self.assertEqual([ e[5] for e in store.query() ], [ 1 ])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#
+# Tests for the job scheduler.
+#
+
+import threading
+import time
+import unittest
+
+import jobs
+
+class JobSchedulerTest (unittest.TestCase):
+    def setUp(self):
+        self.fired = []
+        self.cond = threading.Condition()
+        self.scheduler = jobs.JobScheduler(self.fire)
+    def tearDown(self):
+        self.scheduler.halt()
+    def fire(self, job):
+        with self.cond:
+            self.fired.append(job.switch_name)
+            self.cond.notify_all()
+        if job.switch_name == "fail":
+            raise ValueError("no such switch")
+    def wait_fired(self, n):
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.fired) >= n, 5)
+            return list(self.fired)
+    def test_due_in_time_order(self):
+        now = time.time()
+        for offset, name in ((-1, "b"), (-3, "a"), (-2, "c2"), (-2, "c1")):
+            self.scheduler.add(now + offset, name, True)
+        self.scheduler.add(now + 10, "later", True)
+        self.scheduler.start()
+        # equal times go in the order they were added
+        self.assertEqual(self.wait_fired(4), [ "a", "c2", "c1", "b" ])
+        self.assertEqual([ job.switch_name for job in
+                           self.scheduler.values() ], [ "later" ])
+        self.assertEqual(self.scheduler.stats()["pending"], 1)
+    def test_cancel(self):
+        now = time.time()
+        a = self.scheduler.add(now - 2, "a", True)
+        self.scheduler.add(now - 1, "b", True)
+        self.assertEqual(self.scheduler.cancel(a.job_id), a)
+        self.assertEqual(self.scheduler.cancel(a.job_id), None)
+        self.assertEqual(self.scheduler.get(a.job_id), None)
+        self.scheduler.add(now + 0.1, "c", True)
+        self.scheduler.start()
+        self.assertEqual(self.wait_fired(2), [ "b", "c" ])
+    def test_reschedule(self):
+        # as the heater planner does it: cancel, and add at the new time
+        now = time.time()
+        a = self.scheduler.add(now + 10, "a", True)
+        self.scheduler.add(now - 1, "b", True)
+        self.scheduler.cancel(a.job_id)
+        self.scheduler.add(now - 2, "a", True)
+        self.scheduler.start()
+        self.assertEqual(self.wait_fired(2), [ "a", "b" ])
+        self.assertEqual(self.scheduler.values(), [])
+    def test_ids(self):
+        a = self.scheduler.add(time.time(), "a", True)
+        b = self.scheduler.add(time.time(), "b", False)
+        self.assertEqual((a.job_id, b.job_id), (1, 2))
+        self.assertEqual(self.scheduler.get(2), b)
+    def test_load_missed(self):
+        now = 100000.0
+        loaded = [ jobs.Job(3, now - 10, "run", True, jobs.MISSED_RUN),
+                   jobs.Job(7, now - 10, "skip", True, jobs.MISSED_SKIP),
+                   jobs.Job(5, now - jobs.DEFAULT_MAX_LATENESS - 1, "stale",
+                            True, jobs.MISSED_RUN),
+                   jobs.Job(4, now + 10, "future", True, jobs.MISSED_SKIP) ]
+        dropped = self.scheduler.load(loaded, now)
+        self.assertEqual(sorted(job.switch_name for job in dropped),
+                         [ "skip", "stale" ])
+        self.assertEqual([ job.job_id for job in self.scheduler.values() ],
+                         [ 3, 4 ])
+        self.assertEqual(self.scheduler.stats()["missed"], 2)
+        # new ids follow on from the highest loaded one, dropped or not
+        self.assertEqual(self.scheduler.add(now, "new", True).job_id, 8)
+    def test_thread_fires_in_order(self):
+        self.scheduler.start()
+        now = time.time()
+        self.scheduler.add(now + 0.2, "c", True)
+        self.scheduler.add(now + 0.1, "b", True)
+        self.scheduler.add(now - 1, "a", True)
+        self.assertEqual(self.wait_fired(3), [ "a", "b", "c" ])
+        stats = self.scheduler.stats()
+        self.assertEqual((stats["pending"], stats["fired"]), (0, 3))
+        self.assertTrue(stats["last_lateness"] >= 0)
+    def test_thread_woken_by_earlier_job(self):
+        self.scheduler.start()
+        self.scheduler.add(time.time() + 3600, "later", True)
+        time.sleep(0.05)
+        self.scheduler.add(time.time(), "now", True)
+        self.assertEqual(self.wait_fired(1), [ "now" ])
+    def test_failing_job(self):
+        now = time.time()
+        self.scheduler.add(now - 2, "fail", True)
+        self.scheduler.add(now - 1, "ok", True)
+        self.scheduler.start()
+        self.assertEqual(self.wait_fired(2), [ "fail", "ok" ])
+    def test_halt_while_waiting(self):
+        self.scheduler.add(time.time() + 3600, "later", True)
+        self.scheduler.start()
+        time.sleep(0.05)
+        start = time.monotonic()
+        self.scheduler.halt()
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertFalse(self.scheduler.is_alive())
+        self.assertEqual(self.fired, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+#
+# Tests for the JSON-RPC interface.
+#
+
+import unittest
+
+import jsonrpcif
+
+class EventLog:
+    def since(self, cursor, limit):
+        raise AssertionError("long poll run in a multicall")
+
+class Hub:
+    def __init__(self):
+        self.event_log = EventLog()
+        self.depth = 0
+    def lock(self):
+        self.depth += 1
+    def unlock(self):
+        self.depth -= 1
+
+class MulticallTest (unittest.TestCase):
+    def setUp(self):
+        self.hub = Hub()
+        self.jif = jsonrpcif.JSONRPCIf(self.hub)
+    def tearDown(self):
+        self.jif.server.server_close()
+    def test_long_poll_rejected(self):
+        results = self.jif.multicall([ [ "get_events_since", [ 0, 30 ] ],
+                                       [ "no_such_method", [] ] ])
+        self.assertEqual(results[0],
+                         [ False, "get_events_since can't be part of a "
+                           "multicall." ])
+        self.assertEqual(results[1],
+                         [ False, "No such method no_such_method." ])
+        self.assertEqual(self.hub.depth, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+#
+# Tests for the non-blocking logging.
+#
+
+import syslog
+import time
+import unittest
+from unittest import mock
+
+import log
+
+class Arg:
+    def __init__(self):
+        self.formatted = False
+    def __str__(self):
+        self.formatted = True
+        return "arg"
+
+class LogTest (unittest.TestCase):
+    def setUp(self):
+        log.flush()
+        log.setlogmask(syslog.LOG_UPTO(syslog.LOG_INFO))
+    def tearDown(self):
+        log.setlogmask(syslog.LOG_UPTO(syslog.LOG_DEBUG))
+    def test_masked_not_formatted(self):
+        arg = Arg()
+        with mock.patch("syslog.syslog") as write:
+            log.log(syslog.LOG_DEBUG, "Debug %s.", arg)
+            log.flush()
+        self.assertFalse(write.called)
+        self.assertFalse(arg.formatted)
+        self.assertFalse(log.enabled(syslog.LOG_DEBUG))
+    def test_enabled_written(self):
+        with mock.patch("syslog.syslog") as write:
+            log.log(syslog.LOG_INFO, "Info %s.", Arg())
+            log.flush()
+            # the writer thread may have got to it first
+            deadline = time.monotonic() + 5
+            while not write.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+        write.assert_called_once_with(syslog.LOG_INFO, "Info arg.")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#
+# Tests for the snapshot and journal state store.
+#
+
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import persist
+
+class Item:
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+def item_key(item):
+    return item.key
+
+class StateStoreTest (unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirname, "state")
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+    def open_store(self):
+        items = {}
+        store = persist.StateStore(self.filename, threading.RLock())
+        store.add_section("items", item_key, items.get,
+                          lambda: items.values())
+        return store, items
+    def load(self):
+        store, items = self.open_store()
+        return dict((item.key, item.value)
+                    for item in store.load().get("items", []))
+    def test_journal_replayed(self):
+        store, items = self.open_store()
+        items["a"] = Item("a", 1)
+        store.flush(compact=True)
+        items["a"] = Item("a", 2)
+        items["b"] = Item("b", 3)
+        store.mark("items", "a")
+        store.mark("items", "b")
+        store.flush()
+        del items["b"]
+        store.mark("items", "b")
+        store.flush()
+        self.assertEqual(self.load(), { "a": 2 })
+    def test_torn_journal_write(self):
+        store, items = self.open_store()
+        items["a"] = Item("a", 1)
+        store.flush(compact=True)
+        items["a"] = Item("a", 2)
+        store.mark("items", "a")
+        store.flush()
+        # a record whose write never finished
+        data = pickle.dumps(("items", "a", Item("a", 3)))
+        record = persist.RECORD_HEADER.pack(len(data)) + data
+        with open(store.journal_filename, "ab") as f:
+            f.write(record[:len(record) - 5])
+        self.assertEqual(self.load(), { "a": 2 })
+    def test_failed_journal_write(self):
+        store, items = self.open_store()
+        items["a"] = Item("a", 1)
+        store.flush(compact=True)
+        items["a"] = Item("a", 2)
+        store.mark("items", "a")
+        size = os.path.getsize(store.journal_filename)
+        with mock.patch("os.fsync", side_effect=OSError("I/O error")):
+            self.assertRaises(OSError, store.flush)
+        # what wasn't synced may never have reached the disk
+        os.truncate(store.journal_filename, size)
+        items["b"] = Item("b", 3)
+        store.mark("items", "b")
+        # the change that failed to be saved is still saved next time
+        store.flush()
+        self.assertEqual(self.load(), { "a": 2, "b": 3 })
+        store.flush()
+        self.assertEqual(self.load(), { "a": 2, "b": 3 })
+    def test_failed_snapshot_write(self):
+        store, items = self.open_store()
+        items["a"] = Item("a", 1)
+        store.flush(compact=True)
+        items["a"] = Item("a", 2)
+        store.mark("items", "a")
+        with mock.patch("os.rename", side_effect=OSError("disk full")):
+            self.assertRaises(OSError, store.flush, True)
+        self.assertEqual(self.load(), { "a": 1 })
+        store.flush()
+        self.assertEqual(self.load(), { "a": 2 })
+    def test_stale_journal_ignored(self):
+        store, items = self.open_store()
+        items["a"] = Item("a", 1)
+        store.flush(compact=True)
+        items["b"] = Item("b", 2)
+        store.mark("items", "b")
+        store.flush()
+        stale = open(store.journal_filename, "rb").read()
+        del items["b"]
+        items["a"] = Item("a", 3)
+        store.flush(compact=True)
+        # as if the new snapshot was renamed into place, but the journal
+        # not yet replaced, when the hub stopped
+        with open(store.journal_filename, "wb") as f:
+            f.write(stale)
+        self.assertEqual(self.load(), { "a": 3 })
+    def test_repeated_compaction(self):
+        store, items = self.open_store()
+        for i in range(0, 3):
+            items["a"] = Item("a", i)
+            store.mark("items", "a")
+            store.flush()
+            store.flush(compact=True)
+        self.assertEqual(self.load(), { "a": 2 })
+        self.assertFalse(os.path.exists(store.snapshot_filename + ".tmp"))
+        self.assertFalse(os.path.exists(store.journal_filename + ".tmp"))
+    def test_close_compacts(self):
+        store, items = self.open_store()
+        items["a"] = Item("a", 1)
+        store.flush(compact=True)
+        journal_size = os.path.getsize(store.journal_filename)
+        items["a"] = Item("a", 2)
+        store.mark("items", "a")
+        store.close()
+        # everything went to the snapshot; the journal is back to its
+        # header
+        self.assertEqual(os.path.getsize(store.journal_filename),
+                         journal_size)
+        self.assertEqual(self.load(), { "a": 2 })
+
+if __name__ == "__main__":
+    unittest.main()
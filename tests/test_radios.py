@@ -0,0 +1,107 @@
+#
+# Tests for routing switch commands over several radios.
+#
+
+import time
+import unittest
+
+import dedupe
+import radios
+import rfxtrx433
+
+TYPE = rfxtrx433.TYPE_LIGHTING2_MESSAGE
+
+class Radio:
+    def __init__(self):
+        self.sent = []
+    def set_switch(self, device_id, unit_id, seq_no, state, priority,
+                   delay=0):
+        self.sent.append((device_id, unit_id, state, delay))
+    def stats(self):
+        return {}
+
+def nop(*args):
+    pass
+
+class RadioSetTest (unittest.TestCase):
+    def setUp(self):
+        self.deduper = dedupe.Deduper()
+        self.radios = radios.RadioSet(self.deduper)
+        self.a = Radio()
+        self.b = Radio()
+        self.radios.add("a", self.a)
+        self.radios.add("b", self.b)
+    def test_fan_out(self):
+        self.radios.set_switch(TYPE, 0x123, 1, 0, True, 0)
+        self.assertEqual(self.a.sent, [ (0x123, 1, True, 0) ])
+        self.assertEqual(self.b.sent, [ (0x123, 1, True, radios.STAGGER) ])
+        self.assertEqual(self.radios.fanned_out, 1)
+    def test_routed_to_best(self):
+        self.radios.heard_cb(0)(TYPE, 0x123, 1, 1, 3)
+        self.radios.heard_cb(1)(TYPE, 0x123, 1, 1, 7)
+        self.assertEqual(self.radios.best_radio(TYPE, 0x123, 1), 1)
+        # other units of the device go the same way
+        self.assertEqual(self.radios.best_radio(TYPE, 0x123, 2), 1)
+        self.radios.set_switch(TYPE, 0x123, 1, 0, True, 0)
+        self.assertEqual((self.a.sent, len(self.b.sent)), ([], 1))
+        self.assertEqual(self.radios.routed, 1)
+        self.assertEqual(self.radios.routes(),
+                         [ (TYPE, 0x123, 1, "b", 7), (TYPE, 0x123, None, "b",
+                                                      7) ])
+    def test_route_expires(self):
+        routes = radios.RadioSet(max_age=0.05)
+        routes.add("a", Radio())
+        routes.heard_cb(0)(TYPE, 0x123, 1, 1, 3)
+        self.assertEqual(routes.best_radio(TYPE, 0x123, 1), 0)
+        time.sleep(0.1)
+        self.assertEqual(routes.best_radio(TYPE, 0x123, 1), None)
+        self.assertEqual(routes.routes(), [])
+    def test_own_transmission_marked(self):
+        self.radios.set_switch(TYPE, 0x123, 1, 0, True, 0)
+        self.assertTrue(self.deduper.duplicate((TYPE, 0x123, 1, 1),
+                                               time.monotonic()))
+    def test_own_transmission_not_a_route(self):
+        self.radios.set_switch(TYPE, 0x123, 1, 0, True, 0)
+        # radio b hears what a sent
+        self.radios.heard_cb(1)(TYPE, 0x123, 1, 1, 9)
+        self.assertEqual(self.radios.best_radio(TYPE, 0x123, 1), None)
+        self.assertEqual(self.radios.stats()["echoes"], 1)
+        # the device itself, or a remote, saying something else is
+        self.radios.heard_cb(0)(TYPE, 0x123, 1, 0, 5)
+        self.assertEqual(self.radios.best_radio(TYPE, 0x123, 1), 0)
+    def test_own_transmission_not_marked_with_one_radio(self):
+        # nothing else hears it, so a remote sending the same is real
+        single = radios.RadioSet(self.deduper)
+        single.add("a", Radio())
+        single.set_switch(TYPE, 0x456, 2, 0, False, 0)
+        self.assertFalse(self.deduper.duplicate((TYPE, 0x456, 2, 0),
+                                                time.monotonic()))
+        single.heard_cb(0)(TYPE, 0x456, 2, 0, 5)
+        self.assertEqual(single.best_radio(TYPE, 0x456, 2), 0)
+    def test_clock(self):
+        # as when replaying a capture from long ago
+        self.radios.clock = lambda: 1000000000.0
+        self.radios.set_switch(TYPE, 0x123, 1, 0, True, 0)
+        self.assertTrue(self.deduper.duplicate((TYPE, 0x123, 1, 1),
+                                               1000000000.5))
+        self.radios.heard_cb(0)(TYPE, 0x123, 1, 0, 5)
+        self.assertEqual(self.radios.best_radio(TYPE, 0x123, 1), 0)
+        self.radios.clock = lambda: 1000000000.0 + radios.ROUTE_MAX_AGE + 1
+        self.assertEqual(self.radios.best_radio(TYPE, 0x123, 1), None)
+    def test_decoders_share_deduper(self):
+        presses = []
+        decoders = [ rfxtrx433.Decoder(nop, nop,
+                                       lambda *args: presses.append(args),
+                                       self.deduper, heard_cb=
+                                       self.radios.heard_cb(i))
+                     for i in range(0, 2) ]
+        # the same press, heard weakly by a and well by b
+        decoders[0].parse_frame(bytes.fromhex("0b 11 00 03 01 23 45 67 01 01 "
+                                              "0f 30"))
+        decoders[1].parse_frame(bytes.fromhex("0b 11 00 03 01 23 45 67 01 01 "
+                                              "0f 70"))
+        self.assertEqual(presses, [ (0x01234567, 1, 1) ])
+        self.assertEqual(self.radios.best_radio(TYPE, 0x01234567, 1), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#
+# Tests for the device registry.
+#
+
+import unittest
+
+import registry
+
+class Device:
+    def __init__(self, device_id, unit_id, name):
+        self.device_id = device_id
+        self.unit_id = unit_id
+        self.name = name
+
+def device_addr(d):
+    return (d.device_id, d.unit_id)
+
+def device_name(d):
+    return d.name
+
+class RegistryTest (unittest.TestCase):
+    def setUp(self):
+        self.registry = registry.Registry(device_addr, device_name)
+        self.a = Device(1, 1, "porch")
+        self.b = Device(1, 2, "hall")
+        self.c = Device(2, 1, "garage")
+        self.registry.load([ self.a, self.b, self.c ])
+    def test_lookups(self):
+        self.assertIs(self.registry.get((1, 2)), self.b)
+        self.assertIs(self.registry.find("garage"), self.c)
+        self.assertEqual(self.registry.get((9, 9)), None)
+        self.assertEqual(self.registry.find("cellar"), None)
+        self.assertTrue((1, 1) in self.registry)
+        self.assertEqual(len(self.registry), 3)
+    def test_insertion_order(self):
+        self.assertEqual(list(self.registry), [ self.a, self.b, self.c ])
+        # replacing keeps the position, like assigning to a list slot
+        a2 = Device(1, 1, "front door")
+        self.registry.add(a2)
+        self.assertEqual(list(self.registry), [ a2, self.b, self.c ])
+        self.assertEqual(self.registry.find("porch"), None)
+        self.assertIs(self.registry.find("front door"), a2)
+    def test_remove(self):
+        self.assertIs(self.registry.remove((1, 2)), self.b)
+        self.assertEqual(self.registry.find("hall"), None)
+        self.assertEqual(list(self.registry), [ self.a, self.c ])
+        self.assertRaises(KeyError, self.registry.remove, (1, 2))
+    def test_reindex(self):
+        self.b.name = "stairs"
+        self.registry.reindex(self.b, "hall")
+        self.assertEqual(self.registry.find("hall"), None)
+        self.assertIs(self.registry.find("stairs"), self.b)
+    def test_shared_names(self):
+        # names need not be unique; the first added is found
+        d = Device(3, 1, "porch")
+        self.registry.add(d)
+        self.assertIs(self.registry.find("porch"), self.a)
+        self.registry.remove((1, 1))
+        self.assertIs(self.registry.find("porch"), d)
+    def test_unnamed(self):
+        self.registry.add(Device(4, 1, None))
+        self.registry.add(Device(4, 2, None))
+        self.assertEqual(self.registry.find(None).unit_id, 1)
+
+if __name__ == "__main__":
+    unittest.main()
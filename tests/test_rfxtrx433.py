@@ -0,0 +1,197 @@
+#
+# Tests for the RFXtrx433 frame reader and decoder.
+#
+
+import struct
+import unittest
+from unittest import mock
+
+import dedupe
+import rfxtrx433
+
+TEMP_FRAME = bytes.fromhex("08 50 05 01 99 a6 00 d7 69")
+NEGATIVE_TEMP_FRAME = bytes.fromhex("08 50 07 02 44 01 80 2d 50")
+BUTTON_FRAME = bytes.fromhex("0b 11 00 03 01 23 45 67 01 01 0f 70")
+STATUS_FRAME = bytes.fromhex("0d 01 00 00 02 53 45 00 00 00 00 00 00 00")
+UNKNOWN_FRAME = bytes.fromhex("07 20 00 06 12 34 56 00")
+
+STREAM = TEMP_FRAME + BUTTON_FRAME + STATUS_FRAME + UNKNOWN_FRAME + \
+    NEGATIVE_TEMP_FRAME
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+    def decoder(self, **kw):
+        return rfxtrx433.Decoder(self.status, self.temp, self.button, **kw)
+    def status(self, firmware_rev):
+        self.calls.append(("status", firmware_rev))
+    def temp(self, sensor_id, seq_no, temp, signal_level):
+        self.calls.append(("temp", sensor_id, seq_no, temp, signal_level))
+    def button(self, device_id, unit_id, state):
+        self.calls.append(("button", device_id, unit_id, state))
+
+class Device:
+    # what FrameReader.fill() needs of a serial port
+    def __init__(self, data):
+        self.data = data
+    @property
+    def in_waiting(self):
+        return len(self.data)
+    def readinto(self, buf):
+        n = min(len(buf), len(self.data))
+        buf[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+class DecoderTest (unittest.TestCase):
+    def test_temp(self):
+        recorder = Recorder()
+        recorder.decoder().parse_frame(TEMP_FRAME)
+        # sensor ids are id_hi<<8 + id_lo, which Python reads as
+        # id_hi << (8 + id_lo); kept, so named sensors keep their ids
+        self.assertEqual(recorder.calls,
+                         [ ("temp", 0x99 << (8 + 0xa6), 1, 21.5, 6) ])
+    def test_negative_temp(self):
+        recorder = Recorder()
+        recorder.decoder().parse_frame(NEGATIVE_TEMP_FRAME)
+        self.assertEqual(recorder.calls,
+                         [ ("temp", 0x44 << (8 + 0x01), 2, -4.5, 5) ])
+    def test_button(self):
+        recorder = Recorder()
+        recorder.decoder().parse_frame(BUTTON_FRAME)
+        self.assertEqual(recorder.calls, [ ("button", 0x01234567, 1, 1) ])
+    def test_status(self):
+        recorder = Recorder()
+        recorder.decoder().parse_frame(STATUS_FRAME)
+        self.assertEqual(recorder.calls, [ ("status", 0x45) ])
+    def test_per_byte_and_framed_agree(self):
+        per_byte = Recorder()
+        decoder = per_byte.decoder()
+        for i in range(0, len(STREAM)):
+            decoder.put_char(STREAM[i:i+1])
+        framed = Recorder()
+        rfxtrx433.FrameReader().feed(STREAM, framed.decoder().parse_frame)
+        self.assertEqual(len(per_byte.calls), 4)
+        self.assertEqual(per_byte.calls, framed.calls)
+
+class Rain:
+    # a handler for a packet type the decoder doesn't know of
+    layout = struct.Struct(">3xBH")
+    def __init__(self):
+        self.fields = []
+    def handle(self, decoder, fields):
+        self.fields.append(fields)
+
+class HandlerTableTest (unittest.TestCase):
+    def test_counts(self):
+        recorder = Recorder()
+        decoder = recorder.decoder()
+        for frame in (TEMP_FRAME, TEMP_FRAME, BUTTON_FRAME, UNKNOWN_FRAME):
+            decoder.parse_frame(frame)
+        result = decoder.stats()
+        self.assertEqual(result["frames"], { "0x50/0x05": 2, "0x11/0x00": 1,
+                                             "0x20/0x00": 1 })
+        self.assertEqual((result["short"], result["unknown"]), (0, 1))
+        self.assertEqual(result["parse"]["count"], 4)
+    def test_short_frames(self):
+        recorder = Recorder()
+        decoder = recorder.decoder()
+        # cut off before the end of their layouts
+        decoder.parse_frame(TEMP_FRAME[:6])
+        decoder.parse_frame(BUTTON_FRAME[:9])
+        decoder.parse_frame(b"\x01\x50")
+        self.assertEqual(recorder.calls, [])
+        self.assertEqual((decoder.short, decoder.unknown), (3, 0))
+    def test_other_temp_subtypes_unknown(self):
+        # 0x50 packets used to all be decoded as Lacrosse readings,
+        # whatever their subtype
+        recorder = Recorder()
+        decoder = recorder.decoder()
+        decoder.parse_frame(bytes.fromhex("08 50 01 01 99 a6 00 d7 69"))
+        self.assertEqual(recorder.calls, [])
+        self.assertEqual(decoder.unknown, 1)
+    def test_register_handler(self):
+        rain = Rain()
+        with mock.patch.dict(rfxtrx433.HANDLERS):
+            rfxtrx433.register_handler(0x55, 0x02, rain)
+            recorder = Recorder()
+            decoder = recorder.decoder()
+            decoder.parse_frame(bytes.fromhex("0b 55 02 09 01 2c 00 00 00 00 "
+                                              "00 79"))
+        self.assertEqual(rain.fields, [ (9, 0x012c) ])
+        self.assertEqual(decoder.unknown, 0)
+        self.assertNotIn(rfxtrx433.handler_key(0x55, 0x02),
+                         rfxtrx433.HANDLERS)
+    def test_own_table(self):
+        rain = Rain()
+        recorder = Recorder()
+        decoder = recorder.decoder(handlers={ 0x5502: rain })
+        decoder.parse_frame(TEMP_FRAME)
+        decoder.parse_frame(bytes.fromhex("0b 55 02 09 01 2c 00 00 00 00 00 "
+                                          "79"))
+        self.assertEqual(recorder.calls, [])
+        self.assertEqual(rain.fields, [ (9, 0x012c) ])
+        self.assertEqual(decoder.unknown, 1)
+
+class DecoderDedupeTest (unittest.TestCase):
+    def test_repeats_suppressed(self):
+        recorder = Recorder()
+        decoder = recorder.decoder(deduper=dedupe.Deduper(60))
+        decoder.parse_frame(TEMP_FRAME)
+        # another seq no and signal level, but the same reading
+        decoder.parse_frame(bytes.fromhex("08 50 05 02 99 a6 00 d7 39"))
+        decoder.parse_frame(bytes.fromhex("08 50 05 03 99 a6 00 d8 69"))
+        decoder.parse_frame(BUTTON_FRAME)
+        decoder.parse_frame(BUTTON_FRAME)
+        decoder.parse_frame(bytes.fromhex("0b 11 00 04 01 23 45 67 01 00 0f "
+                                          "70"))
+        self.assertEqual(recorder.calls,
+                         [ ("temp", 0x99 << (8 + 0xa6), 1, 21.5, 6),
+                           ("temp", 0x99 << (8 + 0xa6), 3, 21.6, 6),
+                           ("button", 0x01234567, 1, 1),
+                           ("button", 0x01234567, 1, 0) ])
+    def test_no_deduper(self):
+        recorder = Recorder()
+        decoder = recorder.decoder()
+        decoder.parse_frame(BUTTON_FRAME)
+        decoder.parse_frame(BUTTON_FRAME)
+        self.assertEqual(len(recorder.calls), 2)
+
+class FrameReaderTest (unittest.TestCase):
+    def frames(self, chunks, size=rfxtrx433.FRAME_BUFFER_SIZE):
+        reader = rfxtrx433.FrameReader(size)
+        frames = []
+        count = 0
+        for chunk in chunks:
+            # the views are only valid until the next feed
+            count += reader.feed(chunk, lambda f: frames.append(bytes(f)))
+        self.assertEqual(count, len(frames))
+        return frames
+    def test_whole_stream(self):
+        self.assertEqual(self.frames([ STREAM ]),
+                         [ TEMP_FRAME, BUTTON_FRAME, STATUS_FRAME,
+                           UNKNOWN_FRAME, NEGATIVE_TEMP_FRAME ])
+    def test_split_anywhere(self):
+        expected = self.frames([ STREAM ])
+        for size in (1, 2, 3, 5, 7, 13):
+            chunks = [ STREAM[i:i+size] for i in range(0, len(STREAM), size) ]
+            self.assertEqual(self.frames(chunks), expected)
+    def test_small_buffer(self):
+        # a buffer just big enough for the longest frame still works
+        chunks = [ STREAM[i:i+4] for i in range(0, len(STREAM), 4) ]
+        self.assertEqual(self.frames(chunks, len(STATUS_FRAME)),
+                         self.frames([ STREAM ]))
+    def test_fill(self):
+        device = Device(STREAM[:20])
+        reader = rfxtrx433.FrameReader()
+        frames = []
+        self.assertEqual(reader.fill(device), 20)
+        self.assertEqual(reader.process(lambda f: frames.append(bytes(f))), 1)
+        self.assertEqual(frames, [ TEMP_FRAME ])
+        device.data = STREAM[20:]
+        reader.fill(device)
+        reader.process(lambda f: frames.append(bytes(f)))
+        self.assertEqual(frames, self.frames([ STREAM ]))
+
+if __name__ == "__main__":
+    unittest.main()
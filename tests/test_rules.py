@@ -0,0 +1,165 @@
+#
+# Tests for the rule engine.
+#
+
+import time
+import unittest
+
+import rules
+
+SENSORS = { "garage": 10, "outside": 11 }
+BUTTONS = { "hall": (20, 1) }
+
+def resolve_sensor(word):
+    if word not in SENSORS:
+        raise rules.RuleError("No sensor \"%s\"." % word)
+    return SENSORS[word]
+
+def resolve_button(word):
+    if word not in BUTTONS:
+        raise rules.RuleError("No button \"%s\"." % word)
+    return BUTTONS[word]
+
+def parse(text, name="rule"):
+    return rules.parse(name, text, resolve_sensor, resolve_button)
+
+def at(hour, minute=0):
+    # a time today, local time, at hour:minute
+    t = time.localtime()
+    return time.mktime((t.tm_year, t.tm_mon, t.tm_mday, hour, minute, 0, 0,
+                        0, -1))
+
+class ParseTest (unittest.TestCase):
+    def test_temp(self):
+        rule = parse("temp garage < 2 hysteresis 1 then heater on else off")
+        condition, = rule.conditions
+        self.assertEqual((condition.sensor_id, condition.op,
+                          condition.threshold, condition.hysteresis),
+                         (10, "<", 2.0, 1.0))
+        self.assertEqual((rule.switch_name, rule.state, rule.else_state),
+                         ("heater", True, False))
+    def test_button_and_time(self):
+        rule = parse("button hall on and time 22:00-06:30 "
+                     "then \"hall light\" on")
+        button, window = rule.conditions
+        self.assertEqual((button.device_id, button.unit_id, button.state),
+                         (20, 1, True))
+        self.assertEqual((window.start, window.end), (22*60, 6*60+30))
+        self.assertEqual(rule.switch_name, "hall light")
+        self.assertEqual(rule.else_state, None)
+        self.assertEqual(rule.keys(), set([ ("button", 20, 1) ]))
+    def test_errors(self):
+        for text in ("temp garage < 2",
+                     "time 06:00-22:00 then heater on",
+                     "temp cellar < 2 then heater on",
+                     "temp garage < cold then heater on",
+                     "temp garage = 2 then heater on",
+                     "button hall maybe then heater on",
+                     "time 25:00-06:00 and button hall on then heater on",
+                     "temp garage < 2 then heater on else",
+                     "temp garage < 2 and then heater on",
+                     "temp garage < 2 then \"heater on"):
+            self.assertRaises(rules.RuleError, parse, text)
+
+class ConditionTest (unittest.TestCase):
+    def test_hysteresis_below(self):
+        condition = rules.TempCondition(10, "<", 2.0, 1.0)
+        changes = [ (temp, condition.update(temp), condition.active)
+                    for temp in (5.0, 1.9, 2.5, 2.9, 3.0, 2.5, 1.0) ]
+        self.assertEqual(changes, [ (5.0, False, False), (1.9, True, True),
+                                    (2.5, False, True), (2.9, False, True),
+                                    (3.0, True, False), (2.5, False, False),
+                                    (1.0, True, True) ])
+    def test_hysteresis_above(self):
+        condition = rules.TempCondition(10, ">", 25.0, 2.0)
+        states = []
+        for temp in (20.0, 26.0, 24.0, 23.5, 23.0, 24.0):
+            condition.update(temp)
+            states.append(condition.active)
+        self.assertEqual(states, [ False, True, True, True, False, False ])
+    def test_time_window(self):
+        day = rules.TimeCondition(6*60, 22*60)
+        self.assertTrue(day.holds(at(6)))
+        self.assertTrue(day.holds(at(21, 59)))
+        self.assertFalse(day.holds(at(22)))
+        night = rules.TimeCondition(22*60, 6*60)
+        self.assertTrue(night.holds(at(23)))
+        self.assertTrue(night.holds(at(5, 59)))
+        self.assertFalse(night.holds(at(6)))
+        self.assertFalse(night.holds(at(12)))
+
+class RuleEngineTest (unittest.TestCase):
+    def setUp(self):
+        self.actions = []
+        self.changed = []
+        self.engine = rules.RuleEngine(self.action, self.changed.append)
+    def action(self, rule, switch_name, state):
+        self.actions.append((rule.name, switch_name, state))
+    def test_acts_on_changes_only(self):
+        self.engine.add(parse("temp garage < 2 hysteresis 1 "
+                              "then heater on else off", "frost"))
+        for temp in (5.0, 4.0, 1.5, 1.0, 2.5, 0.5, 3.5, 4.0):
+            self.engine.temp(10, temp, at(12))
+        # the first reading settles the state, which is acted on; after
+        # that, only changes are
+        self.assertEqual(self.actions, [ ("frost", "heater", False),
+                                         ("frost", "heater", True),
+                                         ("frost", "heater", False) ])
+        self.assertEqual(self.engine.fired, 3)
+    def test_only_dependent_rules_evaluated(self):
+        self.engine.add(parse("temp garage < 2 then heater on", "garage"))
+        self.engine.add(parse("temp outside < 2 then heater on", "outside"))
+        self.engine.temp(10, 1.0, at(12))
+        self.engine.temp(99, 1.0, at(12))
+        self.assertEqual(self.engine.evaluated, 1)
+        self.assertEqual(self.actions, [ ("garage", "heater", True) ])
+    def test_button(self):
+        self.engine.add(parse("button hall on then \"hall light\" on "
+                              "else off", "hall"))
+        for state in (True, True, False, True):
+            self.engine.button(20, 1, state, at(12))
+        self.assertEqual([ state for name, switch, state in self.actions ],
+                         [ True, False, True ])
+    def test_time_window_checked_on_readings(self):
+        self.engine.add(parse("temp garage < 2 and time 06:00-22:00 "
+                              "then heater on else off", "day"))
+        self.engine.temp(10, 1.0, at(23))
+        self.engine.temp(10, 1.0, at(7))
+        self.engine.temp(10, 1.0, at(8))
+        self.assertEqual([ state for name, switch, state in self.actions ],
+                         [ False, True ])
+    def test_disabled(self):
+        self.engine.add(parse("temp garage < 2 hysteresis 1 "
+                              "then heater on else off", "frost"))
+        self.engine.set_enabled("frost", False)
+        self.engine.temp(10, 1.0, at(12))
+        self.assertEqual(self.actions, [])
+        # conditions are still tracked, and acted on once enabled
+        self.assertTrue(self.engine.get("frost").conditions[0].active)
+        self.engine.set_enabled("frost", True)
+        self.engine.temp(10, 2.5, at(12))
+        self.assertEqual(self.actions, [ ("frost", "heater", True) ])
+    def test_remove(self):
+        self.engine.add(parse("temp garage < 2 then heater on", "frost"))
+        self.engine.remove("frost")
+        self.engine.temp(10, 1.0, at(12))
+        self.assertEqual(self.actions, [])
+        self.assertEqual(self.engine.evaluated, 0)
+        self.assertEqual(self.engine.get("frost"), None)
+    def test_replace(self):
+        self.engine.add(parse("temp garage < 2 then heater on", "frost"))
+        self.engine.add(parse("temp outside < 2 then heater on", "frost"))
+        self.engine.temp(10, 1.0, at(12))
+        self.engine.temp(11, 1.0, at(12))
+        self.assertEqual(len(self.engine.rules), 1)
+        self.assertEqual(self.engine.evaluated, 1)
+    def test_changed(self):
+        self.engine.add(parse("temp garage < 2 then heater on", "frost"))
+        self.engine.temp(10, 5.0, at(12))
+        self.engine.temp(10, 5.0, at(12))
+        self.engine.temp(10, 1.0, at(12))
+        # once when first evaluated, once when the condition changed
+        self.assertEqual(len(self.changed), 2)
+
+if __name__ == "__main__":
+    unittest.main()
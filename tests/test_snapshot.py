@@ -0,0 +1,103 @@
+#
+# Tests for the immutable hub state snapshots.
+#
+
+import unittest
+
+import snapshot
+
+class Switch:
+    def __init__(self, device_id, unit_id, name, state):
+        self.device_id = device_id
+        self.unit_id = unit_id
+        self.name = name
+        self.state = state
+
+class Sensor:
+    def __init__(self, sensor_id, name, temp, last_update):
+        self.sensor_id = sensor_id
+        self.name = name
+        self.temp = temp
+        self.last_update = last_update
+
+class Button:
+    def __init__(self, device_id, unit_id, name, on_action, off_action):
+        self.device_id = device_id
+        self.unit_id = unit_id
+        self.name = name
+        self.on_action = on_action
+        self.off_action = off_action
+
+class SnapshotTest (unittest.TestCase):
+    def test_switch_section(self):
+        switches = [ Switch(1, 1, "porch", True), Switch(1, 2, "hall", None),
+                     Switch(2, 1, "hall", False) ]
+        section = snapshot.SwitchSection(switches)
+        self.assertEqual(section.items, ((1, 1, "porch", True),
+                                         (1, 2, "hall", None),
+                                         (2, 1, "hall", False)))
+        self.assertEqual(section.get((2, 1)), (2, 1, "hall", False))
+        # the first switch of a name is the one found by it
+        self.assertEqual(section.find("hall"), (1, 2, "hall", None))
+        self.assertEqual(section.get((3, 1)), None)
+        self.assertEqual(section.find("attic"), None)
+    def test_detached_from_objects(self):
+        switch = Switch(1, 1, "porch", True)
+        sensor = Sensor(5, None, 21.5, 1000.0)
+        snap = snapshot.Snapshot(snapshot.SensorSection([ sensor ]),
+                                 snapshot.SwitchSection([ switch ]))
+        switch.state = False
+        sensor.temp = 22.0
+        self.assertEqual(snap.switches.get((1, 1))[3], True)
+        self.assertEqual(snap.temp_sensors.items, ((5, None, 21.5, 1000.0), ))
+    def test_replace_shares_sections(self):
+        snap = snapshot.Snapshot(
+            snapshot.SensorSection([ Sensor(5, "out", 1.0, 1000.0) ]),
+            snapshot.SwitchSection([ Switch(1, 1, "porch", True) ]),
+            snapshot.button_section([ Button(7, 1, "door", "on", None) ]))
+        new = snap.replace(
+            temp_sensors=snapshot.SensorSection([ Sensor(5, "out", 2.0,
+                                                         1010.0) ]))
+        self.assertEqual(new.temp_sensors.items, ((5, "out", 2.0, 1010.0), ))
+        self.assertIs(new.switches, snap.switches)
+        self.assertIs(new.buttons, snap.buttons)
+        # the old snapshot is left as it was
+        self.assertEqual(snap.temp_sensors.items, ((5, "out", 1.0, 1000.0), ))
+        self.assertEqual(snap.buttons, ((7, 1, "door", "on", None), ))
+    def test_switch_updated(self):
+        switches = [ Switch(1, 1, "porch", True), Switch(1, 2, "hall", None),
+                     Switch(2, 1, "hall", False) ]
+        section = snapshot.SwitchSection(switches)
+        switches[1].state = True
+        new = section.updated(switches[1])
+        self.assertEqual(new.items, ((1, 1, "porch", True),
+                                     (1, 2, "hall", True),
+                                     (2, 1, "hall", False)))
+        self.assertEqual(new.get((1, 2)), (1, 2, "hall", True))
+        self.assertEqual(new.find("hall"), (1, 2, "hall", True))
+        # the old section is left as it was
+        self.assertEqual(section.get((1, 2)), (1, 2, "hall", None))
+        self.assertEqual(section.find("hall"), (1, 2, "hall", None))
+    def test_switch_updated_needs_rebuild(self):
+        section = snapshot.SwitchSection([ Switch(1, 1, "porch", True) ])
+        self.assertEqual(section.updated(Switch(1, 2, "hall", True)), None)
+        self.assertEqual(section.updated(Switch(1, 1, "door", True)), None)
+    def test_sensor_updated(self):
+        sensors = [ Sensor(5, "out", 1.0, 1000.0), Sensor(6, "in", 20.0,
+                                                           1000.0) ]
+        section = snapshot.SensorSection(sensors)
+        sensors[1].temp = 21.0
+        new = section.updated(sensors[1])
+        self.assertEqual(new.items, ((5, "out", 1.0, 1000.0),
+                                     (6, "in", 21.0, 1000.0)))
+        self.assertEqual(section.items, ((5, "out", 1.0, 1000.0),
+                                         (6, "in", 20.0, 1000.0)))
+        self.assertEqual(section.updated(Sensor(7, None, 3.0, 1000.0)), None)
+    def test_empty(self):
+        snap = snapshot.Snapshot()
+        self.assertEqual(snap.temp_sensors.items, ())
+        self.assertEqual(snap.switches.items, ())
+        self.assertEqual(snap.buttons, ())
+
+if __name__ == "__main__":
+    unittest.main()
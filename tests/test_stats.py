@@ -0,0 +1,64 @@
+#
+# Tests for the latency histograms.
+#
+
+import threading
+import unittest
+
+import stats
+
+class HistogramTest (unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(stats.Histogram().to_dict(), { "count": 0 })
+    def test_percentiles(self):
+        h = stats.Histogram()
+        # 90 samples of 3 us, 9 of 100 us and one of 5 ms
+        for i in range(0, 90):
+            h.add(0.000003)
+        for i in range(0, 9):
+            h.add(0.0001)
+        h.add(0.005)
+        d = h.to_dict()
+        self.assertEqual(d["count"], 100)
+        self.assertAlmostEqual(d["mean"], (90 * 3 + 9 * 100 + 5000) / 100.0
+                               / 1000000)
+        # reported as the upper bound of the bucket
+        self.assertEqual(d["p50"], 4 / 1000000.0)
+        self.assertEqual(d["p90"], 4 / 1000000.0)
+        self.assertEqual(d["p99"], 128 / 1000000.0)
+        self.assertEqual(d["max"], 0.005)
+    def test_percentile_capped_by_max(self):
+        h = stats.Histogram()
+        h.add(0.000100)
+        self.assertEqual(h.percentile(0.5), 0.0001)
+    def test_zero_and_long_samples(self):
+        h = stats.Histogram()
+        h.add(0.0)
+        h.add(10.0)
+        self.assertEqual(h.percentile(0.5), 1 / 1000000.0)
+        self.assertEqual(h.percentile(1.0), 10.0)
+
+class HistogramSetTest (unittest.TestCase):
+    def test_threads(self):
+        histograms = stats.HistogramSet()
+        def add(name):
+            for i in range(0, 1000):
+                histograms.add(name, 0.001)
+        threads = [ threading.Thread(target=add, args=(name, ))
+                    for name in ("a", "a", "b") ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        d = histograms.to_dict()
+        self.assertEqual(sorted(d), [ "a", "b" ])
+        self.assertEqual((d["a"]["count"], d["b"]["count"]), (2000, 1000))
+
+class CountsTest (unittest.TestCase):
+    def test_counts_to_dict(self):
+        self.assertEqual(stats.counts_to_dict({ 0x5001: 3, 0x1100: 1 }, hex),
+                         { "0x5001": 3, "0x1100": 1 })
+        self.assertEqual(stats.counts_to_dict({ 1: 2 }), { "1": 2 })
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+#
+# Tests for the temperature series.
+#
+
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+from array import array
+from unittest import mock
+
+import persist
+import tempseries
+from tempseries import MINUTE, HOUR
+
+T0 = 1700000000.0 - 1700000000.0 % tempseries.DAY
+
+def dump(store):
+    return dict((series.sensor_id, [ [ list(a) for a in tier.arrays() ]
+                                     for tier in series.tiers ])
+                for series in store.values())
+
+class TempSeriesTest (unittest.TestCase):
+    def test_raw_points(self):
+        series = tempseries.TempSeries(1)
+        for i, temp in enumerate((1.0, 3.0, 2.0)):
+            series.add(T0 + i * 20, temp)
+        series.add(T0 + MINUTE, 10.0)
+        self.assertEqual(series.series(T0, None),
+                         [ (T0, 1.0, 1.0, 1.0, 1), (T0 + 20, 3.0, 3.0, 3.0, 1),
+                           (T0 + 40, 2.0, 2.0, 2.0, 1),
+                           (T0 + 60, 10.0, 10.0, 10.0, 1) ])
+        # adjacent points are merged to fit
+        self.assertEqual(series.series(T0, None, 1),
+                         [ (T0, 1.0, 10.0, 4.0, 4) ])
+        self.assertEqual(series.series(T0 + 20, T0 + 60, 1),
+                         [ (T0 + 20, 2.0, 3.0, 2.5, 2) ])
+    def test_coarser_tier_for_old_data(self):
+        series = tempseries.TempSeries(1)
+        for i in range(0, tempseries.RAW_CAPACITY * 2):
+            series.add(T0 + i * MINUTE, float(i % 10))
+        # raw readings no longer reach back to the start
+        points = series.series(T0, None, 10)
+        self.assertEqual(points[0][0], T0)
+        self.assertEqual(sum(p[4] for p in points),
+                         tempseries.RAW_CAPACITY * 2)
+        self.assertEqual(min(p[1] for p in points), 0.0)
+        self.assertEqual(max(p[2] for p in points), 9.0)
+    def test_hour_buckets(self):
+        series = tempseries.TempSeries(1)
+        for i in range(0, tempseries.MINUTE_CAPACITY * 2):
+            series.add(T0 + i * MINUTE, float(i // 60))
+        points = series.series(T0, T0 + 3 * HOUR)
+        self.assertEqual(points,
+                         [ (T0 + h * HOUR, float(h), float(h), float(h), 60)
+                           for h in range(0, 3) ])
+    def test_exact_values(self):
+        series = tempseries.TempSeries(1)
+        series.add(T0, -5.2)
+        series.add(T0 + 5*tempseries.DAY, -5.2)
+        # the oldest reading only left in the rollups
+        for points in (series.series(T0, None),
+                       series.series(T0 + 5*tempseries.DAY, None)):
+            self.assertEqual(points[0][1:4], (-5.2, -5.2, -5.2))
+    def test_dirty_tail(self):
+        series = tempseries.TempSeries(1)
+        for i in range(0, 10):
+            series.add(T0 + i * 30, 1.0)
+        series.tails()
+        self.assertEqual(series.tails(), None)
+        series.add(T0 + 300, 2.0)
+        raw, minutes, hours, days = series.tails()
+        self.assertEqual(list(raw[0]), [ T0 + 300 ])
+        self.assertEqual(list(minutes[0]), [ T0 + 300 ])
+        # the hour and day buckets were updated in place
+        self.assertEqual((list(hours[0]), list(hours[4])), ([ T0 ], [ 11 ]))
+        self.assertEqual(list(days[0]), [ T0 ])
+    def test_empty(self):
+        series = tempseries.TempSeries(1)
+        self.assertEqual(series.series(None, None), [])
+
+class TempSeriesStoreTest (unittest.TestCase):
+    def test_store(self):
+        store = tempseries.TempSeriesStore()
+        store.add(1, T0, 1.0)
+        store.add(2, T0, 2.0)
+        self.assertEqual(store.series(2, None, None),
+                         [ (T0, 2.0, 2.0, 2.0, 1) ])
+        self.assertEqual(store.series(3, None, None), None)
+        store.remove(2)
+        self.assertEqual(store.series(2, None, None), None)
+        self.assertEqual([ s.sensor_id for s in store.values() ], [ 1 ])
+        loaded = tempseries.TempSeriesStore()
+        loaded.load(store.values())
+        self.assertEqual(loaded.series(1, None, None),
+                         [ (T0, 1.0, 1.0, 1.0, 1) ])
+
+class SeriesFileTest (unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirname, "state.series")
+        self.lock = threading.RLock()
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+    def load(self):
+        store = tempseries.TempSeriesStore()
+        tempseries.SeriesFile(self.filename, store, self.lock).load()
+        return store
+    def test_saved_incrementally(self):
+        store = tempseries.TempSeriesStore()
+        series_file = tempseries.SeriesFile(self.filename, store, self.lock)
+        for i in range(0, 2000):
+            store.add(1, T0 + i * 37, (i % 50) / 3.0)
+            store.add(2, T0 + i * 41, -i / 7.0)
+            if i % 100 == 0:
+                series_file.save()
+        series_file.save()
+        size = os.path.getsize(self.filename)
+        store.add(1, T0 + HOUR * 30, 5.0)
+        series_file.save()
+        # only the changed buckets are appended
+        self.assertLess(os.path.getsize(self.filename) - size, 2048)
+        series_file.save()
+        self.assertEqual(dump(self.load()), dump(store))
+    def test_removed(self):
+        store = tempseries.TempSeriesStore()
+        series_file = tempseries.SeriesFile(self.filename, store, self.lock)
+        store.add(1, T0, 1.0)
+        store.add(2, T0, 2.0)
+        series_file.save()
+        store.remove(2)
+        store.add(1, T0 + MINUTE, 1.5)
+        series_file.save()
+        self.assertEqual(sorted(s.sensor_id for s in self.load().values()),
+                         [ 1 ])
+        # a sensor that comes back starts from scratch
+        store.add(2, T0 + HOUR, 3.0)
+        series_file.close()
+        loaded = self.load()
+        self.assertEqual(dump(loaded), dump(store))
+        self.assertEqual(len(loaded.get(2).tiers[0]), 1)
+    def test_torn_write(self):
+        store = tempseries.TempSeriesStore()
+        series_file = tempseries.SeriesFile(self.filename, store, self.lock)
+        store.add(1, T0, 1.0)
+        series_file.close()
+        with open(self.filename, "ab") as f:
+            f.write(b"\0\0\1\0partial")
+        self.assertEqual(dump(self.load()), dump(store))
+    def test_compacted(self):
+        store = tempseries.TempSeriesStore()
+        series_file = tempseries.SeriesFile(self.filename, store, self.lock)
+        sizes = []
+        with mock.patch.object(tempseries, "MIN_COMPACT_SIZE", 0):
+            for i in range(0, 100):
+                store.add(1, T0 + i * MINUTE, 1.0)
+                series_file.save()
+                sizes.append(os.path.getsize(self.filename))
+        # rewritten once the appended changes outgrow what they update
+        self.assertTrue(any(b < a for a, b in zip(sizes, sizes[1:])))
+        self.assertEqual(dump(self.load()), dump(store))
+    def test_single_precision(self):
+        # a file saved when min and max were kept as floats
+        store = tempseries.TempSeriesStore()
+        store.add(1, T0, -5.2)
+        tails = [ [ array('f', a) if i in (1, 2) else a
+                    for i, a in enumerate(tail) ]
+                  for tail in store.get(1).tails() ]
+        persist.write_atomically(self.filename,
+                                 persist.encode_record((1, tails)))
+        loaded = self.load()
+        loaded.add(1, T0 + 1, -5.2)
+        self.assertEqual(loaded.series(1, None, None)[1][1:4],
+                         (-5.2, -5.2, -5.2))
+    def test_legacy(self):
+        # series pickled whole, before the tiers tracked what changed
+        store = tempseries.TempSeriesStore()
+        for i in range(0, 100):
+            store.add(1, T0 + i * 37, float(i))
+        legacy = pickle.loads(pickle.dumps(list(store.values())))
+        for series in legacy:
+            for tier in series.tiers:
+                del tier.dirty
+        loaded = tempseries.TempSeriesStore()
+        loaded.load(legacy)
+        self.assertEqual(dump(loaded), dump(store))
+        loaded.add(1, T0 + HOUR * 2, 1.0)
+
+if __name__ == "__main__":
+    unittest.main()
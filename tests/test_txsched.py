@@ -0,0 +1,108 @@
+#
+# Tests for the transmit scheduler.
+#
+
+import unittest
+
+import txsched
+from txsched import FRAME_AIRTIME, PRIORITY_BULK, PRIORITY_INTERACTIVE
+
+def drain(scheduler, now, until):
+    # (time, payload) for every frame sent, polling as the radio would
+    sent = []
+    while now < until:
+        payload = scheduler.next_packet(now)
+        if payload != None:
+            sent.append((round(now, 6), payload))
+            continue
+        timeout = scheduler.timeout(now)
+        if timeout == None:
+            break
+        now += max(timeout, 0.001)
+    return sent
+
+class TxSchedulerTest (unittest.TestCase):
+    def test_repeats(self):
+        scheduler = txsched.TxScheduler(3, 0.5)
+        scheduler.submit("a", "on", PRIORITY_INTERACTIVE, 0.0)
+        sent = drain(scheduler, 0.0, 10.0)
+        self.assertEqual(sent, [ (0.0, "on"), (0.5, "on"), (1.0, "on") ])
+        self.assertEqual(scheduler.pending(), 0)
+        self.assertEqual(scheduler.timeout(1.0), None)
+        self.assertEqual((scheduler.sent, scheduler.resent), (1, 2))
+    def test_frames_spaced_by_airtime(self):
+        scheduler = txsched.TxScheduler(1, 0.5)
+        for key in ("a", "b", "c"):
+            scheduler.submit(key, key, PRIORITY_INTERACTIVE, 0.0)
+        self.assertEqual(scheduler.next_packet(0.0), "a")
+        self.assertEqual(scheduler.next_packet(0.0), None)
+        self.assertAlmostEqual(scheduler.timeout(0.0), FRAME_AIRTIME)
+        sent = drain(scheduler, 0.0, 10.0)
+        times = [ t for t, payload in sent ]
+        self.assertEqual([ payload for t, payload in sent ], [ "b", "c" ])
+        self.assertAlmostEqual(times[0], FRAME_AIRTIME)
+        self.assertAlmostEqual(times[1] - times[0], FRAME_AIRTIME)
+    def test_repeats_interleaved(self):
+        scheduler = txsched.TxScheduler(2, 0.5)
+        scheduler.submit("a", "a", PRIORITY_INTERACTIVE, 0.0)
+        scheduler.submit("b", "b", PRIORITY_INTERACTIVE, 0.0)
+        sent = [ payload for t, payload in drain(scheduler, 0.0, 10.0) ]
+        self.assertEqual(sent, [ "a", "b", "a", "b" ])
+    def test_superseded(self):
+        scheduler = txsched.TxScheduler(3, 0.5)
+        scheduler.submit("a", "on", PRIORITY_BULK, 0.0)
+        self.assertEqual(scheduler.next_packet(0.0), "on")
+        scheduler.submit("a", "off", PRIORITY_INTERACTIVE, 0.1)
+        sent = [ payload for t, payload in drain(scheduler, 0.1, 10.0) ]
+        self.assertEqual(sent, [ "off", "off", "off" ])
+        self.assertEqual(scheduler.superseded, 1)
+    def test_superseded_keeps_priority(self):
+        scheduler = txsched.TxScheduler(1, 0.5)
+        # use up the bulk budget
+        for i in range(0, 20):
+            scheduler.submit(i, "bulk", PRIORITY_BULK, 0.0)
+        drain(scheduler, 0.0, 0.5)
+        now = 0.5
+        scheduler.submit("a", "on", PRIORITY_INTERACTIVE, now)
+        scheduler.submit("a", "off", PRIORITY_BULK, now)
+        # still goes out ahead of the paced bulk traffic
+        self.assertEqual(scheduler.next_packet(now + FRAME_AIRTIME), "off")
+    def test_interactive_first(self):
+        scheduler = txsched.TxScheduler(1, 0.5)
+        scheduler.submit("bulk", "bulk", PRIORITY_BULK, 0.0)
+        scheduler.submit("interactive", "interactive", PRIORITY_INTERACTIVE,
+                         0.0)
+        sent = [ payload for t, payload in drain(scheduler, 0.0, 10.0) ]
+        self.assertEqual(sent, [ "interactive", "bulk" ])
+    def test_bulk_duty_cycle(self):
+        scheduler = txsched.TxScheduler(1, 0.5)
+        count = 40
+        for i in range(0, count):
+            scheduler.submit(i, i, PRIORITY_BULK, 0.0)
+        sent = drain(scheduler, 0.0, 100.0)
+        self.assertEqual(len(sent), count)
+        gaps = [ b - a for (a, x), (b, y) in zip(sent, sent[1:]) ]
+        # at least a burst goes out back-to-back, then the budget paces
+        # the rest
+        for gap in gaps[:txsched.BULK_BURST - 1]:
+            self.assertAlmostEqual(gap, FRAME_AIRTIME)
+        for gap in gaps[-20:]:
+            self.assertAlmostEqual(gap, txsched.BULK_INTERVAL, places=3)
+        # over a long enough run, bulk stays within its share
+        span = sent[-1][0] - sent[0][0] + FRAME_AIRTIME
+        burst = txsched.BULK_TOLERANCE + txsched.BULK_INTERVAL
+        self.assertLessEqual(count * FRAME_AIRTIME,
+                             txsched.BULK_DUTY_CYCLE * (span + burst))
+    def test_bulk_leaves_room_for_interactive(self):
+        scheduler = txsched.TxScheduler(1, 0.5)
+        for i in range(0, 20):
+            scheduler.submit(i, "bulk", PRIORITY_BULK, 0.0)
+        drain(scheduler, 0.0, 0.5)
+        now = 0.5
+        scheduler.submit("x", "interactive", PRIORITY_INTERACTIVE, now)
+        sent = drain(scheduler, now, now + 1.0)
+        self.assertEqual(sent[0][1], "interactive")
+        self.assertLess(sent[0][0] - now, FRAME_AIRTIME + 0.002)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#
+# Transmit scheduler for the RFXtrx433.
+#
+# Commands are queued per (device_id, unit_id) and sent a number of times
+# each. Repeats of different commands are interleaved, a newer command for
+# the same device replaces one that is still pending, and bulk traffic is
+# held to a share of the airtime so it can't starve interactive commands.
+#
+
+import threading
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Time a single frame keeps the band busy.
+FRAME_AIRTIME = 0.05
+
+# Fraction of the airtime bulk traffic may use, and how many frames it
+# may send back-to-back before the budget kicks in.
+BULK_DUTY_CYCLE = 0.5
+BULK_BURST = 6
+
+BULK_INTERVAL = FRAME_AIRTIME / BULK_DUTY_CYCLE
+BULK_TOLERANCE = (BULK_BURST - 1) * BULK_INTERVAL
+
+class TxEntry:
+    def __init__(self, payload, priority, repeats, due, order):
+        self.payload = payload
+        self.priority = priority
+        self.remaining = repeats
+        self.due = due
+        self.order = order
+
+class TxScheduler:
+    def __init__(self, repeats, repeat_delay):
+        self.repeats = repeats
+        self.repeat_delay = repeat_delay
+        self._entries = {}
+        self._order = 0
+        self._channel_free = 0
+        # theoretical arrival time of the next bulk frame, as in GCRA
+        self._bulk_tat = 0
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.resent = 0
+        self.superseded = 0
+    def submit(self, key, payload, priority, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry != None:
+                # superseded; the old command is dropped in favour of this one
+                priority = min(priority, entry.priority)
+                self.superseded += 1
+            self._order += 1
+            self._entries[key] = TxEntry(payload, priority, self.repeats, now,
+                                         self._order)
+    def pending(self):
+        with self._lock:
+            return len(self._entries)
+    def _bulk_allowed_at(self):
+        return self._bulk_tat - BULK_TOLERANCE
+    def _eligible(self, entry, now):
+        return entry.priority != PRIORITY_BULK or \
+            self._bulk_allowed_at() <= now
+    def next_packet(self, now):
+        with self._lock:
+            if now < self._channel_free:
+                return None
+            best_key = None
+            best = None
+            for key, entry in self._entries.items():
+                if entry.due > now or not self._eligible(entry, now):
+                    continue
+                if best == None or \
+                        (entry.priority, entry.due, entry.order) < \
+                        (best.priority, best.due, best.order):
+                    best_key = key
+                    best = entry
+            if best == None:
+                return None
+            if best.priority == PRIORITY_BULK:
+                self._bulk_tat = max(self._bulk_tat, now) + BULK_INTERVAL
+            if best.remaining < self.repeats:
+                self.resent += 1
+            else:
+                self.sent += 1
+            best.remaining -= 1
+            if best.remaining > 0:
+                best.due = now + self.repeat_delay
+            else:
+                del self._entries[best_key]
+            self._channel_free = now + FRAME_AIRTIME
+            return best.payload
+    def timeout(self, now):
+        with self._lock:
+            if not self._entries:
+                return None
+            wakeup = None
+            for entry in self._entries.values():
+                due = entry.due
+                if entry.priority == PRIORITY_BULK:
+                    due = max(due, self._bulk_allowed_at())
+                if wakeup == None or due < wakeup:
+                    wakeup = due
+            wakeup = max(wakeup, self._channel_free)
+            return max(0, wakeup - now)